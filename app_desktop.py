@@ -1,12 +1,38 @@
 from flask import Flask, render_template_string, request, jsonify, send_file
 import pandas as pd
+import numpy as np
 import sqlite3
 from datetime import datetime
 import os
 from werkzeug.utils import secure_filename
 import json
 import re
+import time
+import hashlib
+import threading
+import uuid
+import base64
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from functools import wraps
 from io import BytesIO
+from itertools import islice, chain
+import pickle
+import inspect
+import marshal
+import csv
+import codecs
+import unicodedata
+import openpyxl
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # Sem pyarrow: snapshots em pickle, CSV pelo engine C do pandas e sem Parquet
+    pa = pacsv = pq = None
 
 # --------------------
 # Configuração
@@ -14,9 +40,39 @@ from io import BytesIO
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
-ALLOWED_EXTENSIONS = {'xls', 'xlsx'}
+app.config['IMPORT_CHUNK_SIZE'] = 5000  # Linhas por lote (executemany) na importação
+app.config['IMPORT_WORKERS'] = 2  # Threads do pool de importação em segundo plano
+app.config['PARSE_PROCESSES'] = max((os.cpu_count() or 2) - 1, 1)  # Processos para ler abas em paralelo
+app.config['IMPORT_JOBS_HISTORY'] = 50  # Jobs finalizados mantidos em memória para consulta
+app.config['SYNC_KEY_COLUMNS'] = ['numero_cotacao', 'numero_circuito']  # Chave de negócio do modo sincronizar
+app.config['IMPORT_STREAMING'] = True  # Lê .xlsx em blocos (openpyxl read-only) em vez de carregar a planilha inteira
+app.config['SNAPSHOT_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'snapshots')
+app.config['UPLOAD_CACHE_MAX_MB'] = 500  # Limite da pasta uploads (arquivos + snapshots), com descarte LRU
+app.config['BULK_BATCH_SIZE'] = 20000  # Registros por transação na API /api/ordens/bulk
+app.config['CONSULTA_PAGINA_PADRAO'] = 100  # Linhas por página em /api/consultar
+app.config['CONSULTA_PAGINA_MAX'] = 1000
+app.config['CONTAGEM_TEMPO_MAX'] = 0.5  # Segundos para a contagem exata antes de cair na estimativa
+app.config['CONTAGEM_AMOSTRA'] = 50000  # Ids mais recentes usados como amostra na contagem estimada
+app.config['CONTAGEM_CACHE_ITENS'] = 256
+app.config['DB_POOL_SIZE'] = 8  # Conexões de leitura ociosas mantidas abertas para reuso
+app.config['DB_CACHE_SIZE_KB'] = 32 * 1024  # PRAGMA cache_size por conexão
+app.config['DB_MMAP_SIZE'] = 256 * 1024 * 1024  # PRAGMA mmap_size (0 desliga o I/O mapeado)
+app.config['DB_SYNCHRONOUS'] = 'NORMAL'  # Com WAL, NORMAL só arrisca a última transação em queda de energia
+app.config['DB_TEMP_STORE'] = 'MEMORY'  # Ordenações e tabelas temporárias em memória
+app.config['DB_BUSY_TIMEOUT_MS'] = 5000
+app.config['CONSULTA_LENTA_MS'] = 100  # Consultas a partir desse tempo (execução + leitura) entram no log de lentas
+app.config['CONSULTAS_LENTAS_MAX'] = 200  # Tamanho do buffer circular do log de consultas lentas
+app.config['MANUTENCAO_INTERVALO_S'] = 6 * 3600  # Manutenção periódica do banco (ANALYZE, optimize, checkpoint, vácuo)
+app.config['FILTROS_VALORES_MAX'] = 500  # Valores por campo no catálogo de /api/filtros (os mais frequentes)
+app.config['RELATORIO_GRUPOS_MAX'] = 5000  # Linhas (grupos) devolvidas por /api/relatorios
+app.config['RESPOSTAS_CACHE_MB'] = 64  # Memória máxima do cache de respostas das rotas de leitura (LRU)
+app.config['MANUTENCAO_LINHAS'] = 50000  # Importações/remoções a partir disso disparam a manutenção na sequência
+app.config['MANUTENCAO_VACUO_PAGINAS'] = 25000  # Páginas livres devolvidas ao disco por execução (vácuo incremental)
+ALLOWED_EXTENSIONS = {'xls', 'xlsx', 'csv', 'parquet', 'ndjson', 'jsonl'}
+EXCEL_EXTENSIONS = {'xls', 'xlsx'}
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SNAPSHOT_FOLDER'], exist_ok=True)
 
 # --------------------
 # HTML e CSS (Tailwind CSS via CDN para um design moderno)
@@ -101,6 +157,37 @@ HTML_TEMPLATE = """
 
             <!-- Dashboard Page -->
             <div id="dashboard" class="page active">
+                <!-- Filtros do Dashboard (período, faixa de valor e status) -->
+                <section class="bg-white p-6 rounded-xl shadow-lg mb-8">
+                    <div class="grid grid-cols-1 md:grid-cols-6 gap-4">
+                        <div>
+                            <label for="dashboardDataInicio" class="block text-sm font-medium text-gray-700">Criado a partir de</label>
+                            <input type="date" id="dashboardDataInicio" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="dashboardDataFim" class="block text-sm font-medium text-gray-700">Criado até</label>
+                            <input type="date" id="dashboardDataFim" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="dashboardValorMin" class="block text-sm font-medium text-gray-700">Valor mínimo (R$)</label>
+                            <input type="number" id="dashboardValorMin" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="dashboardValorMax" class="block text-sm font-medium text-gray-700">Valor máximo (R$)</label>
+                            <input type="number" id="dashboardValorMax" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="dashboardStatusFilter" class="block text-sm font-medium text-gray-700">Status da OS</label>
+                            <select id="dashboardStatusFilter" multiple size="3" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white">
+                                <!-- Opções serão carregadas via JS -->
+                            </select>
+                        </div>
+                        <div class="flex items-end">
+                            <button class="w-full bg-blue-600 text-white p-2 rounded-md hover:bg-blue-700 transition duration-150 font-semibold" onclick="loadDashboard()">Aplicar</button>
+                        </div>
+                    </div>
+                </section>
+
                 <section class="grid grid-cols-1 md:grid-cols-3 lg:grid-cols-5 gap-6 mb-8" id="metrics">
                     <!-- Cards de Métricas serão injetados aqui -->
                 </section>
@@ -117,7 +204,15 @@ HTML_TEMPLATE = """
                 </section>
 
                 <section class="bg-white p-6 rounded-xl shadow-lg mb-8">
-                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Timeline de Criação das Ordens (Mensal)</h3>
+                    <div class="flex justify-between items-center mb-4">
+                        <h3 class="text-xl font-semibold text-gray-700">Timeline de Criação das Ordens</h3>
+                        <select id="timelineGranularidade" onchange="loadTimeline()" class="rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white text-sm">
+                            <option value="dia">Diária</option>
+                            <option value="semana">Semanal</option>
+                            <option value="mes" selected>Mensal</option>
+                            <option value="trimestre">Trimestral</option>
+                        </select>
+                    </div>
                     <canvas id="timelineChart"></canvas>
                 </section>
 
@@ -147,9 +242,8 @@ HTML_TEMPLATE = """
                         </div>
                         <div>
                             <label for="statusFilter" class="block text-sm font-medium text-gray-700">Status da OS</label>
-                            <select id="statusFilter" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white">
-                                <option value="">Todos os Status</option>
-                                <!-- Opções serão carregadas via JS -->
+                            <select id="statusFilter" multiple size="3" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white">
+                                <!-- Opções serão carregadas via JS (nenhum selecionado = todos) -->
                             </select>
                         </div>
                         <div>
@@ -168,6 +262,34 @@ HTML_TEMPLATE = """
                             </button>
                         </div>
                     </div>
+                    <div class="grid grid-cols-1 md:grid-cols-6 gap-4 mt-4">
+                        <div>
+                            <label for="produtoFilter" class="block text-sm font-medium text-gray-700">Produto</label>
+                            <input type="text" id="produtoFilter" list="produtoSugestoes" placeholder="Todos" autocomplete="off" oninput="sugerirValores('produto')" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                            <datalist id="produtoSugestoes"></datalist>
+                        </div>
+                        <div>
+                            <label for="clienteFilter" class="block text-sm font-medium text-gray-700">Cliente</label>
+                            <input type="text" id="clienteFilter" list="clienteSugestoes" placeholder="Todos" autocomplete="off" oninput="sugerirValores('cliente')" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                            <datalist id="clienteSugestoes"></datalist>
+                        </div>
+                        <div>
+                            <label for="consultaDataInicio" class="block text-sm font-medium text-gray-700">Criado a partir de</label>
+                            <input type="date" id="consultaDataInicio" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="consultaDataFim" class="block text-sm font-medium text-gray-700">Criado até</label>
+                            <input type="date" id="consultaDataFim" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="consultaValorMin" class="block text-sm font-medium text-gray-700">Valor mínimo (R$)</label>
+                            <input type="number" id="consultaValorMin" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="consultaValorMax" class="block text-sm font-medium text-gray-700">Valor máximo (R$)</label>
+                            <input type="number" id="consultaValorMax" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                    </div>
                 </div>
 
                 <!-- Resultados da Consulta -->
@@ -191,6 +313,9 @@ HTML_TEMPLATE = """
                             </tbody>
                         </table>
                     </div>
+                    <div class="mt-4 text-center">
+                        <button id="carregarMaisBtn" class="hidden bg-gray-100 text-gray-700 px-4 py-2 rounded-md hover:bg-gray-200 transition duration-150 font-semibold" onclick="carregarPagina()">Carregar mais</button>
+                    </div>
                 </div>
             </div>
             
@@ -200,28 +325,39 @@ HTML_TEMPLATE = """
                 
                 <div class="bg-blue-50 border-l-4 border-blue-400 text-blue-700 p-4 mb-6" role="alert">
                     <p class="font-bold">Instruções Importantes:</p>
-                    <p class="text-sm">1. Faça upload da planilha <code>CARGA_PAINEL.xlsx</code> atualizada.<br>2. Escolha entre **Substituir** (apaga tudo e insere o novo) ou **Adicionar** (mantém o existente e insere o novo).</p>
+                    <p class="text-sm">1. Faça upload da planilha <code>CARGA_PAINEL.xlsx</code> atualizada.<br>2. Escolha entre **Substituir** (apaga tudo e insere o novo), **Adicionar** (mantém o existente e insere o novo) ou **Sincronizar** (atualiza pela cotação/circuito apenas as linhas novas ou alteradas).</p>
                 </div>
                 
                 <div class="bg-white p-6 rounded-xl shadow-lg">
-                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Selecione a planilha (.xlsx ou .xls)</h3>
-                    <input type="file" id="fileInput" accept=".xlsx,.xls" class="block w-full text-sm text-gray-500 file:mr-4 file:py-2 file:px-4 file:rounded-full file:border-0 file:text-sm file:font-semibold file:bg-blue-50 file:text-blue-700 hover:file:bg-blue-100">
+                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Selecione a planilha (.xlsx ou .xls) ou exportação (.csv, .parquet, .ndjson)</h3>
+                    <input type="file" id="fileInput" accept=".xlsx,.xls,.csv,.parquet,.ndjson,.jsonl" multiple class="block w-full text-sm text-gray-500 file:mr-4 file:py-2 file:px-4 file:rounded-full file:border-0 file:text-sm file:font-semibold file:bg-blue-50 file:text-blue-700 hover:file:bg-blue-100">
+                    <label class="mt-4 flex items-center space-x-2 text-sm text-gray-700">
+                        <input type="checkbox" id="todasAbas" class="rounded border-gray-300">
+                        <span>Importar todas as abas de cada planilha (ex.: uma aba por regional)</span>
+                    </label>
                     
                     <div class="mt-6 flex space-x-4">
-                        <button class="btn-upload bg-red-600 text-white p-3 rounded-lg hover:bg-red-700 transition duration-150 font-semibold flex-1" onclick="uploadFile(true)">
+                        <button class="btn-upload bg-red-600 text-white p-3 rounded-lg hover:bg-red-700 transition duration-150 font-semibold flex-1" onclick="uploadFile('substituir')">
                             <svg class="w-5 h-5 inline-block mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16"></path></svg>
                             Substituir Dados Existentes
                         </button>
-                        <button class="btn-upload bg-green-600 text-white p-3 rounded-lg hover:bg-green-700 transition duration-150 font-semibold flex-1" onclick="uploadFile(false)">
+                        <button class="btn-upload bg-green-600 text-white p-3 rounded-lg hover:bg-green-700 transition duration-150 font-semibold flex-1" onclick="uploadFile('adicionar')">
                             <svg class="w-5 h-5 inline-block mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M12 6v6m0 0v6m0-6h6m-6 0H6"></path></svg>
                             Adicionar aos Dados Existentes
                         </button>
+                        <button class="btn-upload bg-blue-600 text-white p-3 rounded-lg hover:bg-blue-700 transition duration-150 font-semibold flex-1" onclick="uploadFile('sincronizar')">
+                            <svg class="w-5 h-5 inline-block mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 4v5h.582m15.356 2A8.001 8.001 0 004.582 9m0 0H9m11 11v-5h-.581m0 0a8.003 8.003 0 01-15.357-2m15.357 2H15"></path></svg>
+                            Sincronizar Alterações
+                        </button>
                     </div>
                     
                     <div id="uploadAlert" class="mt-6"></div>
                     <div class="loading hidden text-center mt-6" id="uploadLoading">
                         <div class="animate-spin rounded-full h-10 w-10 border-b-2 border-blue-600 mx-auto"></div>
-                        <p class="text-gray-500 mt-2">Processando, aguarde...</p>
+                        <p class="text-gray-500 mt-2" id="uploadProgressText">Processando, aguarde...</p>
+                        <div class="w-full bg-gray-200 rounded-full h-2 mt-3">
+                            <div id="uploadProgressBar" class="bg-blue-600 h-2 rounded-full transition-all duration-300" style="width: 0%"></div>
+                        </div>
                     </div>
                 </div>
             </div>
@@ -230,21 +366,59 @@ HTML_TEMPLATE = """
             <div id="relatorios" class="page">
                 <h2 class="text-2xl font-bold text-gray-800 mb-6">Relatórios Gerenciais</h2>
                 
+                <!-- Filtros e agrupamento do relatório (agregado no banco) -->
+                <section class="bg-white p-6 rounded-xl shadow-lg mb-8">
+                    <div class="grid grid-cols-1 md:grid-cols-7 gap-4">
+                        <div>
+                            <label for="relatoriosDataInicio" class="block text-sm font-medium text-gray-700">Criado a partir de</label>
+                            <input type="date" id="relatoriosDataInicio" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="relatoriosDataFim" class="block text-sm font-medium text-gray-700">Criado até</label>
+                            <input type="date" id="relatoriosDataFim" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="relatoriosValorMin" class="block text-sm font-medium text-gray-700">Valor mínimo (R$)</label>
+                            <input type="number" id="relatoriosValorMin" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="relatoriosValorMax" class="block text-sm font-medium text-gray-700">Valor máximo (R$)</label>
+                            <input type="number" id="relatoriosValorMax" min="0" step="0.01" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border">
+                        </div>
+                        <div>
+                            <label for="relatoriosStatusFilter" class="block text-sm font-medium text-gray-700">Status da OS</label>
+                            <select id="relatoriosStatusFilter" multiple size="3" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white">
+                                <!-- Opções serão carregadas via JS -->
+                            </select>
+                        </div>
+                        <div>
+                            <label for="relatoriosAgrupar" class="block text-sm font-medium text-gray-700">Agrupar por</label>
+                            <select id="relatoriosAgrupar" multiple size="3" class="mt-1 block w-full rounded-md border-gray-300 shadow-sm focus:border-blue-500 focus:ring-blue-500 p-2 border bg-white">
+                                <option value="status" selected>Status OS</option>
+                                <option value="status_cotacao" selected>Status Cotação</option>
+                                <option value="produto">Produto</option>
+                                <option value="cliente">Cliente</option>
+                                <option value="mes">Mês de criação</option>
+                            </select>
+                        </div>
+                        <div class="flex items-end">
+                            <button class="w-full bg-blue-600 text-white p-2 rounded-md hover:bg-blue-700 transition duration-150 font-semibold" onclick="loadRelatorios()">Aplicar</button>
+                        </div>
+                    </div>
+                </section>
+
                 <section class="grid grid-cols-1 md:grid-cols-3 gap-6 mb-8" id="relatoriosMetrics">
                     <!-- Cards de Métricas serão injetados aqui -->
                 </section>
                 
                 <div class="bg-white p-6 rounded-xl shadow-lg">
-                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Performance Detalhada por Status</h3>
+                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Performance Detalhada</h3>
+                    <p id="relatoriosAviso" class="text-sm text-yellow-700 mb-2"></p>
                     <div class="table-auto-scroll">
                         <table class="min-w-full divide-y divide-gray-200">
                             <thead class="bg-gray-50">
-                                <tr>
-                                    <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Status OS</th>
-                                    <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Status Cotação</th>
-                                    <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Quantidade</th>
-                                    <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Total (R$)</th>
-                                    <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Ticket Médio (R$)</th>
+                                <tr id="performanceHead">
+                                    <!-- Colunas do agrupamento + Quantidade, Total e Ticket Médio -->
                                 </tr>
                             </thead>
                             <tbody id="performanceBody" class="bg-white divide-y divide-gray-200">
@@ -269,6 +443,28 @@ HTML_TEMPLATE = """
                     <div id="colunasEsperadas" class="bg-gray-50 p-4 rounded-lg text-sm font-mono text-gray-700"></div>
                 </div>
                 
+                <div class="bg-white p-6 rounded-xl shadow-lg mb-6">
+                    <h3 class="text-xl font-semibold text-gray-700 mb-4">Histórico de Cargas</h3>
+                    <p class="text-sm text-gray-500 mb-3">Cada importação é uma carga. Desfazer remove apenas as linhas inseridas por ela.</p>
+                    <div class="table-auto-scroll">
+                        <table class="min-w-full divide-y divide-gray-200">
+                            <thead class="bg-gray-50">
+                                <tr>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Carga</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Início</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Origem / Modo</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Arquivo</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Status</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Inseridas / Atualizadas</th>
+                                    <th class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">Linhas Atuais</th>
+                                    <th class="px-4 py-2"></th>
+                                </tr>
+                            </thead>
+                            <tbody id="cargasBody" class="bg-white divide-y divide-gray-200"></tbody>
+                        </table>
+                    </div>
+                </div>
+
                 <div class="bg-red-50 border-l-4 border-red-400 text-red-700 p-4 mb-6" role="alert">
                     <h3 class="text-xl font-semibold text-red-800 mb-4">Limpeza de Dados</h3>
                     <p class="text-sm mb-4"><strong>ATENÇÃO:</strong> Esta ação é **irreversível** e apagará todos os registros do banco de dados.</p>
@@ -322,7 +518,10 @@ HTML_TEMPLATE = """
             document.getElementById(pageName).classList.add('active');
             
             // Carregar dados específicos da página
-            if (pageName === 'dashboard') loadDashboard();
+            if (pageName === 'dashboard') {
+                loadFilterOptions();
+                loadDashboard();
+            }
             else if (pageName === 'consulta') {
                 loadFilterOptions();
                 buscarDados();
@@ -335,30 +534,116 @@ HTML_TEMPLATE = """
             fetch('/api/filtros')
                 .then(r => r.json())
                 .then(data => {
-                    const statusSelect = document.getElementById('statusFilter');
-                    const cotacaoSelect = document.getElementById('cotacaoFilter');
-                    
-                    // Limpar e adicionar opção padrão
-                    statusSelect.innerHTML = '<option value="">Todos os Status</option>';
-                    cotacaoSelect.innerHTML = '<option value="">Todos os Status</option>';
-                    
-                    data.status.forEach(s => {
-                        statusSelect.innerHTML += `<option value="${s}">${s}</option>`;
+                    // Seleções múltiplas de status mantêm o que já estava marcado
+                    ['statusFilter', 'dashboardStatusFilter', 'relatoriosStatusFilter'].forEach(id => {
+                        preencherOpcoes(document.getElementById(id), data.status);
                     });
-                    data.status_cotacao.forEach(s => {
-                        cotacaoSelect.innerHTML += `<option value="${s}">${s}</option>`;
+                    preencherOpcoes(document.getElementById('cotacaoFilter'), data.status_cotacao, 'Todos os Status');
+                    // Produto e cliente: os mais frequentes já de início; o restante vem pela busca por prefixo
+                    preencherSugestoes('produto', data.produto);
+                    preencherSugestoes('cliente', data.cliente);
+                });
+        }
+
+        function preencherOpcoes(select, itens, opcaoPadrao) {
+            // Opções montadas em um fragmento fora do documento e trocadas de uma vez: custo proporcional
+            // ao número de valores, sem reanalisar o HTML do select a cada opção
+            const marcados = new Set(Array.from(select.selectedOptions).map(o => o.value));
+            const fragmento = document.createDocumentFragment();
+            if (opcaoPadrao) fragmento.appendChild(new Option(opcaoPadrao, ''));
+            itens.forEach(item => {
+                const marcado = marcados.has(item.valor);
+                fragmento.appendChild(new Option(`${item.valor} (${item.quantidade})`, item.valor, marcado, marcado));
+            });
+            select.replaceChildren(fragmento);
+        }
+
+        function preencherSugestoes(campo, itens) {
+            const fragmento = document.createDocumentFragment();
+            itens.forEach(item => {
+                const opcao = document.createElement('option');
+                opcao.value = item.valor;
+                opcao.label = `${item.quantidade} ordens`;
+                fragmento.appendChild(opcao);
+            });
+            document.getElementById(campo + 'Sugestoes').replaceChildren(fragmento);
+        }
+
+        let sugestaoTimer = null;
+        function sugerirValores(campo) {
+            // Busca por prefixo no catálogo a cada digitação, com uma pausa curta entre teclas
+            clearTimeout(sugestaoTimer);
+            sugestaoTimer = setTimeout(() => {
+                const prefixo = document.getElementById(campo + 'Filter').value;
+                fetch(`/api/filtros?campo=${campo}&limite=20&prefixo=${encodeURIComponent(prefixo)}`)
+                    .then(r => r.json())
+                    .then(data => preencherSugestoes(campo, data.valores || []));
+            }, 200);
+        }
+
+        function loadTimeline() {
+            const params = adicionarFiltrosIntervalo(new URLSearchParams(), 'dashboard');
+            params.append('granularidade', document.getElementById('timelineGranularidade').value);
+            fetch('/api/timeline?' + params.toString())
+                .then(r => r.json())
+                .then(data => {
+                    if (data.success === false) return;
+                    if (timelineChart) timelineChart.destroy();
+                    const ctxTimeline = document.getElementById('timelineChart').getContext('2d');
+                    timelineChart = new Chart(ctxTimeline, {
+                        type: 'line',
+                        data: {
+                            labels: data.labels,
+                            datasets: [{
+                                label: 'Ordens Criadas',
+                                data: data.values,
+                                borderColor: '#3b82f6',
+                                backgroundColor: 'rgba(59, 130, 246, 0.2)',
+                                tension: 0.4,
+                                fill: true
+                            }]
+                        },
+                        options: {
+                            responsive: true,
+                            scales: {
+                                y: { beginAtZero: true }
+                            },
+                            plugins: {
+                                legend: { position: 'top' }
+                            }
+                        }
                     });
                 });
         }
 
+        function valoresSelecionados(select) {
+            return Array.from(select.selectedOptions).map(o => o.value).filter(v => v);
+        }
+
+        function adicionarFiltrosIntervalo(params, prefixo) {
+            // Período de criação, faixa de valor e status (seleção múltipla, um parâmetro por valor)
+            const campos = { DataInicio: 'data_inicio', DataFim: 'data_fim', ValorMin: 'valor_min', ValorMax: 'valor_max' };
+            Object.entries(campos).forEach(([sufixo, nome]) => {
+                const valor = document.getElementById(prefixo + sufixo).value;
+                if (valor) params.append(nome, valor);
+            });
+            const statusId = prefixo === 'consulta' ? 'statusFilter' : prefixo + 'StatusFilter';
+            valoresSelecionados(document.getElementById(statusId)).forEach(s => params.append('status', s));
+            return params;
+        }
+
         function loadDashboard() {
-            if (statusChart) statusChart.destroy();
-            if (cotacaoChart) cotacaoChart.destroy();
-            if (timelineChart) timelineChart.destroy();
-            
-            fetch('/api/dashboard')
+            const params = adicionarFiltrosIntervalo(new URLSearchParams(), 'dashboard');
+            fetch('/api/dashboard?' + params.toString())
                 .then(r => r.json())
                 .then(data => {
+                    if (data.success === false) {
+                        alert(data.message);
+                        return;
+                    }
+                    if (statusChart) statusChart.destroy();
+                    if (cotacaoChart) cotacaoChart.destroy();
+
                     // 1. Métricas
                     const metrics = [
                         { title: 'Total de Ordens', value: data.metricas.total, icon: '<svg class="w-6 h-6 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 5H7a2 2 0 00-2 2v12a2 2 0 002 2h10a2 2 0 002-2V7a2 2 0 00-2-2h-2M9 5a2 2 0 002 2h2a2 2 0 002-2m-3 7h3m-3 4h3m-6-4h.01M9 16h.01"></path></svg>' },
@@ -435,31 +720,8 @@ HTML_TEMPLATE = """
                         }
                     });
                     
-                    // 4. Gráfico de Timeline
-                    const ctxTimeline = document.getElementById('timelineChart').getContext('2d');
-                    timelineChart = new Chart(ctxTimeline, {
-                        type: 'line',
-                        data: {
-                            labels: data.timeline_chart.labels,
-                            datasets: [{
-                                label: 'Ordens Criadas',
-                                data: data.timeline_chart.values,
-                                borderColor: '#3b82f6',
-                                backgroundColor: 'rgba(59, 130, 246, 0.2)',
-                                tension: 0.4,
-                                fill: true
-                            }]
-                        },
-                        options: {
-                            responsive: true,
-                            scales: {
-                                y: { beginAtZero: true }
-                            },
-                            plugins: {
-                                legend: { position: 'top' }
-                            }
-                        }
-                    });
+                    // 4. Gráfico de Timeline (granularidade escolhida, servida pelo rollup diário)
+                    loadTimeline();
                     
                     // 5. Top Clientes
                     let htmlClientes = data.top_clientes.map(c => `
@@ -481,72 +743,163 @@ HTML_TEMPLATE = """
                 });
         }
         
-        function uploadFile(atualizar) {
+        function uploadFile(modo) {
             const fileInput = document.getElementById('fileInput');
-            const file = fileInput.files[0];
+            const files = Array.from(fileInput.files);
             
-            if (!file) {
+            if (!files.length) {
                 alert('Selecione um arquivo!');
                 return;
             }
             
             const formData = new FormData();
-            formData.append('file', file);
-            formData.append('atualizar', atualizar);
+            files.forEach(file => formData.append('file', file));
+            formData.append('modo', modo);
+            formData.append('todas_abas', document.getElementById('todasAbas').checked);
             
             document.getElementById('uploadLoading').classList.remove('hidden');
             document.getElementById('uploadAlert').innerHTML = '';
             document.querySelectorAll('.btn-upload').forEach(btn => btn.disabled = true);
             
+            document.getElementById('uploadProgressText').textContent = 'Enviando arquivo...';
+            document.getElementById('uploadProgressBar').style.width = '0%';
+
+            const finalizarUpload = (success, message) => {
+                document.getElementById('uploadLoading').classList.add('hidden');
+                document.querySelectorAll('.btn-upload').forEach(btn => btn.disabled = false);
+
+                const alertClass = success ? 'bg-green-100 border-green-500 text-green-700' : 'bg-red-100 border-red-500 text-red-700';
+                document.getElementById('uploadAlert').innerHTML = `
+                    <div class="border-l-4 p-4 ${alertClass}" role="alert">
+                        <p class="font-bold">${success ? 'Sucesso!' : 'Erro!'}</p>
+                        <p>${message}</p>
+                    </div>
+                `;
+
+                if (success) {
+                    fileInput.value = '';
+                    setTimeout(() => {
+                        showPage('dashboard', document.querySelector('.nav-btn')); // Volta para o dashboard
+                    }, 2000);
+                }
+            };
+
+            const erroConexao = (error) => {
+                document.getElementById('uploadLoading').classList.add('hidden');
+                document.querySelectorAll('.btn-upload').forEach(btn => btn.disabled = false);
+                document.getElementById('uploadAlert').innerHTML = `
+                    <div class="border-l-4 p-4 bg-red-100 border-red-500 text-red-700" role="alert">
+                        <p class="font-bold">Erro de Conexão!</p>
+                        <p>Não foi possível comunicar com o servidor: ${error.message}</p>
+                    </div>
+                `;
+            };
+
+            // Consulta o andamento do job até ele terminar
+            const acompanharJob = (jobId) => {
+                fetch('/api/jobs/' + jobId)
+                    .then(r => r.json())
+                    .then(job => {
+                        if (job.fase === 'concluido') {
+                            document.getElementById('uploadProgressBar').style.width = '100%';
+                            const abas = (job.resultado.abas || []).map(a =>
+                                `<li>${a.arquivo} / ${a.aba}: ${a.ignorada ? 'ignorada (sem colunas reconhecidas)' : `${a.linhas} linhas`}${a.cache ? ' (cache)' : ` em ${a.tempo_leitura_segundos}s`}</li>`
+                            ).join('');
+                            finalizarUpload(true, job.resultado.message + (abas ? `<ul class="list-disc ml-6 mt-2 text-sm">${abas}</ul>` : ''));
+                            return;
+                        }
+                        if (job.fase === 'erro' || job.success === false) {
+                            finalizarUpload(false, job.erro || job.message);
+                            return;
+                        }
+
+                        const fases = {
+                            'na_fila': 'Na fila...',
+                            'preparando': 'Abrindo planilha...',
+                            'lendo_abas': 'Lendo abas em paralelo...',
+                            'aguardando_escrita': 'Aguardando outra importação terminar...',
+                            'importando': 'Importando'
+                        };
+                        let texto = fases[job.fase] || job.fase;
+                        if (job.fase === 'importando') {
+                            texto += `: ${job.linhas_processadas}` + (job.total_estimado ? ` de ~${job.total_estimado}` : '') + ' linhas';
+                            texto += ` (${Math.round(job.linhas_por_segundo)} linhas/s`;
+                            texto += job.eta_segundos !== null ? `, ~${Math.ceil(job.eta_segundos)}s restantes)` : ')';
+                        }
+                        document.getElementById('uploadProgressText').textContent = texto;
+                        if (job.percentual !== null) {
+                            document.getElementById('uploadProgressBar').style.width = `${job.percentual}%`;
+                        }
+                        setTimeout(() => acompanharJob(jobId), 1000);
+                    })
+                    .catch(erroConexao);
+            };
+
             fetch('/api/upload', { method: 'POST', body: formData })
                 .then(r => r.json())
                 .then(data => {
-                    document.getElementById('uploadLoading').classList.add('hidden');
-                    document.querySelectorAll('.btn-upload').forEach(btn => btn.disabled = false);
-                    
-                    const alertClass = data.success ? 'bg-green-100 border-green-500 text-green-700' : 'bg-red-100 border-red-500 text-red-700';
-                    document.getElementById('uploadAlert').innerHTML = `
-                        <div class="border-l-4 p-4 ${alertClass}" role="alert">
-                            <p class="font-bold">${data.success ? 'Sucesso!' : 'Erro!'}</p>
-                            <p>${data.message}</p>
-                        </div>
-                    `;
-                    
-                    if (data.success) {
-                        fileInput.value = '';
-                        setTimeout(() => {
-                            showPage('dashboard', document.querySelector('.nav-btn')); // Volta para o dashboard
-                        }, 2000);
+                    if (!data.success) {
+                        finalizarUpload(false, data.message);
+                        return;
                     }
+                    document.getElementById('uploadProgressText').textContent = 'Na fila...';
+                    acompanharJob(data.job_id);
                 })
-                .catch(error => {
-                    document.getElementById('uploadLoading').classList.add('hidden');
-                    document.querySelectorAll('.btn-upload').forEach(btn => btn.disabled = false);
-                    document.getElementById('uploadAlert').innerHTML = `
-                        <div class="border-l-4 p-4 bg-red-100 border-red-500 text-red-700" role="alert">
-                            <p class="font-bold">Erro de Conexão!</p>
-                            <p>Não foi possível comunicar com o servidor: ${error.message}</p>
-                        </div>
-                    `;
-                });
+                .catch(erroConexao);
         }
         
-        function buscarDados() {
+        const CAMPOS_TABELA_CONSULTA = ['id', 'descricao_operacao', 'status', 'status_cotacao', 'denominacao_produto', 'nome_emissor_ordem', 'valor_pedido_bruto'];
+        let consultaParams = new URLSearchParams();
+        let consultaCursor = null;
+
+        function parametrosConsulta() {
             const busca = document.getElementById('searchInput').value;
-            const status = document.getElementById('statusFilter').value;
             const cotacao = document.getElementById('cotacaoFilter').value;
+            const produto = document.getElementById('produtoFilter').value.trim();
+            const cliente = document.getElementById('clienteFilter').value.trim();
             
             const params = new URLSearchParams();
             if (busca) params.append('busca', busca);
-            if (status) params.append('status', status);
             if (cotacao) params.append('status_cotacao', cotacao);
+            if (produto) params.append('produto', produto);
+            if (cliente) params.append('cliente', cliente);
+            return adicionarFiltrosIntervalo(params, 'consulta');
+        }
+
+        function buscarDados() {
+            // Nova consulta: a contagem vem em paralelo e as páginas seguem pelo cursor
+            consultaParams = parametrosConsulta();
+            consultaCursor = null;
+            document.getElementById('resultadosTitle').textContent = 'Resultados: contando...';
+            document.getElementById('resultadosBody').innerHTML = '';
+
+            fetch('/api/consultar/contagem?' + consultaParams.toString())
+                .then(r => r.json())
+                .then(data => {
+                    if (data.success === false) {
+                        document.getElementById('resultadosTitle').textContent = data.message;
+                        return;
+                    }
+                    const total = data.total.toLocaleString('pt-BR');
+                    document.getElementById('resultadosTitle').textContent = `Resultados: ${data.exato ? '' : '~'}${total} registros`;
+                });
+            carregarPagina();
+        }
+
+        function carregarPagina() {
+            const params = new URLSearchParams(consultaParams);
+            const primeiraPagina = !consultaCursor;
+            if (consultaCursor) params.append('cursor', consultaCursor);
+            // Só as colunas exibidas na tabela, no formato colunas + linhas
+            params.append('fields', CAMPOS_TABELA_CONSULTA.join(','));
+            params.append('formato', 'tabela');
             
             fetch('/api/consultar?' + params.toString())
                 .then(r => r.json())
                 .then(data => {
-                    document.getElementById('resultadosTitle').textContent = `Resultados: ${data.total} registros (Limitado a 1000)`;
-                    
-                    let html = data.resultados.map(r => {
+                    if (data.success === false) return;
+                    let html = data.linhas.map(linha => {
+                        const r = Object.fromEntries(data.colunas.map((c, i) => [c, linha[i]]));
                         const statusClass = getStatusColor(r.status || 'Sem Status');
                         return `
                             <tr class="hover:bg-gray-50">
@@ -565,32 +918,41 @@ HTML_TEMPLATE = """
                         `;
                     }).join('');
                     
-                    document.getElementById('resultadosBody').innerHTML = html || `
-                        <tr>
-                            <td colspan="7" class="px-6 py-4 text-center text-gray-500">Nenhum registro encontrado com os filtros aplicados.</td>
-                        </tr>
-                    `;
+                    const body = document.getElementById('resultadosBody');
+                    if (primeiraPagina && !html) {
+                        body.innerHTML = `
+                            <tr>
+                                <td colspan="7" class="px-6 py-4 text-center text-gray-500">Nenhum registro encontrado com os filtros aplicados.</td>
+                            </tr>
+                        `;
+                    } else {
+                        body.insertAdjacentHTML('beforeend', html);
+                    }
+                    consultaCursor = data.proximo_cursor;
+                    document.getElementById('carregarMaisBtn').classList.toggle('hidden', !consultaCursor);
                 });
         }
         
         function exportarDados() {
-            const busca = document.getElementById('searchInput').value;
-            const status = document.getElementById('statusFilter').value;
-            const cotacao = document.getElementById('cotacaoFilter').value;
-            
-            const params = new URLSearchParams();
-            if (busca) params.append('busca', busca);
-            if (status) params.append('status', status);
-            if (cotacao) params.append('status_cotacao', cotacao);
+            const params = parametrosConsulta();
             
             // Redireciona para a rota de exportação com os parâmetros de filtro
             window.location.href = '/api/exportar?' + params.toString();
         }
         
+        const ROTULOS_AGRUPAMENTO = { status: 'Status OS', status_cotacao: 'Status Cotação', produto: 'Produto', cliente: 'Cliente', mes: 'Mês' };
+
         function loadRelatorios() {
-            fetch('/api/relatorios')
+            const params = adicionarFiltrosIntervalo(new URLSearchParams(), 'relatorios');
+            const agrupar = valoresSelecionados(document.getElementById('relatoriosAgrupar'));
+            if (agrupar.length) params.append('agrupar', agrupar.join(','));
+            fetch('/api/relatorios?' + params.toString())
                 .then(r => r.json())
                 .then(data => {
+                    if (data.success === false) {
+                        alert('Erro no relatório: ' + data.message);
+                        return;
+                    }
                     // Métricas
                     const metrics = [
                         { title: 'Ordens no Período', value: data.metricas.total, icon: '<svg class="w-6 h-6 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 19v-6a2 2 0 00-2-2H5a2 2 0 00-2 2v6a2 2 0 002 2h2a2 2 0 002-2zm0 0V9a2 2 0 012-2h2a2 2 0 012 2v10m-6 0a2 2 0 002 2h2a2 2 0 002-2m0 0V5a2 2 0 012-2h2a2 2 0 012 2v14a2 2 0 01-2 2h-2a2 2 0 01-2-2z"></path></svg>' },
@@ -611,11 +973,16 @@ HTML_TEMPLATE = """
                     `).join('');
                     document.getElementById('relatoriosMetrics').innerHTML = htmlMetrics;
 
-                    // Tabela de Performance
+                    // Tabela de Performance: uma coluna por dimensão do agrupamento
+                    const th = titulo => `<th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">${titulo}</th>`;
+                    document.getElementById('performanceHead').innerHTML =
+                        data.agrupamento.map(d => th(ROTULOS_AGRUPAMENTO[d] || d)).join('') +
+                        ['Quantidade', 'Total (R$)', 'Ticket Médio (R$)'].map(th).join('');
+                    document.getElementById('relatoriosAviso').textContent = data.grupos_truncados
+                        ? `Mostrando os primeiros ${data.performance.length} grupos; refine os filtros ou o agrupamento.` : '';
                     let htmlPerf = data.performance.map(p => `
                         <tr class="hover:bg-gray-50">
-                            <td class="px-6 py-4 whitespace-nowrap text-sm font-medium text-gray-900">${p.status || '-'}</td>
-                            <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${p.status_cotacao || '-'}</td>
+                            ${data.agrupamento.map((d, i) => `<td class="px-6 py-4 whitespace-nowrap text-sm ${i === 0 ? 'font-medium text-gray-900' : 'text-gray-500'}">${p[d] || '-'}</td>`).join('')}
                             <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${p.quantidade}</td>
                             <td class="px-6 py-4 whitespace-nowrap text-sm font-bold text-gray-900">${formatCurrency(p.total)}</td>
                             <td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${formatCurrency(p.media)}</td>
@@ -623,7 +990,7 @@ HTML_TEMPLATE = """
                     `).join('');
                     document.getElementById('performanceBody').innerHTML = htmlPerf || `
                         <tr>
-                            <td colspan="5" class="px-6 py-4 text-center text-gray-500">Nenhum dado de performance disponível.</td>
+                            <td colspan="${data.agrupamento.length + 3}" class="px-6 py-4 text-center text-gray-500">Nenhum dado de performance disponível.</td>
                         </tr>
                     `;
                 });
@@ -637,7 +1004,8 @@ HTML_TEMPLATE = """
                     const metrics = [
                         { title: 'Total de Registros', value: data.total_registros, icon: '<svg class="w-6 h-6 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 7v10a2 2 0 002 2h12a2 2 0 002-2V9a2 2 0 00-2-2h-3m-2 4l-3 3m0 0l-3-3m3 3V4"></path></svg>' },
                         { title: 'Tamanho do Banco', value: `${data.tamanho_mb} MB`, icon: '<svg class="w-6 h-6 text-red-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 7v10a2 2 0 002 2h12a2 2 0 002-2V9a2 2 0 00-2-2h-3m-2 4l-3 3m0 0l-3-3m3 3V4"></path></svg>' },
-                        { title: 'Colunas no DB', value: data.colunas.split(',').length, icon: '<svg class="w-6 h-6 text-green-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 6h16M4 10h16M4 14h16M4 18h16"></path></svg>' }
+                        { title: 'Colunas no DB', value: data.colunas.split(',').length, icon: '<svg class="w-6 h-6 text-green-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 6h16M4 10h16M4 14h16M4 18h16"></path></svg>' },
+                        { title: 'Espaço Livre (vácuo pendente)', value: `${data.armazenamento.livre_mb} MB (${data.armazenamento.paginas_livres_pct}%)`, icon: '<svg class="w-6 h-6 text-yellow-600" fill="none" stroke="currentColor" viewBox="0 0 24 24" xmlns="http://www.w3.org/2000/svg"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M4 6h16M4 10h16M4 14h16M4 18h16"></path></svg>' }
                     ];
                     
                     let htmlMetrics = metrics.map(m => `
@@ -657,6 +1025,38 @@ HTML_TEMPLATE = """
                     let htmlCols = data.colunas_esperadas.map((col, i) => `${i+1}. <code>${col}</code>`).join('<br>');
                     document.getElementById('colunasEsperadas').innerHTML = htmlCols;
                 });
+            loadCargas();
+        }
+
+        function loadCargas() {
+            fetch('/api/cargas')
+                .then(r => r.json())
+                .then(data => {
+                    document.getElementById('cargasBody').innerHTML = data.cargas.map(c => `
+                        <tr>
+                            <td class="px-4 py-2 text-sm font-medium text-gray-900">${c.id}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.iniciado_em}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.origem} / ${c.modo}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.arquivo || '-'}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.status}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.inseridos} / ${c.atualizados}</td>
+                            <td class="px-4 py-2 text-sm text-gray-500">${c.linhas_atuais}</td>
+                            <td class="px-4 py-2 text-right">
+                                ${c.linhas_atuais ? `<button class="text-red-600 hover:text-red-800 text-sm font-semibold" onclick="desfazerCarga(${c.id})">Desfazer</button>` : ''}
+                            </td>
+                        </tr>
+                    `).join('');
+                });
+        }
+
+        function desfazerCarga(id) {
+            if (!confirm(`Remover as linhas inseridas pela carga ${id}?`)) return;
+            fetch(`/api/cargas/${id}`, { method: 'DELETE' })
+                .then(r => r.json())
+                .then(data => {
+                    alert(data.message);
+                    loadConfig();
+                });
         }
         
         function limparDados() {
@@ -677,6 +1077,7 @@ HTML_TEMPLATE = """
             if (initialButton) {
                 initialButton.classList.add('bg-blue-700', 'bg-blue-800');
             }
+            loadFilterOptions();
             loadDashboard();
         };
     </script>
@@ -689,10 +1090,237 @@ HTML_TEMPLATE = """
 # --------------------
 DB_FILE = 'ordens_servico_completo.db'
 
-def init_database():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
+STAGING_TABLE = 'ordens_servico_staging'
+# Resumos da staging, calculados antes da troca e renomeados junto com ela
+RESUMOS_STAGING = {'resumo_ordens': 'resumo_ordens_staging', 'resumo_diario': 'resumo_diario_staging'}
+
+# Índice de busca textual (FTS5 com conteúdo externo: guarda só o índice, o texto vem da view de ordens_servico)
+BUSCA_TABLE = 'ordens_busca'
+BUSCA_STAGING_TABLE = 'ordens_busca_staging'
+# (coluna, peso no bm25): números de cotação/circuito e cliente pesam mais que a descrição livre
+BUSCA_COLUMNS = [
+    ('nome_emissor_ordem', 5.0), ('descricao_operacao', 1.0), ('denominacao_produto', 2.0),
+    ('numero_cotacao', 10.0), ('numero_circuito', 10.0)
+]
+
+# Colunas de texto de baixa cardinalidade guardadas como chave inteira de uma tabela de dimensão.
+# Em ordens_servico a coluna vira <coluna>_id; a view ORDENS_VIEW devolve o texto com o nome original.
+DIMENSOES = {
+    'status': 'dim_status',
+    'status_cotacao': 'dim_status_cotacao',
+    'denominacao_produto': 'dim_produto',
+    'nome_emissor_ordem': 'dim_cliente',
+    'canal_distribuicao': 'dim_canal_distribuicao',
+}
+ORDENS_VIEW = 'vw_ordens_servico'
+
+def chave_busca(texto):
+    # Forma dobrada dos valores das dimensões (sem acentos, casefold), gravada em chave_busca e aplicada
+    # ao prefixo do catálogo: "ác" e "AC" casam com "Ácme Ltda", como o remove_diacritics do FTS.
+    # Mudar a dobra exige uma migração que recalcule a coluna.
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+# Colunas de ordens_servico como a aplicação as vê (texto no lugar das chaves das dimensões)
+CAMPOS_CONSULTA = [
+    'id', 'descricao_operacao', 'numero_oportunidade', 'numero_vta', 'numero_cotacao', 'numero_circuito',
+    'status_cotacao', 'denominacao_produto', 'quantidade', 'status', 'valor_pedido_bruto', 'criado_em',
+    'emissor_ordem', 'nome_emissor_ordem', 'nome_gerente_contas', 'organizacao_vendas', 'canal_distribuicao',
+    'setor_atividade', 'item_sd', 'id_produto', 'tempo_contrato', 'data_importacao', 'data_atualizacao',
+    'hash_conteudo', 'carga_id'
+]
+
+def coluna_fisica(coluna):
+    return f'{coluna}_id' if coluna in DIMENSOES else coluna
+
+def ddl_ordens_servico(tabela='ordens_servico'):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao_operacao TEXT, numero_oportunidade TEXT, numero_vta TEXT,
+            numero_cotacao TEXT, numero_circuito TEXT, status_cotacao_id INTEGER REFERENCES dim_status_cotacao(id),
+            denominacao_produto_id INTEGER REFERENCES dim_produto(id), quantidade INTEGER,
+            status_id INTEGER REFERENCES dim_status(id),
+            valor_pedido_bruto REAL, criado_em DATE, emissor_ordem TEXT,
+            nome_emissor_ordem_id INTEGER REFERENCES dim_cliente(id), nome_gerente_contas TEXT, organizacao_vendas TEXT,
+            canal_distribuicao_id INTEGER REFERENCES dim_canal_distribuicao(id), setor_atividade TEXT, item_sd TEXT,
+            id_produto TEXT, tempo_contrato TEXT,
+            data_importacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            hash_conteudo TEXT, carga_id INTEGER REFERENCES cargas(id)
+        )
+    """
+
+# Agregados do dashboard (resumo_ordens) mantidos a cada escrita: uma linha por (dimensão, chave) com
+# contagem e soma; chave é o id da dimensão (0 = sem valor). A coluna ultima_importacao ficou da versão 8
+# e não é mais mantida: a data da última importação vem de MAX(data_importacao), que acompanha as remoções.
+RESUMOS = {
+    'status': 'IFNULL(o.status_id, 0)',
+    'status_cotacao': 'IFNULL(o.status_cotacao_id, 0)',
+    'cliente': 'IFNULL(o.nome_emissor_ordem_id, 0)',
+    'produto': 'IFNULL(o.denominacao_produto_id, 0)',
+}
+# O rollup diário (resumo_diario) guarda linhas e soma por (dia de criado_em, status), '' = sem data:
+# base da timeline em qualquer granularidade.
+
+# Mesmo schema das migrações 8 e 10; a staging monta os seus resumos com estas definições
+def ddl_resumo(tabela='resumo_ordens'):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            dimensao TEXT NOT NULL, chave NOT NULL,
+            linhas INTEGER NOT NULL, valor REAL NOT NULL, ultima_importacao DATETIME,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    """
+
+def ddl_resumo_diario(tabela='resumo_diario'):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            dia TEXT NOT NULL, status_id INTEGER NOT NULL,
+            linhas INTEGER NOT NULL, valor REAL NOT NULL,
+            PRIMARY KEY (dia, status_id)
+        ) WITHOUT ROWID
+    """
+
+def select_ordens(tabela='ordens_servico'):
+    # Colunas lógicas (texto das dimensões de volta, via chave primária) seguidas das chaves <coluna>_id,
+    # que ficam disponíveis para filtrar e agrupar por inteiro
+    colunas, juncoes = [], []
+    for coluna in CAMPOS_CONSULTA:
+        if coluna in DIMENSOES:
+            dimensao = DIMENSOES[coluna]
+            colunas.append(f'{dimensao}.valor AS {coluna}')
+            juncoes.append(f'LEFT JOIN {dimensao} ON {dimensao}.id = o.{coluna}_id')
+        else:
+            colunas.append(f'o.{coluna}')
+    colunas += [f'o.{coluna}_id' for coluna in DIMENSOES]
+    return f"SELECT {', '.join(colunas)} FROM {tabela} o {' '.join(juncoes)}"
+
+def valor_coluna(coluna, linha):
+    # Texto de uma coluna lógica a partir de new/old da tabela física (usado nos gatilhos)
+    if coluna in DIMENSOES:
+        return f'(SELECT valor FROM {DIMENSOES[coluna]} WHERE id = {linha}.{coluna}_id)'
+    return f'{linha}.{coluna}'
+
+def ddl_busca(tabela=BUSCA_TABLE):
+    # remove_diacritics faz "concluido" casar com "concluído"; o índice de prefixos de 2 e 3
+    # caracteres atende as buscas incrementais digitadas na Consulta.
+    # content aponta sempre para a view ativa: a staging do índice é preenchida explicitamente.
+    return f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {tabela} USING fts5(
+            {', '.join(c for c, _ in BUSCA_COLUMNS)},
+            content='{ORDENS_VIEW}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """
+
+def criar_gatilhos_busca(cursor):
+    # Mantém o índice de busca em sincronia com inserções, exclusões e atualizações
+    colunas = ', '.join(c for c, _ in BUSCA_COLUMNS)
+    fisicas = ', '.join(coluna_fisica(c) for c, _ in BUSCA_COLUMNS)
+    novos = ', '.join(valor_coluna(c, 'new') for c, _ in BUSCA_COLUMNS)
+    antigos = ', '.join(valor_coluna(c, 'old') for c, _ in BUSCA_COLUMNS)
+    for sql in (
+        f"""CREATE TRIGGER IF NOT EXISTS {BUSCA_TABLE}_ai AFTER INSERT ON ordens_servico BEGIN
+                INSERT INTO {BUSCA_TABLE}(rowid, {colunas}) VALUES (new.id, {novos});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {BUSCA_TABLE}_ad AFTER DELETE ON ordens_servico BEGIN
+                INSERT INTO {BUSCA_TABLE}({BUSCA_TABLE}, rowid, {colunas}) VALUES ('delete', old.id, {antigos});
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {BUSCA_TABLE}_au AFTER UPDATE OF {fisicas} ON ordens_servico BEGIN
+                INSERT INTO {BUSCA_TABLE}({BUSCA_TABLE}, rowid, {colunas}) VALUES ('delete', old.id, {antigos});
+                INSERT INTO {BUSCA_TABLE}(rowid, {colunas}) VALUES (new.id, {novos});
+            END""",
+    ):
+        cursor.execute(sql)
+
+def indices_ordens_servico():
+    # (nome base, colunas) dos índices secundários de ordens_servico, derivados das consultas:
+    # filtros de build_query_and_params, GROUP BYs do dashboard, timeline e MAX(data_importacao).
+    # Com filtro de igualdade, o rowid embutido no índice já entrega a ordem de ORDER BY id DESC.
+    # Filtros e agrupamentos por dimensão usam as chaves inteiras.
+    chaves = app.config['SYNC_KEY_COLUMNS']
+    return [
+        (f"idx_ordens_chave_{'_'.join(chaves)}", [coluna_fisica(c) for c in chaves]),
+        ('idx_ordens_status', ['status_id']),
+        ('idx_ordens_status_cotacao', ['status_cotacao_id']),
+        # Filtro combinado status + status_cotacao
+        ('idx_ordens_status_status_cotacao', ['status_id', 'status_cotacao_id']),
+        ('idx_ordens_cliente', ['nome_emissor_ordem_id']),
+        ('idx_ordens_produto', ['denominacao_produto_id']),
+        ('idx_ordens_criado_em', ['criado_em']),
+        ('idx_ordens_data_importacao', ['data_importacao']),
+        # Filtros por intervalo: status (igualdade) + período, e faixa de valor
+        ('idx_ordens_status_criado_em', ['status_id', 'criado_em']),
+        ('idx_ordens_valor', ['valor_pedido_bruto']),
+        # Listagem, comparação e remoção de cargas
+        ('idx_ordens_carga', ['carga_id']),
+    ]
+
+def criar_indices(cursor, tabela='ordens_servico'):
+    # Para a tabela de staging, usa a variante do nome que não está ocupada pela tabela ativa
+    # (nomes de índice são globais e sobrevivem ao RENAME da troca).
+    for nome, colunas in indices_ordens_servico():
+        if tabela != 'ordens_servico':
+            existe = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (nome,)).fetchone()
+            nome = f'{nome}_b' if existe else nome
+        elif cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (f'{nome}_b',)).fetchone():
+            continue
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})")
+
+def analisar_tabela(cursor, tabela='ordens_servico'):
+    # Atualiza as estatísticas do planejador; analysis_limit amostra cada índice em vez de
+    # percorrê-lo inteiro, o que mantém o ANALYZE barato mesmo depois de cargas grandes.
+    cursor.execute("PRAGMA analysis_limit = 1000")
+    cursor.execute(f"ANALYZE {tabela}")
+
+def dimensoes_orfas(cursor, tabela='ordens_servico'):
+    # {dimensão: ids} dos valores que nenhuma linha de tabela usa (uma passada por coluna)
+    return {
+        dimensao: [row[0] for row in cursor.execute(
+            f"SELECT id FROM {dimensao} EXCEPT SELECT {coluna}_id FROM {tabela}"
+        ).fetchall()]
+        for coluna, dimensao in DIMENSOES.items()
+    }
+
+def remover_dimensoes_orfas(cursor, orfas=None):
+    # Valores que nenhuma ordem usa mais (após substituir, sincronizar ou limpar) saem das dimensões.
+    # orfas: ids já calculados (troca da staging), para a transação da troca não varrer a tabela.
+    orfas = dimensoes_orfas(cursor) if orfas is None else orfas
+    for dimensao, ids in orfas.items():
+        for inicio in range(0, len(ids), 500):
+            grupo = ids[inicio:inicio + 500]
+            cursor.execute(f"DELETE FROM {dimensao} WHERE id IN ({','.join('?' * len(grupo))})", grupo)
+
+def atualizar_resumo(cursor, filtro='WHERE 1', params=(), sinal=1, tabela='ordens_servico', resumos=None):
+    # Soma (sinal=1) ou subtrai (sinal=-1) ao resumo as linhas de ordens_servico selecionadas por filtro:
+    # chamado depois de inserir e antes de apagar/atualizar, na mesma transação da escrita.
+    # Grupos que chegam a zero linhas saem do resumo. tabela/resumos: origem e destino (staging).
+    resumos = resumos or {'resumo_ordens': 'resumo_ordens', 'resumo_diario': 'resumo_diario'}
+    for dimensao, expressao in RESUMOS.items():
+        cursor.execute(f"""
+            INSERT INTO {resumos['resumo_ordens']} (dimensao, chave, linhas, valor)
+            SELECT '{dimensao}', {expressao}, {sinal} * COUNT(*), {sinal} * TOTAL(o.valor_pedido_bruto)
+            FROM {tabela} o {filtro} GROUP BY 2
+            ON CONFLICT (dimensao, chave) DO UPDATE SET
+                linhas = linhas + excluded.linhas, valor = valor + excluded.valor
+        """, params)
+    cursor.execute(f"DELETE FROM {resumos['resumo_ordens']} WHERE linhas <= 0")
+    cursor.execute(f"""
+        INSERT INTO {resumos['resumo_diario']} (dia, status_id, linhas, valor)
+        SELECT IFNULL(date(o.criado_em), ''), IFNULL(o.status_id, 0), {sinal} * COUNT(*), {sinal} * TOTAL(o.valor_pedido_bruto)
+        FROM {tabela} o {filtro} GROUP BY 1, 2
+        ON CONFLICT (dia, status_id) DO UPDATE SET linhas = linhas + excluded.linhas, valor = valor + excluded.valor
+    """, params)
+    cursor.execute(f"DELETE FROM {resumos['resumo_diario']} WHERE linhas <= 0")
+
+# --------------------
+# Migrações de schema (versionadas por PRAGMA user_version)
+# --------------------
+# As migrações já publicadas guardam o schema da sua época: o estado atual é sempre o resultado
+# de aplicar a lista inteira, em ordem, a partir de qualquer versão.
+def migracao_tabela_base(cursor):
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS ordens_servico (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             descricao_operacao TEXT, numero_oportunidade TEXT, numero_vta TEXT,
@@ -705,41 +1333,764 @@ def init_database():
             data_importacao DATETIME DEFAULT CURRENT_TIMESTAMP,
             data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    conn.commit()
-    conn.close()
+    """)
 
-init_database()
+def migracao_hash_conteudo(cursor):
+    # Bancos criados antes do modo sincronizar não têm a coluna de hash
+    colunas = [row[1] for row in cursor.execute("PRAGMA table_info(ordens_servico)")]
+    if 'hash_conteudo' not in colunas:
+        cursor.execute("ALTER TABLE ordens_servico ADD COLUMN hash_conteudo TEXT")
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def migracao_indices_consulta(cursor):
+    for nome, colunas in [
+        ('idx_ordens_chave_numero_cotacao_numero_circuito', 'numero_cotacao, numero_circuito'),
+        ('idx_ordens_status', 'status'),
+        ('idx_ordens_status_cotacao', 'status_cotacao'),
+        ('idx_ordens_status_status_cotacao', 'status, status_cotacao'),
+        ('idx_ordens_cliente', 'nome_emissor_ordem'),
+        ('idx_ordens_produto', 'denominacao_produto'),
+        ('idx_ordens_criado_em', 'criado_em'),
+        ('idx_ordens_data_importacao', 'data_importacao'),
+    ]:
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (f'{nome}_b',)).fetchone():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON ordens_servico ({colunas})")
+    analisar_tabela(cursor)
 
-# --------------------
-# Funções utilitárias para mapping e datas
-# --------------------
-def mapear_status(status_excel):
-    if pd.isna(status_excel) or status_excel == '':
-        return 'Sem Status'
-    status = str(status_excel).strip()
-    status_map = {
-        'concluído': 'Concluído', 'concluido': 'Concluído', 'finalizado': 'Concluído',
-        'completo': 'Concluído', 'pendente': 'Pendente', 'aberto': 'Aberto',
-        'liberado': 'Liberado', 'liberada': 'Liberado', 'aprovado': 'Aprovado',
-        'em andamento': 'Em Andamento', 'processando': 'Em Andamento',
-        'cancelado': 'Cancelado', 'rejeitado': 'Rejeitado'
-    }
-    return status_map.get(status.lower(), status)
+def migracao_busca_textual(cursor):
+    colunas = 'nome_emissor_ordem, descricao_operacao, denominacao_produto, numero_cotacao, numero_circuito'
+    novos = ', '.join(f'new.{c}' for c in colunas.split(', '))
+    antigos = ', '.join(f'old.{c}' for c in colunas.split(', '))
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS ordens_busca USING fts5(
+            {colunas}, content='ordens_servico', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    cursor.execute("INSERT INTO ordens_busca(ordens_busca) VALUES ('rebuild')")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_ai AFTER INSERT ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(rowid, {colunas}) VALUES (new.id, {novos}); END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_ad AFTER DELETE ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(ordens_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos}); END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_au AFTER UPDATE OF {colunas} ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(ordens_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos});
+        INSERT INTO ordens_busca(rowid, {colunas}) VALUES (new.id, {novos}); END""")
 
-def converter_data(data_excel):
-    if pd.isna(data_excel) or data_excel == '':
-        return None
-    try:
-        if isinstance(data_excel, str):
-            # Tenta converter string para datetime
-            for fmt in ['%d.%m.%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S']:
-                try:
+def migracao_dimensoes(cursor):
+    # SQL congelado da versão 5: reconstrói ordens_servico com as colunas de baixa cardinalidade como
+    # chaves das dimensões. Índices, view, índice de busca e gatilhos são recriados sobre o novo layout.
+    dimensoes = {
+        'status': 'dim_status',
+        'status_cotacao': 'dim_status_cotacao',
+        'denominacao_produto': 'dim_produto',
+        'nome_emissor_ordem': 'dim_cliente',
+        'canal_distribuicao': 'dim_canal_distribuicao',
+    }
+    for coluna, dimensao in dimensoes.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {dimensao} (id INTEGER PRIMARY KEY, valor TEXT NOT NULL UNIQUE)")
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {dimensao} (valor) "
+            f"SELECT DISTINCT {coluna} FROM ordens_servico WHERE {coluna} IS NOT NULL ORDER BY {coluna}"
+        )
+    cursor.execute("DROP TABLE IF EXISTS ordens_busca")
+    cursor.execute("DROP TABLE IF EXISTS ordens_servico_dimensoes")
+    cursor.execute("""
+        CREATE TABLE ordens_servico_dimensoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao_operacao TEXT, numero_oportunidade TEXT, numero_vta TEXT,
+            numero_cotacao TEXT, numero_circuito TEXT, status_cotacao_id INTEGER REFERENCES dim_status_cotacao(id),
+            denominacao_produto_id INTEGER REFERENCES dim_produto(id), quantidade INTEGER,
+            status_id INTEGER REFERENCES dim_status(id),
+            valor_pedido_bruto REAL, criado_em DATE, emissor_ordem TEXT,
+            nome_emissor_ordem_id INTEGER REFERENCES dim_cliente(id), nome_gerente_contas TEXT, organizacao_vendas TEXT,
+            canal_distribuicao_id INTEGER REFERENCES dim_canal_distribuicao(id), setor_atividade TEXT, item_sd TEXT,
+            id_produto TEXT, tempo_contrato TEXT,
+            data_importacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            hash_conteudo TEXT
+        )
+    """)
+    # Colunas existentes até a versão 4 (também as colunas lógicas da view da versão 5)
+    colunas = [
+        'id', 'descricao_operacao', 'numero_oportunidade', 'numero_vta', 'numero_cotacao', 'numero_circuito',
+        'status_cotacao', 'denominacao_produto', 'quantidade', 'status', 'valor_pedido_bruto', 'criado_em',
+        'emissor_ordem', 'nome_emissor_ordem', 'nome_gerente_contas', 'organizacao_vendas', 'canal_distribuicao',
+        'setor_atividade', 'item_sd', 'id_produto', 'tempo_contrato', 'data_importacao', 'data_atualizacao',
+        'hash_conteudo'
+    ]
+    destino = [f'{c}_id' if c in dimensoes else c for c in colunas]
+    origem = [
+        f'(SELECT id FROM {dimensoes[c]} WHERE valor = o.{c})' if c in dimensoes else f'o.{c}'
+        for c in colunas
+    ]
+    cursor.execute(
+        f"INSERT INTO ordens_servico_dimensoes ({', '.join(destino)}) "
+        f"SELECT {', '.join(origem)} FROM ordens_servico o"
+    )
+    sequencia = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ordens_servico'").fetchone()
+    cursor.execute("DROP TABLE ordens_servico")
+    cursor.execute("ALTER TABLE ordens_servico_dimensoes RENAME TO ordens_servico")
+    if sequencia:
+        # Ids de ordens já excluídas não voltam a ser usados
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'ordens_servico'", (sequencia[0],))
+    cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'ordens_servico'")
+    for nome, colunas_indice in [
+        ('idx_ordens_chave_numero_cotacao_numero_circuito', 'numero_cotacao, numero_circuito'),
+        ('idx_ordens_status', 'status_id'),
+        ('idx_ordens_status_cotacao', 'status_cotacao_id'),
+        ('idx_ordens_status_status_cotacao', 'status_id, status_cotacao_id'),
+        ('idx_ordens_cliente', 'nome_emissor_ordem_id'),
+        ('idx_ordens_produto', 'denominacao_produto_id'),
+        ('idx_ordens_criado_em', 'criado_em'),
+        ('idx_ordens_data_importacao', 'data_importacao'),
+    ]:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON ordens_servico ({colunas_indice})")
+    campos = [f'{dimensoes[c]}.valor AS {c}' if c in dimensoes else f'o.{c}' for c in colunas]
+    campos += [f'o.{c}_id' for c in dimensoes]
+    juncoes = [f'LEFT JOIN {dimensoes[c]} ON {dimensoes[c]}.id = o.{c}_id' for c in colunas if c in dimensoes]
+    cursor.execute(
+        f"CREATE VIEW IF NOT EXISTS vw_ordens_servico AS "
+        f"SELECT {', '.join(campos)} FROM ordens_servico o {' '.join(juncoes)}"
+    )
+    busca = 'nome_emissor_ordem, descricao_operacao, denominacao_produto, numero_cotacao, numero_circuito'
+    fisicas = 'nome_emissor_ordem_id, descricao_operacao, denominacao_produto_id, numero_cotacao, numero_circuito'
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS ordens_busca USING fts5(
+            {busca}, content='vw_ordens_servico', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    cursor.execute("INSERT INTO ordens_busca(ordens_busca) VALUES ('rebuild')")
+    novos, antigos = (
+        f'(SELECT valor FROM dim_cliente WHERE id = {linha}.nome_emissor_ordem_id), {linha}.descricao_operacao, '
+        f'(SELECT valor FROM dim_produto WHERE id = {linha}.denominacao_produto_id), '
+        f'{linha}.numero_cotacao, {linha}.numero_circuito'
+        for linha in ('new', 'old')
+    )
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_ai AFTER INSERT ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(rowid, {busca}) VALUES (new.id, {novos}); END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_ad AFTER DELETE ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(ordens_busca, rowid, {busca}) VALUES ('delete', old.id, {antigos}); END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS ordens_busca_au AFTER UPDATE OF {fisicas} ON ordens_servico BEGIN
+        INSERT INTO ordens_busca(ordens_busca, rowid, {busca}) VALUES ('delete', old.id, {antigos});
+        INSERT INTO ordens_busca(rowid, {busca}) VALUES (new.id, {novos}); END""")
+    analisar_tabela(cursor)
+
+def migracao_indices_intervalo(cursor):
+    # Índices da versão 6; o nome _b só aparece depois de uma troca de staging, que já os cria
+    for nome, colunas in [
+        ('idx_ordens_status_criado_em', 'status_id, criado_em'),
+        ('idx_ordens_valor', 'valor_pedido_bruto'),
+    ]:
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (f'{nome}_b',)).fetchone():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON ordens_servico ({colunas})")
+    analisar_tabela(cursor)
+
+def migracao_cargas(cursor):
+    # Cada importação (upload ou API bulk) é uma carga; as linhas que ela insere guardam o carga_id
+    # (linhas anteriores ficam sem carga) e a view passa a expô-lo
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cargas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origem TEXT NOT NULL, modo TEXT NOT NULL, arquivo TEXT, hash_arquivo TEXT,
+            status TEXT NOT NULL DEFAULT 'em_andamento',
+            inseridos INTEGER DEFAULT 0, atualizados INTEGER DEFAULT 0, inalterados INTEGER DEFAULT 0,
+            iniciado_em DATETIME DEFAULT CURRENT_TIMESTAMP, concluido_em DATETIME,
+            tempo_segundos REAL, erro TEXT
+        )
+    """)
+    colunas = [row[1] for row in cursor.execute("PRAGMA table_info(ordens_servico)")]
+    if 'carga_id' not in colunas:
+        cursor.execute("ALTER TABLE ordens_servico ADD COLUMN carga_id INTEGER REFERENCES cargas(id)")
+    cursor.execute("DROP VIEW IF EXISTS vw_ordens_servico")
+    cursor.execute("""
+        CREATE VIEW vw_ordens_servico AS SELECT
+            o.id, o.descricao_operacao, o.numero_oportunidade, o.numero_vta, o.numero_cotacao, o.numero_circuito,
+            dim_status_cotacao.valor AS status_cotacao, dim_produto.valor AS denominacao_produto, o.quantidade,
+            dim_status.valor AS status, o.valor_pedido_bruto, o.criado_em, o.emissor_ordem,
+            dim_cliente.valor AS nome_emissor_ordem, o.nome_gerente_contas, o.organizacao_vendas,
+            dim_canal_distribuicao.valor AS canal_distribuicao, o.setor_atividade, o.item_sd, o.id_produto,
+            o.tempo_contrato, o.data_importacao, o.data_atualizacao, o.hash_conteudo, o.carga_id,
+            o.status_id, o.status_cotacao_id, o.denominacao_produto_id, o.nome_emissor_ordem_id,
+            o.canal_distribuicao_id
+        FROM ordens_servico o
+        LEFT JOIN dim_status_cotacao ON dim_status_cotacao.id = o.status_cotacao_id
+        LEFT JOIN dim_produto ON dim_produto.id = o.denominacao_produto_id
+        LEFT JOIN dim_status ON dim_status.id = o.status_id
+        LEFT JOIN dim_cliente ON dim_cliente.id = o.nome_emissor_ordem_id
+        LEFT JOIN dim_canal_distribuicao ON dim_canal_distribuicao.id = o.canal_distribuicao_id
+    """)
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_ordens_carga_b'").fetchone():
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ordens_carga ON ordens_servico (carga_id)")
+    analisar_tabela(cursor)
+
+def migracao_resumo(cursor):
+    # SQL congelado da versão 8 (a dimensão mes sai na migração 10, que cria o rollup diário)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_ordens (
+            dimensao TEXT NOT NULL, chave NOT NULL,
+            linhas INTEGER NOT NULL, valor REAL NOT NULL, ultima_importacao DATETIME,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    """)
+    expressoes = {
+        'status': 'IFNULL(status_id, 0)',
+        'status_cotacao': 'IFNULL(status_cotacao_id, 0)',
+        'cliente': 'IFNULL(nome_emissor_ordem_id, 0)',
+        'produto': 'IFNULL(denominacao_produto_id, 0)',
+        'mes': "IFNULL(strftime('%Y-%m', criado_em), '')",
+    }
+    for dimensao, expressao in expressoes.items():
+        cursor.execute(
+            f"INSERT INTO resumo_ordens (dimensao, chave, linhas, valor, ultima_importacao) "
+            f"SELECT '{dimensao}', {expressao}, COUNT(*), TOTAL(valor_pedido_bruto), MAX(data_importacao) "
+            f"FROM ordens_servico GROUP BY 2"
+        )
+
+def migracao_catalogo_filtros(cursor):
+    # Busca por prefixo sem diferenciar maiúsculas (LIKE 'abc%') vira SEARCH nestes índices
+    for dimensao in ('dim_status', 'dim_status_cotacao', 'dim_produto', 'dim_cliente', 'dim_canal_distribuicao'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{dimensao}_valor_nocase ON {dimensao} (valor COLLATE NOCASE)")
+
+def migracao_chave_busca(cursor):
+    # O índice NOCASE só dobra ASCII ("ác" não achava "Ácme"): a busca por prefixo passa a usar a
+    # coluna dobrada em Python, com índice binário comum
+    for dimensao in ('dim_status', 'dim_status_cotacao', 'dim_produto', 'dim_cliente', 'dim_canal_distribuicao'):
+        cursor.execute(f"ALTER TABLE {dimensao} ADD COLUMN chave_busca TEXT")
+        valores = cursor.execute(f"SELECT id, valor FROM {dimensao}").fetchall()
+        cursor.executemany(
+            f"UPDATE {dimensao} SET chave_busca = ? WHERE id = ?",
+            ((chave_busca(valor), id_) for id_, valor in valores),
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{dimensao}_chave_busca ON {dimensao} (chave_busca)")
+        cursor.execute(f"DROP INDEX IF EXISTS idx_{dimensao}_valor_nocase")
+
+def migracao_resumo_diario(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_diario (
+            dia TEXT NOT NULL, status_id INTEGER NOT NULL,
+            linhas INTEGER NOT NULL, valor REAL NOT NULL,
+            PRIMARY KEY (dia, status_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("DELETE FROM resumo_ordens WHERE dimensao = 'mes'")
+    cursor.execute(
+        "INSERT INTO resumo_diario (dia, status_id, linhas, valor) "
+        "SELECT IFNULL(date(criado_em), ''), IFNULL(status_id, 0), COUNT(*), TOTAL(valor_pedido_bruto) "
+        "FROM ordens_servico GROUP BY 1, 2"
+    )
+
+# Cada migração roda uma única vez, em ordem; novas alterações de schema entram no fim da lista
+MIGRACOES = [
+    (1, 'Tabela ordens_servico', migracao_tabela_base),
+    (2, 'Coluna hash_conteudo', migracao_hash_conteudo),
+    (3, 'Índices secundários das consultas', migracao_indices_consulta),
+    (4, 'Índice de busca textual (FTS5)', migracao_busca_textual),
+    (5, 'Tabelas de dimensão para colunas de baixa cardinalidade', migracao_dimensoes),
+    (6, 'Índices para filtros por período e faixa de valor', migracao_indices_intervalo),
+    (7, 'Cargas de importação (carga_id por linha)', migracao_cargas),
+    (8, 'Agregados materializados do dashboard', migracao_resumo),
+    (9, 'Índices de prefixo do catálogo de filtros', migracao_catalogo_filtros),
+    (10, 'Rollup diário da timeline', migracao_resumo_diario),
+    (11, 'Chave de busca sem acentos nas dimensões', migracao_chave_busca),
+]
+
+def migrar_banco(conn):
+    # Aplica as migrações pendentes; cada uma é atômica junto com o avanço do user_version
+    # (o DDL do SQLite é transacional). Bancos antigos sobem de versão na inicialização.
+    cursor = conn.cursor()
+    versao = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for numero, descricao, migracao in MIGRACOES:
+        if numero <= versao:
+            continue
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            # Outro processo pode ter migrado enquanto esperávamos o lock
+            if cursor.execute("PRAGMA user_version").fetchone()[0] >= numero:
+                conn.rollback()
+                continue
+            migracao(cursor)
+            cursor.execute(f"PRAGMA user_version = {numero}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migração {numero} aplicada: {descricao}")
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+def init_database():
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    try:
+        # Vácuo incremental: páginas liberadas por DELETE/DROP podem voltar ao disco aos poucos, sem
+        # VACUUM completo. Em banco novo vale de imediato; em banco existente exige um VACUUM, uma única vez,
+        # que fica para a thread de manutenção (converter_vacuo_incremental) em vez de travar a inicialização.
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL fica gravado no arquivo: leitores continuam lendo enquanto uma importação escreve
+        conn.execute("PRAGMA journal_mode = WAL")
+        migrar_banco(conn)
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+# --------------------
+# Medição de consultas (log de consultas lentas com plano de execução)
+# --------------------
+_consultas_lentas = deque(maxlen=app.config['CONSULTAS_LENTAS_MAX'])
+_consultas_lock = threading.Lock()
+_consultas_estatisticas = {'medidas': 0, 'lentas': 0, 'tempo_total_ms': 0.0}
+
+def parametros_log(parametros):
+    # Parâmetros legíveis e de tamanho limitado para o log
+    def valor(v):
+        return v if v is None or isinstance(v, (int, float)) else str(v)[:200]
+    if isinstance(parametros, dict):
+        return {k: valor(v) for k, v in parametros.items()}
+    return [valor(v) for v in parametros]
+
+def plano_consulta(sql, parametros):
+    # EXPLAIN QUERY PLAN em uma conexão de leitura à parte: a conexão medida pode estar com
+    # transação aberta ou com o progress handler da contagem já estourado.
+    if not re.match(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', sql, re.IGNORECASE):
+        return []
+    conn = get_db_connection()
+    try:
+        return [row[3] for row in sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parametros)]
+    except sqlite3.Error:
+        # Tabelas de staging ainda não confirmadas não existem para as outras conexões
+        return []
+    finally:
+        conn.close()
+
+def varreduras_completas(plano):
+    # Passos do plano que leem a tabela inteira ("SCAN tabela"), fora subconsultas materializadas.
+    # Varreduras de índice inteiro ("SCAN t USING [COVERING] INDEX") e tabelas virtuais (FTS) não contam.
+    subconsultas = {m.group(2) for m in (re.match(r'(CO-ROUTINE|MATERIALIZE) (\S+)', p) for p in plano) if m}
+    return [p for p in plano
+            if re.fullmatch(r'SCAN (\S+)', p) and p.split()[1] not in subconsultas and p != 'SCAN CONSTANT ROW']
+
+def registrar_consulta(sql, parametros, duracao, linhas, erro=None, lote=None):
+    # lote: número de conjuntos de parâmetros de um executemany (parametros traz só o primeiro)
+    duracao_ms = duracao * 1000
+    with _consultas_lock:
+        _consultas_estatisticas['medidas'] += 1
+        _consultas_estatisticas['tempo_total_ms'] += duracao_ms
+    if duracao_ms < app.config['CONSULTA_LENTA_MS']:
+        return
+    plano = plano_consulta(sql, parametros)
+    registro = {
+        'sql': ' '.join(sql.split()),
+        'parametros': parametros_log(parametros),
+        'duracao_ms': round(duracao_ms, 2),
+        'linhas': linhas,
+        'quando': datetime.now().isoformat(timespec='seconds'),
+        'plano': plano,
+        'varreduras_completas': varreduras_completas(plano),
+        'erro': erro,
+    }
+    if lote is not None:
+        registro['lote'] = lote
+    with _consultas_lock:
+        _consultas_estatisticas['lentas'] += 1
+        _consultas_lentas.append(registro)
+
+def contar_parametros(parametros, lote):
+    # Repassa os conjuntos de parâmetros de um gerador guardando o primeiro e o total
+    for p in parametros:
+        if not lote['total']:
+            lote['primeiro'] = p
+        lote['total'] += 1
+        yield p
+
+def consulta_nao_medida(sql):
+    # PRAGMAs (configuração de cada conexão, manutenção) só poluiriam o log
+    return sql.lstrip()[:6].upper() == 'PRAGMA'
+
+class CursorMedido(sqlite3.Cursor):
+    # Mede o execute() mais o tempo gasto lendo as linhas; a consulta é registrada quando o cursor
+    # se esgota, é fechado, executa outra consulta ou é descartado.
+    # executemany (cargas e atualizações em lote) é medido inteiro e registrado na hora.
+    _medicao = None
+
+    def execute(self, sql, parameters=()):
+        self._encerrar_medicao()
+        if consulta_nao_medida(sql):
+            return super().execute(sql, parameters)
+        inicio = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            registrar_consulta(sql, parameters, time.perf_counter() - inicio, 0, erro=str(e))
+            raise
+        self._medicao = [sql, parameters, time.perf_counter() - inicio, 0]
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._encerrar_medicao()
+        if consulta_nao_medida(sql):
+            return super().executemany(sql, seq_of_parameters)
+        # O log guarda o primeiro conjunto de parâmetros (também usado no EXPLAIN) e o total do lote
+        if isinstance(seq_of_parameters, (list, tuple)):
+            lote = {'primeiro': seq_of_parameters[0] if seq_of_parameters else (), 'total': len(seq_of_parameters)}
+        else:
+            lote = {'primeiro': (), 'total': 0}
+            seq_of_parameters = contar_parametros(seq_of_parameters, lote)
+        inicio = time.perf_counter()
+        erro = None
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            erro = str(e)
+            raise
+        finally:
+            registrar_consulta(sql, lote['primeiro'], time.perf_counter() - inicio,
+                               0 if erro else max(self.rowcount, 0), erro=erro, lote=lote['total'])
+        return self
+
+    def _medir(self, leitura, *args):
+        inicio = time.perf_counter()
+        resultado = leitura(*args)
+        if self._medicao:
+            self._medicao[2] += time.perf_counter() - inicio
+        return resultado
+
+    def _contar(self, linhas):
+        if self._medicao:
+            self._medicao[3] += linhas
+
+    def _encerrar_medicao(self):
+        medicao, self._medicao = self._medicao, None
+        if medicao:
+            registrar_consulta(*medicao)
+
+    def fetchone(self):
+        linha = self._medir(super().fetchone)
+        if linha is None:
+            self._encerrar_medicao()
+        else:
+            self._contar(1)
+        return linha
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        linhas = self._medir(super().fetchmany, size)
+        self._contar(len(linhas))
+        if len(linhas) < size:
+            self._encerrar_medicao()
+        return linhas
+
+    def fetchall(self):
+        linhas = self._medir(super().fetchall)
+        self._contar(len(linhas))
+        self._encerrar_medicao()
+        return linhas
+
+    def __next__(self):
+        try:
+            linha = self._medir(super().__next__)
+        except StopIteration:
+            self._encerrar_medicao()
+            raise
+        self._contar(1)
+        return linha
+
+    def close(self):
+        self._encerrar_medicao()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._encerrar_medicao()
+        except Exception:
+            # Descartado no encerramento do interpretador ou com a conexão já fechada
+            pass
+
+def resumo_consultas_lentas(limite=20):
+    # Agrupa o buffer por SQL: os piores ofensores primeiro (tempo acumulado no log)
+    with _consultas_lock:
+        registros = list(_consultas_lentas)
+        estatisticas = dict(_consultas_estatisticas)
+    grupos = {}
+    for registro in registros:
+        grupo = grupos.setdefault(registro['sql'], {'sql': registro['sql'], 'execucoes': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        grupo['execucoes'] += 1
+        grupo['total_ms'] += registro['duracao_ms']
+        grupo['max_ms'] = max(grupo['max_ms'], registro['duracao_ms'])
+        # O registro mais recente define parâmetros e plano mostrados
+        grupo.update({k: registro[k] for k in ('parametros', 'linhas', 'quando', 'plano', 'varreduras_completas', 'erro')})
+        grupo['lote'] = registro.get('lote')
+    piores = sorted(grupos.values(), key=lambda g: g['total_ms'], reverse=True)[:limite]
+    for grupo in piores:
+        grupo['media_ms'] = round(grupo['total_ms'] / grupo['execucoes'], 2)
+        grupo['total_ms'] = round(grupo['total_ms'], 2)
+        grupo['varredura_completa'] = bool(grupo['varreduras_completas'])
+    estatisticas['tempo_total_ms'] = round(estatisticas['tempo_total_ms'], 2)
+    return {
+        'limite_ms': app.config['CONSULTA_LENTA_MS'],
+        'estatisticas': dict(estatisticas, no_buffer=len(registros)),
+        'com_varredura_completa': sum(1 for g in grupos.values() if g['varreduras_completas']),
+        'consultas': piores,
+    }
+
+# --------------------
+# Conexões (pool de leitura + conexão única de escrita)
+# --------------------
+class ConexaoMedida(sqlite3.Connection):
+    # Todo cursor (inclusive os de conn.execute e do pandas) passa pela medição
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class ConexaoPool(ConexaoMedida):
+    # close() devolve a conexão ao pool em vez de fechá-la; as rotas continuam chamando conn.close()
+    pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.devolver(self)
+        else:
+            super().close()
+
+    def fechar(self):
+        super().close()
+
+def configurar_conexao(conn):
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT_MS'])}")
+    conn.execute(f"PRAGMA cache_size = -{int(app.config['DB_CACHE_SIZE_KB'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(app.config['DB_MMAP_SIZE'])}")
+    conn.execute(f"PRAGMA synchronous = {app.config['DB_SYNCHRONOUS']}")
+    conn.execute(f"PRAGMA temp_store = {app.config['DB_TEMP_STORE']}")
+    return conn
+
+class PoolConexoes:
+    # Pilha de conexões ociosas. Nunca bloqueia: sem conexão livre abre uma nova, e na devolução
+    # só mantém até `tamanho` ociosas. Com WAL nenhum leitor espera pela escrita em andamento.
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._ociosas = []
+        self._lock = threading.Lock()
+        self.estatisticas = {'criadas': 0, 'reutilizadas': 0, 'descartadas': 0, 'em_uso': 0, 'pico_em_uso': 0}
+
+    def obter(self):
+        with self._lock:
+            conn = self._ociosas.pop() if self._ociosas else None
+            self.estatisticas['reutilizadas' if conn else 'criadas'] += 1
+            self.estatisticas['em_uso'] += 1
+            self.estatisticas['pico_em_uso'] = max(self.estatisticas['pico_em_uso'], self.estatisticas['em_uso'])
+        if conn is None:
+            conn = configurar_conexao(sqlite3.connect(DB_FILE, factory=ConexaoPool, check_same_thread=False))
+            conn.pool = self
+        return conn
+
+    def devolver(self, conn):
+        # Estado deixado pela requisição não passa para a próxima
+        if conn.in_transaction:
+            conn.rollback()
+        conn.set_progress_handler(None, 0)
+        with self._lock:
+            self.estatisticas['em_uso'] -= 1
+            if len(self._ociosas) < self.tamanho:
+                self._ociosas.append(conn)
+                return
+            self.estatisticas['descartadas'] += 1
+        conn.fechar()
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self.estatisticas, ociosas=len(self._ociosas), tamanho=self.tamanho)
+
+_pool_leitura = PoolConexoes(app.config['DB_POOL_SIZE'])
+
+def get_db_connection():
+    return _pool_leitura.obter()
+
+# O SQLite aceita um escritor por vez: toda escrita passa pela mesma conexão, em fila
+_escrita_lock = threading.Lock()
+_conexao_escrita = None
+_escrita_estatisticas = {'usos': 0, 'espera_segundos': 0.0, 'ocupada': False}
+
+@contextmanager
+def conexao_escrita():
+    global _conexao_escrita
+    inicio = time.time()
+    with _escrita_lock:
+        _escrita_estatisticas['usos'] += 1
+        _escrita_estatisticas['espera_segundos'] += time.time() - inicio
+        _escrita_estatisticas['ocupada'] = True
+        if _conexao_escrita is None:
+            _conexao_escrita = configurar_conexao(sqlite3.connect(DB_FILE, factory=ConexaoMedida, check_same_thread=False))
+        try:
+            yield _conexao_escrita
+        finally:
+            if _conexao_escrita.in_transaction:
+                _conexao_escrita.rollback()
+            _escrita_estatisticas['ocupada'] = False
+
+def estatisticas_conexoes():
+    return {
+        'leitura': _pool_leitura.to_dict(),
+        'escrita': dict(_escrita_estatisticas, espera_segundos=round(_escrita_estatisticas['espera_segundos'], 3))
+    }
+
+# Geração dos dados: avança a cada escrita confirmada e invalida o que foi calculado antes dela
+_dados_geracao = 0
+_dados_geracao_lock = threading.Lock()
+
+def marcar_dados_alterados():
+    global _dados_geracao
+    with _dados_geracao_lock:
+        _dados_geracao += 1
+
+def geracao_dados():
+    with _dados_geracao_lock:
+        return _dados_geracao
+
+# --------------------
+# Manutenção do banco (estatísticas, checkpoint do WAL e vácuo incremental) em segundo plano
+# --------------------
+_manutencao_evento = threading.Event()
+_manutencao_lock = threading.Lock()
+_manutencao_thread = None
+_manutencao_estado = {
+    'execucoes': 0, 'pendente': None, 'ultima_execucao': None, 'ultimo_motivo': None,
+    'ultima_duracao_segundos': None, 'paginas_devolvidas': None, 'checkpoint': None, 'erro': None,
+    'conversao_vacuo': None
+}
+
+def converter_vacuo_incremental(conn):
+    # Conversão única de bancos criados antes do vácuo incremental: o VACUUM completo reescreve o
+    # arquivo inteiro, então roda aqui, em segundo plano e na fila de escrita, e o andamento fica no estado
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    inicio = time.time()
+    with _manutencao_lock:
+        _manutencao_estado['conversao_vacuo'] = {'fase': 'em_andamento', 'inicio': datetime.now().isoformat(timespec='seconds')}
+    print("Convertendo o banco para vácuo incremental (VACUUM único)...")
+    conn.executescript("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+    with _manutencao_lock:
+        _manutencao_estado['conversao_vacuo'] = dict(
+            _manutencao_estado['conversao_vacuo'], fase='concluida', duracao_segundos=round(time.time() - inicio, 3)
+        )
+
+def executar_manutencao(motivo, analisar=False):
+    # Roda pela conexão de escrita (em fila com as importações). O vácuo devolve no máximo
+    # MANUTENCAO_VACUO_PAGINAS por vez; se sobrar espaço livre, uma nova execução é agendada.
+    inicio = time.time()
+    with conexao_escrita() as conn:
+        converter_vacuo_incremental(conn)
+        cursor = conn.cursor()
+        if analisar:
+            analisar_tabela(cursor)
+            conn.commit()
+        cursor.execute("PRAGMA optimize")
+        livres = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        if livres:
+            # executescript executa o PRAGMA até o fim (execute() devolveria só uma página)
+            conn.executescript(f"PRAGMA incremental_vacuum({int(app.config['MANUTENCAO_VACUO_PAGINAS'])})")
+        restantes = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        # TRUNCATE zera o arquivo -wal quando nenhum leitor está no meio dele
+        ocupado, paginas_wal, copiadas = cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    with _manutencao_lock:
+        _manutencao_estado.update(
+            execucoes=_manutencao_estado['execucoes'] + 1,
+            ultima_execucao=datetime.now().isoformat(timespec='seconds'),
+            ultimo_motivo=motivo,
+            ultima_duracao_segundos=round(time.time() - inicio, 3),
+            paginas_devolvidas=livres - restantes,
+            checkpoint={'ocupado': bool(ocupado), 'paginas_wal': paginas_wal, 'copiadas': copiadas},
+            erro=None
+        )
+    if restantes:
+        agendar_manutencao('vácuo incremental pendente')
+
+def laco_manutencao():
+    while True:
+        disparada = _manutencao_evento.wait(app.config['MANUTENCAO_INTERVALO_S'])
+        with _manutencao_lock:
+            motivo = _manutencao_estado['pendente'] or 'periódica'
+            _manutencao_estado['pendente'] = None
+            _manutencao_evento.clear()
+        try:
+            # Na execução periódica as estatísticas são refeitas; após cargas, o próprio import já as refez
+            executar_manutencao(motivo, analisar=not disparada)
+        except Exception as e:
+            print(f"Erro na manutenção do banco: {e}")
+            with _manutencao_lock:
+                _manutencao_estado['erro'] = str(e)
+
+def iniciar_manutencao():
+    global _manutencao_thread
+    with _manutencao_lock:
+        if _manutencao_thread is None:
+            _manutencao_thread = threading.Thread(target=laco_manutencao, name='manutencao-banco', daemon=True)
+            _manutencao_thread.start()
+
+def agendar_manutencao(motivo):
+    # Acorda a thread de manutenção (criada na primeira chamada); pedidos próximos viram uma execução só
+    iniciar_manutencao()
+    with _manutencao_lock:
+        _manutencao_estado['pendente'] = motivo
+    _manutencao_evento.set()
+
+def estado_manutencao():
+    with _manutencao_lock:
+        return dict(_manutencao_estado, intervalo_segundos=app.config['MANUTENCAO_INTERVALO_S'])
+
+def estatisticas_armazenamento(conn):
+    # Páginas livres (espaço que o vácuo incremental devolve) e fragmentação interna das páginas em uso
+    tamanho_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+    paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+    livres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    estatisticas = {
+        'auto_vacuum': {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+        'tamanho_pagina': tamanho_pagina,
+        'paginas': paginas,
+        'paginas_livres': livres,
+        'livre_mb': round(livres * tamanho_pagina / (1024 * 1024), 2),
+        'paginas_livres_pct': round(livres / paginas * 100, 1) if paginas else 0,
+        'wal_mb': round(os.path.getsize(DB_FILE + '-wal') / (1024 * 1024), 2) if os.path.exists(DB_FILE + '-wal') else 0,
+    }
+    try:
+        usados, nao_usados = conn.execute("SELECT SUM(pgsize), SUM(unused) FROM dbstat").fetchone()
+        estatisticas['fragmentacao_pct'] = round(nao_usados / usados * 100, 1) if usados else 0
+    except sqlite3.OperationalError:
+        # SQLite compilado sem a tabela virtual dbstat
+        estatisticas['fragmentacao_pct'] = None
+    return estatisticas
+
+# --------------------
+# Funções utilitárias para mapping e datas
+# --------------------
+STATUS_MAP = {
+    'concluído': 'Concluído', 'concluido': 'Concluído', 'finalizado': 'Concluído',
+    'completo': 'Concluído', 'pendente': 'Pendente', 'aberto': 'Aberto',
+    'liberado': 'Liberado', 'liberada': 'Liberado', 'aprovado': 'Aprovado',
+    'em andamento': 'Em Andamento', 'processando': 'Em Andamento',
+    'cancelado': 'Cancelado', 'rejeitado': 'Rejeitado'
+}
+
+# Formatos de data aceitos em células de texto
+DATE_FORMATS = ['%d.%m.%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S']
+
+def mapear_status(status_excel):
+    if pd.isna(status_excel) or status_excel == '':
+        return 'Sem Status'
+    status = str(status_excel).strip()
+    return STATUS_MAP.get(status.lower(), status)
+
+def converter_data(data_excel):
+    if pd.isna(data_excel) or data_excel == '':
+        return None
+    try:
+        if isinstance(data_excel, str):
+            # Tenta converter string para datetime
+            for fmt in DATE_FORMATS:
+                try:
                     return datetime.strptime(data_excel, fmt).date()
                 except ValueError:
                     continue
@@ -757,40 +2108,1565 @@ def converter_data(data_excel):
     except:
         return None
 
+def converter_texto(valor):
+    # Sempre texto: mesma representação que o SQLite grava em colunas TEXT (e que a chave de sincronização compara)
+    if valor is None or pd.isna(valor):
+        return None
+    return valor if isinstance(valor, str) else str(valor)
+
+# --------------------
+# Normalização vetorizada (uma passada por coluna)
+# --------------------
+# Intervalo de seriais do Excel representável em datetime64[ns]
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+EXCEL_SERIAL_MIN, EXCEL_SERIAL_MAX = -80000, 130000
+
+def serie_para_lista(serie):
+    # NaN/NaT viram None para o sqlite
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+def normalizar_texto_serie(serie):
+    return [converter_texto(v) for v in serie.tolist()]
+
+def mapear_status_serie(serie):
+    # Lookup categórico: cada status distinto é mapeado uma vez e os códigos indexam o resultado.
+    # Código -1 (vazio/NaN) cai no último rótulo, 'Sem Status'.
+    categorias = pd.Categorical(serie)
+    rotulos = [mapear_status(c) for c in categorias.categories]
+    rotulos.append('Sem Status')
+    return np.array(rotulos, dtype=object)[categorias.codes].tolist()
+
+def detectar_formato_data(textos, amostra=200):
+    # Ordena os formatos conhecidos pelo número de acertos em uma amostra da coluna
+    exemplo = textos.iloc[:amostra]
+    acertos = []
+    for fmt in DATE_FORMATS:
+        ok = pd.to_datetime(exemplo, format=fmt, errors='coerce').notna().sum()
+        if ok:
+            acertos.append((ok, fmt))
+    return [fmt for _, fmt in sorted(acertos, key=lambda a: -a[0])]
+
+def converter_datas_serie(serie):
+    # A coluna é separada por tipo uma única vez, sem laço em Python: texto pelo acessor .str, números
+    # (seriais do Excel) por pd.to_numeric e o restante (datetime, date, Timestamp) por pd.to_datetime
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        datas = serie
+    elif pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        datas = converter_seriais_excel(serie)
+    else:
+        datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+        valores = serie.astype(object)
+        try:
+            textos = valores.str.strip()
+        except AttributeError:
+            # Nenhuma célula de texto (o acessor .str exige ao menos uma)
+            textos = pd.Series(np.nan, index=valores.index, dtype=object)
+        e_texto = textos.notna()
+        numeros = pd.to_numeric(valores.where(~e_texto), errors='coerce')
+        e_numero = numeros.notna()
+
+        # Texto: formato dominante em uma passada; os que sobrarem tentam os demais formatos
+        textos = textos[e_texto & (textos != '')]
+        pendentes = textos
+        for fmt in detectar_formato_data(textos):
+            convertidas = pd.to_datetime(pendentes, format=fmt, errors='coerce').dt.normalize()
+            ok = convertidas.notna()
+            datas.loc[convertidas.index[ok]] = convertidas[ok]
+            pendentes = pendentes[~ok]
+            if pendentes.empty:
+                break
+        # Formatos livres (raros): o pandas infere o formato de cada texto restante
+        if not pendentes.empty:
+            convertidas = pd.to_datetime(pendentes, format='mixed', errors='coerce').dt.normalize()
+            ok = convertidas.notna()
+            datas.loc[convertidas.index[ok]] = convertidas[ok]
+
+        # Números: seriais do Excel em lote
+        if e_numero.any():
+            datas.loc[e_numero] = converter_seriais_excel(numeros[e_numero])
+
+        # Demais tipos (datetime, date, Timestamp)
+        outros = valores.notna() & ~e_texto & ~e_numero
+        if outros.any():
+            datas.loc[outros] = pd.to_datetime(valores[outros], errors='coerce')
+
+    return serie_para_lista(datas.dt.strftime('%Y-%m-%d'))
+
+def converter_seriais_excel(numeros):
+    numeros = numeros.astype(float)
+    validos = numeros.between(EXCEL_SERIAL_MIN, EXCEL_SERIAL_MAX)
+    dias = np.trunc(numeros.where(validos))
+    return EXCEL_EPOCH + pd.to_timedelta(dias, unit='D')
+
+def converter_valores_serie(serie):
+    numeros = pd.to_numeric(serie, errors='coerce')
+    if not pd.api.types.is_numeric_dtype(serie):
+        # Strings no formato brasileiro ("R$ 1.234,56") convertidas com operações de string vetorizadas
+        pendentes = numeros.isna() & serie.notna()
+        if pendentes.any():
+            texto = (serie[pendentes].astype(str)
+                     .str.replace('R$', '', regex=False)
+                     .str.replace('.', '', regex=False)
+                     .str.replace(',', '.', regex=False)
+                     .str.strip())
+            numeros = numeros.astype(float)
+            numeros[pendentes] = pd.to_numeric(texto, errors='coerce')
+    return serie_para_lista(numeros.astype(float))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def extensao(caminho):
+    return caminho.rsplit('.', 1)[-1].lower()
+
+# --------------------
+# Motor de importação (colunar, em lotes e em uma única transação)
+# --------------------
+# Mapeamento de colunas do DB para as colunas do arquivo. O próprio nome da coluna no DB vem
+# primeiro: exportações automáticas (CSV/Parquet/NDJSON) usam esses nomes e não podem cair na
+# heurística de substring (ex.: 'COTACAO' casaria com STATUS_COTACAO).
+MAPPING_KEYS = {
+    'descricao_operacao': ['DESCRICAO_OPERACAO', 'DESCR', 'DESCRI', 'OPERACAO'],
+    'status_cotacao': ['STATUS_COTACAO', 'STATUS COT', 'STATUS_COT', 'STATUSCOTACAO', 'COTACAO STATUS'],
+    'status': ['STATUS'],
+    'denominacao_produto': ['DENOMINACAO_PRODUTO', 'PRODUTO', 'DENOMINACAO PRODUTO'],
+    'nome_emissor_ordem': ['NOME_EMISSOR_ORDEM', 'CLIENTE', 'NOME', 'EMISSOR', 'NOME EMISSOR'],
+    'valor_pedido_bruto': ['VALOR_PEDIDO_BRUTO', 'VALOR', 'TOTAL', 'PRECO', 'VALOR PEDIDO'],
+    'criado_em': ['CRIADO_EM', 'CRIADO', 'DATA', 'DATA CRIACAO'],
+    'numero_circuito': ['NUMERO_CIRCUITO', 'NUMERO CIRCUITO', 'CIRCUITO'],
+    'numero_cotacao': ['NUMERO_COTACAO', 'NUMERO COTACAO', 'COTACAO']
+}
+
+# Colunas gravadas pela importação (as demais ficam com o valor padrão do schema)
+IMPORT_COLUMNS = [
+    'descricao_operacao', 'numero_cotacao', 'numero_circuito', 'status_cotacao',
+    'denominacao_produto', 'status', 'valor_pedido_bruto', 'criado_em', 'nome_emissor_ordem'
+]
+
+IMPORT_MODES = ('substituir', 'adicionar', 'sincronizar', 'inserir')
+
+def insert_sql(tabela='ordens_servico', carga_id=None):
+    # A carga é a mesma para todas as linhas do INSERT: vai como literal, não como parâmetro por linha
+    return 'INSERT INTO {} ({}, hash_conteudo, carga_id) VALUES ({}, {})'.format(
+        tabela, ', '.join(coluna_fisica(c) for c in IMPORT_COLUMNS), ','.join('?' * (len(IMPORT_COLUMNS) + 1)),
+        'NULL' if carga_id is None else int(carga_id)
+    )
+
+UPDATE_SQL = 'UPDATE ordens_servico SET {}, hash_conteudo = ?, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?'.format(
+    ', '.join(f'{coluna_fisica(c)} = ?' for c in IMPORT_COLUMNS)
+)
+
+def resolver_colunas(colunas):
+    # Mapeia cada coluna do DB para o nome da coluna correspondente na planilha
+    col_map = {}
+    cols_upper = {str(c).upper(): c for c in colunas}
+
+    for db_col, excel_keys in MAPPING_KEYS.items():
+        for key in excel_keys:
+            key_upper = key.upper()
+            if key_upper in cols_upper:
+                col_map[db_col] = cols_upper[key_upper]
+                break
+            # Heurística de substring
+            for col_name_upper, col_name_raw in cols_upper.items():
+                if key_upper in col_name_upper:
+                    col_map[db_col] = col_name_raw
+                    break
+            if db_col in col_map:
+                break
+    return col_map
+
+def normalizar_colunas(df, col_map):
+    # Extrai cada coluna mapeada uma única vez e normaliza a coluna inteira de uma vez
+    total = len(df)
+
+    def coluna(chave):
+        if chave in col_map and col_map[chave] in df.columns:
+            return df[col_map[chave]].reset_index(drop=True)
+        return pd.Series([None] * total, dtype=object)
+
+    return {
+        'descricao_operacao': normalizar_texto_serie(coluna('descricao_operacao')),
+        'numero_cotacao': normalizar_texto_serie(coluna('numero_cotacao')),
+        'numero_circuito': normalizar_texto_serie(coluna('numero_circuito')),
+        'status_cotacao': normalizar_texto_serie(coluna('status_cotacao')),
+        'denominacao_produto': normalizar_texto_serie(coluna('denominacao_produto')),
+        'status': mapear_status_serie(coluna('status')),
+        'valor_pedido_bruto': converter_valores_serie(coluna('valor_pedido_bruto')),
+        'criado_em': converter_datas_serie(coluna('criado_em')),
+        'nome_emissor_ordem': normalizar_texto_serie(coluna('nome_emissor_ordem')),
+    }
+
+def nomes_cabecalho(cabecalho):
+    # Mesmo tratamento do pandas: strip, colunas sem nome e nomes repetidos
+    nomes = []
+    vistos = {}
+    for i, c in enumerate(cabecalho):
+        nome = str(c).strip() if c is not None else f'Unnamed: {i}'
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f'{nome}.{vistos[nome]}'
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+def ler_planilha_em_blocos(caminho, chunk_size, aba=None):
+    # Lê a aba (por padrão a primeira) em modo read-only, devolvendo DataFrames de no máximo chunk_size linhas.
+    # Apenas um bloco fica em memória por vez, independente do tamanho do arquivo.
+    wb = openpyxl.load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        ws = wb[aba] if aba is not None else wb.worksheets[0]
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = nomes_cabecalho(cabecalho)
+        while True:
+            bloco = list(islice(linhas, chunk_size))
+            if not bloco:
+                break
+            # Ignora linhas totalmente vazias (formatação residual no fim da planilha)
+            bloco = [linha for linha in bloco if any(v is not None for v in linha)]
+            if bloco:
+                yield pd.DataFrame.from_records(bloco, columns=colunas)
+    finally:
+        wb.close()
+
+def ler_planilha(caminho, chunk_size, aba=None):
+    # Escolhe o leitor: streaming para .xlsx, pandas (arquivo inteiro) para .xls
+    if app.config['IMPORT_STREAMING'] and extensao(caminho) == 'xlsx':
+        return ler_planilha_em_blocos(caminho, chunk_size, aba)
+    df = pd.read_excel(caminho, sheet_name=aba if aba is not None else 0,
+                       engine='openpyxl' if extensao(caminho) == 'xlsx' else None)
+    df.columns = [str(c).strip() for c in df.columns]
+    return [df]
+
+def amostra_texto(caminho, tamanho=64 * 1024):
+    # Primeiros bytes do arquivo decodificados; sem UTF-8 válido assume latin-1 (exportações do Excel/ERP)
+    with open(caminho, 'rb') as origem:
+        amostra = origem.read(tamanho)
+    try:
+        # O decoder incremental tolera um caractere multibyte cortado no fim da amostra
+        return codecs.getincrementaldecoder('utf-8-sig')().decode(amostra, final=False), 'utf-8', len(amostra)
+    except UnicodeDecodeError:
+        return amostra.decode('latin-1'), 'latin-1', len(amostra)
+
+def detectar_csv(caminho):
+    texto, encoding, _ = amostra_texto(caminho)
+    primeira_linha = texto.splitlines()[0] if texto else ''
+    try:
+        separador = csv.Sniffer().sniff(primeira_linha, delimiters=',;\t|').delimiter
+    except csv.Error:
+        separador = ','
+    cabecalho = next(csv.reader([primeira_linha], delimiter=separador), [])
+    return separador, encoding, cabecalho
+
+def ler_csv_em_blocos(caminho, chunk_size):
+    # Todas as colunas como texto: a normalização vetorizada converte valores e datas, e a inferência
+    # por bloco do leitor não quebra quando uma coluna vazia no início ganha valores mais adiante.
+    separador, encoding, cabecalho = detectar_csv(caminho)
+    if pacsv is not None:
+        leitor = pacsv.open_csv(
+            caminho,
+            read_options=pacsv.ReadOptions(encoding='utf8' if encoding == 'utf-8' else encoding),
+            parse_options=pacsv.ParseOptions(delimiter=separador),
+            convert_options=pacsv.ConvertOptions(
+                column_types={nome: pa.string() for nome in cabecalho},
+                strings_can_be_null=True
+            )
+        )
+        for lote in leitor:
+            if lote.num_rows:
+                df = lote.to_pandas()
+                df.columns = [str(c).strip().lstrip('\ufeff') for c in df.columns]
+                yield df
+    else:
+        for df in pd.read_csv(caminho, sep=separador, encoding='utf-8-sig' if encoding == 'utf-8' else encoding,
+                              dtype=str, chunksize=chunk_size, engine='c'):
+            df.columns = [str(c).strip() for c in df.columns]
+            yield df
+
+def ler_parquet_em_blocos(caminho, chunk_size):
+    if pq is None:
+        raise ValueError('Leitura de Parquet requer o pacote pyarrow instalado no servidor')
+    for lote in pq.ParquetFile(caminho).iter_batches(batch_size=chunk_size):
+        df = lote.to_pandas()
+        df.columns = [str(c).strip() for c in df.columns]
+        yield df
+
+def ler_ndjson_em_blocos(caminho, chunk_size):
+    with pd.read_json(caminho, lines=True, chunksize=chunk_size, dtype=False, convert_dates=False) as leitor:
+        for df in leitor:
+            df.columns = [str(c).strip() for c in df.columns]
+            yield df
+
+def ler_arquivo(caminho, chunk_size, aba=None):
+    # Ponto único de leitura: cada formato usa o leitor mais rápido disponível, sempre em blocos
+    ext = extensao(caminho)
+    if ext in EXCEL_EXTENSIONS:
+        return ler_planilha(caminho, chunk_size, aba)
+    if ext == 'csv':
+        return ler_csv_em_blocos(caminho, chunk_size)
+    if ext == 'parquet':
+        return ler_parquet_em_blocos(caminho, chunk_size)
+    if ext in ('ndjson', 'jsonl'):
+        return ler_ndjson_em_blocos(caminho, chunk_size)
+    raise ValueError(f'Formato não suportado: .{ext}')
+
+def listar_abas(caminho):
+    ext = extensao(caminho)
+    if ext == 'xlsx':
+        wb = openpyxl.load_workbook(caminho, read_only=True)
+        try:
+            return list(wb.sheetnames)
+        finally:
+            wb.close()
+    if ext == 'xls':
+        return list(pd.ExcelFile(caminho).sheet_names)
+    # Formatos planos têm uma única "aba"
+    return ['dados']
+
+def hash_linha(linha):
+    # Hash do conteúdo normalizado; None é distinto de texto vazio
+    texto = '\x1f'.join('\x00' if v is None else str(v) for v in linha)
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
+
+def codificar_dimensoes(cursor, colunas, dimensoes):
+    # Troca o texto das colunas de dimensão pelas chaves inteiras, criando os valores novos.
+    # dimensoes é o cache valor -> id da importação: cada tabela é lida uma vez por carga.
+    codigos = {}
+    for coluna in IMPORT_COLUMNS:
+        if coluna not in DIMENSOES:
+            continue
+        tabela = DIMENSOES[coluna]
+        mapa = dimensoes.get(coluna)
+        if mapa is None:
+            mapa = dimensoes[coluna] = {valor: id_ for id_, valor in cursor.execute(f"SELECT id, valor FROM {tabela}")}
+        for valor in set(colunas[coluna]) - mapa.keys():
+            if valor is not None:
+                cursor.execute(f"INSERT INTO {tabela} (valor, chave_busca) VALUES (?, ?)", (valor, chave_busca(valor)))
+                mapa[valor] = cursor.lastrowid
+        codigos[coluna] = [None if valor is None else mapa[valor] for valor in colunas[coluna]]
+    return codigos
+
+def linhas_com_hash(colunas, codigos=None):
+    # O hash é sempre do texto normalizado; a linha gravada leva as chaves das dimensões (codigos)
+    codigos = codigos or {}
+    gravadas = zip(*(codigos.get(c, colunas[c]) for c in IMPORT_COLUMNS))
+    for linha, valores in zip(zip(*(colunas[c] for c in IMPORT_COLUMNS)), gravadas):
+        yield valores + (hash_linha(linha),)
+
+def gravar_colunas(cursor, colunas, chunk_size, dimensoes, tabela='ordens_servico', carga_id=None):
+    # Monta as linhas a partir das colunas e grava com executemany em lotes
+    # Na tabela ativa o resumo recebe as linhas novas (ids acima do maior anterior); a staging
+    # tem o resumo recalculado inteiro na troca
+    sql = insert_sql(tabela, carga_id)
+    linhas = linhas_com_hash(colunas, codificar_dimensoes(cursor, colunas, dimensoes))
+    id_antes = cursor.execute(f"SELECT IFNULL(MAX(id), 0) FROM {tabela}").fetchone()[0]
+    inseridas = 0
+    while True:
+        lote = list(islice(linhas, chunk_size))
+        if not lote:
+            break
+        cursor.executemany(sql, lote)
+        inseridas += len(lote)
+    if inseridas and tabela == 'ordens_servico':
+        atualizar_resumo(cursor, "WHERE o.id > ?", (id_antes,))
+    return inseridas
+
+def estimar_linhas(caminho, aba=None):
+    # Total aproximado de linhas sem percorrer o arquivo: dimensão da aba, metadados do Parquet
+    # ou, nos formatos de texto, o tamanho do arquivo dividido pelo tamanho médio de linha da amostra
+    ext = extensao(caminho)
+    try:
+        if ext == 'xlsx':
+            wb = openpyxl.load_workbook(caminho, read_only=True)
+            try:
+                max_row = (wb[aba] if aba is not None else wb.worksheets[0]).max_row
+            finally:
+                wb.close()
+            return max(max_row - 1, 0) if max_row else None
+        if ext == 'parquet' and pq is not None:
+            return pq.ParquetFile(caminho).metadata.num_rows
+        if ext in ('csv', 'ndjson', 'jsonl'):
+            texto, _, lidos = amostra_texto(caminho)
+            linhas = texto.count('\n')
+            if not linhas:
+                return None
+            total = int(os.path.getsize(caminho) / (lidos / linhas))
+            return max(total - 1, 0) if ext == 'csv' else total
+    except Exception:
+        return None
+    return None
+
+def chave_negocio(valores):
+    # Partes da chave vazias ou só com espaços contam como ausentes
+    return tuple(None if v is None or (isinstance(v, str) and not v.strip()) else v for v in valores)
+
+def carregar_chaves(cursor, chaves, id_minimo=0, existentes=None, usadas=False):
+    # chave de negócio -> [[id, hash, usada], ...] das linhas já gravadas, em ordem de id; chaves
+    # repetidas guardam todas as linhas.
+    # Colunas de dimensão entram na chave pelo id, como nas linhas montadas por linhas_com_hash.
+    existentes = {} if existentes is None else existentes
+    cursor.execute(
+        f"SELECT id, {', '.join(coluna_fisica(c) for c in chaves)}, hash_conteudo FROM ordens_servico WHERE id > ? ORDER BY id",
+        (id_minimo,)
+    )
+    for row in cursor.fetchall():
+        existentes.setdefault(chave_negocio(row[1:-1]), []).append([row[0], row[-1], usadas])
+    return existentes
+
+def sincronizar_colunas(cursor, colunas, existentes, chaves, chunk_size, dimensoes, atualizar=True, carga_id=None):
+    # Insere chaves novas, atualiza as que mudaram de hash e ignora as inalteradas.
+    # Chaves repetidas não são colapsadas: cada linha do arquivo consome uma linha gravada da mesma
+    # chave, primeiro as de hash igual (inalteradas) e depois as demais em ordem de id (atualizadas);
+    # o que sobrar do arquivo é inserido. Linhas sem nenhuma parte da chave só casam por hash igual.
+    # Com atualizar=False (modo inserir) as linhas já existentes nunca são alteradas.
+    # Linhas atualizadas continuam na carga que as inseriu.
+    indices_chave = [IMPORT_COLUMNS.index(c) for c in chaves]
+    novas, alteradas = [], []
+    inalteradas = 0
+    por_chave = {}
+    for linha in linhas_com_hash(colunas, codificar_dimensoes(cursor, colunas, dimensoes)):
+        por_chave.setdefault(chave_negocio(linha[i] for i in indices_chave), []).append(linha)
+
+    for chave, linhas in por_chave.items():
+        livres = [entrada for entrada in existentes.get(chave, ()) if not entrada[2]]
+        por_hash = {}
+        for entrada in livres:
+            por_hash.setdefault(entrada[1], []).append(entrada)
+        pendentes = []
+        for linha in linhas:
+            iguais = por_hash.get(linha[-1])
+            if iguais:
+                iguais.pop(0)[2] = True
+                inalteradas += 1
+            else:
+                pendentes.append(linha)
+        # Sem chave não há como saber qual linha gravada a nova substitui: o restante é inserido
+        livres = [entrada for entrada in livres if not entrada[2]] if any(v is not None for v in chave) else []
+        for linha, entrada in zip(pendentes, livres):
+            entrada[2] = True
+            if atualizar:
+                alteradas.append(linha + (entrada[0],))
+                entrada[1] = linha[-1]
+            else:
+                inalteradas += 1
+        novas.extend(pendentes[len(livres):])
+
+    # O resumo perde a versão antiga das linhas alteradas e ganha a nova (ids em grupos de 500 parâmetros)
+    for inicio in range(0, len(alteradas), 500):
+        grupo = alteradas[inicio:inicio + 500]
+        ids = [linha[-1] for linha in grupo]
+        filtro = f"WHERE o.id IN ({','.join('?' * len(ids))})"
+        atualizar_resumo(cursor, filtro, ids, -1)
+        cursor.executemany(UPDATE_SQL, grupo)
+        atualizar_resumo(cursor, filtro, ids)
+    if novas:
+        id_antes = cursor.execute("SELECT IFNULL(MAX(id), 0) FROM ordens_servico").fetchone()[0]
+        for inicio in range(0, len(novas), chunk_size):
+            cursor.executemany(insert_sql(carga_id=carga_id), novas[inicio:inicio + chunk_size])
+        atualizar_resumo(cursor, "WHERE o.id > ?", (id_antes,))
+        # Registra os ids recém-criados (já usados) para que blocos seguintes não casem com eles
+        carregar_chaves(cursor, chaves, id_antes, existentes, usadas=True)
+    return len(novas), len(alteradas), inalteradas
+
+def descartar_staging(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(f"DROP TABLE IF EXISTS {BUSCA_STAGING_TABLE}")
+    for staging in RESUMOS_STAGING.values():
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+
+def preparar_staging(cursor):
+    # Descarta sobras de uma carga interrompida e cria a tabela de staging vazia, sem índices.
+    # A sequência AUTOINCREMENT parte da tabela ativa: ids de ordens substituídas não voltam a ser usados.
+    descartar_staging(cursor)
+    cursor.execute(ddl_ordens_servico(STAGING_TABLE))
+    cursor.execute(
+        "INSERT INTO sqlite_sequence (name, seq) "
+        "SELECT ?, seq FROM sqlite_sequence WHERE name = 'ordens_servico'", (STAGING_TABLE,)
+    )
+
+def promover_staging(conn):
+    # Índices, estatísticas, resumos e a lista de dimensões órfãs são montados sobre a staging já
+    # carregada; a troca em si é uma transação curta (DROP + RENAME) e os leitores nunca veem carga parcial.
+    cursor = conn.cursor()
+    criar_indices(cursor, STAGING_TABLE)
+    analisar_tabela(cursor, STAGING_TABLE)
+    # O índice de busca da carga é montado de uma vez (bem mais rápido que gatilho linha a linha)
+    colunas_busca = ', '.join(c for c, _ in BUSCA_COLUMNS)
+    cursor.execute(ddl_busca(BUSCA_STAGING_TABLE))
+    cursor.execute(f"INSERT INTO {BUSCA_STAGING_TABLE}(rowid, {colunas_busca}) "
+                   f"SELECT id, {colunas_busca} FROM ({select_ordens(STAGING_TABLE)})")
+    cursor.execute(f"INSERT INTO {BUSCA_STAGING_TABLE}({BUSCA_STAGING_TABLE}) VALUES ('optimize')")
+    cursor.execute(ddl_resumo(RESUMOS_STAGING['resumo_ordens']))
+    cursor.execute(ddl_resumo_diario(RESUMOS_STAGING['resumo_diario']))
+    atualizar_resumo(cursor, tabela=STAGING_TABLE, resumos=RESUMOS_STAGING)
+    # Sem outro escritor (conexao_escrita), o que é órfão para a staging continua órfão até a troca
+    orfas = dimensoes_orfas(cursor, STAGING_TABLE)
+    conn.commit()
+
+    # legacy_alter_table evita que o RENAME tente reescrever views/triggers que apontam para a tabela removida
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        sequencia = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ordens_servico'").fetchone()
+        cursor.execute("DROP TABLE ordens_servico")
+        cursor.execute(f"DROP TABLE {BUSCA_TABLE}")
+        cursor.execute(f"ALTER TABLE {STAGING_TABLE} RENAME TO ordens_servico")
+        cursor.execute(f"ALTER TABLE {BUSCA_STAGING_TABLE} RENAME TO {BUSCA_TABLE}")
+        for resumo, staging in RESUMOS_STAGING.items():
+            cursor.execute(f"DROP TABLE {resumo}")
+            cursor.execute(f"ALTER TABLE {staging} RENAME TO {resumo}")
+        # O DROP leva a linha da tabela antiga em sqlite_sequence: a nova continua de onde ela parou
+        if sequencia and not cursor.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'ordens_servico'", sequencia
+        ).rowcount:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('ordens_servico', ?)", sequencia)
+        # Os gatilhos de busca foram removidos junto com a tabela antiga
+        criar_gatilhos_busca(cursor)
+        # O RENAME não leva as estatísticas do ANALYZE junto
+        cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'ordens_servico'")
+        cursor.execute(f"UPDATE sqlite_stat1 SET tbl = 'ordens_servico' WHERE tbl = '{STAGING_TABLE}'")
+        remover_dimensoes_orfas(cursor, orfas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table = OFF")
+
+def truncar_ordens(conn):
+    # Esvazia ordens_servico trocando-a por uma staging vazia (DROP + RENAME, mesmo caminho do
+    # modo substituir): bem mais rápido que DELETE linha a linha com os gatilhos da busca.
+    # Como no DELETE, a sequência de ids é mantida: ordens gravadas depois de limpar não reaproveitam
+    # ids das apagadas (referências antigas, como exportações ou logs, não passam a apontar para outra ordem).
+    preparar_staging(conn.cursor())
+    conn.commit()
+    promover_staging(conn)
+
+def normalizar_blocos(blocos):
+    # O mapeamento de colunas é resolvido uma vez, a partir do cabeçalho do primeiro bloco
+    col_map = None
+    for df in blocos:
+        if col_map is None:
+            col_map = resolver_colunas(df.columns)
+        yield normalizar_colunas(df, col_map)
+
+def iniciar_carga(conn, carga, modo):
+    # Registro da carga em transação própria: o id existe antes das linhas e sobrevive a uma falha
+    cursor = conn.execute(
+        "INSERT INTO cargas (origem, modo, arquivo, hash_arquivo) VALUES (?, ?, ?, ?)",
+        (carga.get('origem', 'upload'), modo, carga.get('arquivo'), carga.get('hash_arquivo'))
+    )
+    conn.commit()
+    marcar_dados_alterados()
+    carga['id'] = cursor.lastrowid
+    return carga['id']
+
+def finalizar_carga(conn, carga_id, contagem, inicio, erro=None):
+    conn.execute(
+        "UPDATE cargas SET status = ?, inseridos = ?, atualizados = ?, inalterados = ?, "
+        "concluido_em = CURRENT_TIMESTAMP, tempo_segundos = ?, erro = ? WHERE id = ?",
+        ('erro' if erro else 'concluida', contagem['inseridos'], contagem['atualizados'], contagem['inalterados'],
+         round(time.time() - inicio, 3), erro, carga_id)
+    )
+    conn.commit()
+
+def importar_blocos(conn, lotes, modo, chunk_size, progresso=None, commit_por_lote=False, lote_gravado=None, carga=None):
+    # Grava cada lote normalizado assim que é produzido, tudo em uma única transação.
+    # No modo substituir a carga vai para a tabela de staging, trocada pela ativa no final.
+    # Com commit_por_lote cada lote é uma transação (API bulk): uma falha desfaz só o lote corrente.
+    # carga: {'origem', 'arquivo', 'hash_arquivo'} registrados em cargas; recebe o 'id' criado.
+    contagem = {'inseridos': 0, 'atualizados': 0, 'inalterados': 0}
+    chaves = app.config['SYNC_KEY_COLUMNS']
+    tabela = STAGING_TABLE if modo == 'substituir' else 'ordens_servico'
+    dimensoes = {}
+    inicio = time.time()
+    carga_id = iniciar_carga(conn, carga, modo) if carga is not None else None
+    try:
+        cursor = conn.cursor()
+        if modo == 'substituir':
+            preparar_staging(cursor)
+        existentes = carregar_chaves(cursor, chaves) if modo in ('sincronizar', 'inserir') else None
+        for colunas in lotes:
+            if existentes is None:
+                contagem['inseridos'] += gravar_colunas(cursor, colunas, chunk_size, dimensoes, tabela, carga_id)
+            else:
+                inseridas, atualizadas, inalteradas = sincronizar_colunas(
+                    cursor, colunas, existentes, chaves, chunk_size, dimensoes,
+                    atualizar=modo == 'sincronizar', carga_id=carga_id
+                )
+                contagem['inseridos'] += inseridas
+                contagem['atualizados'] += atualizadas
+                contagem['inalterados'] += inalteradas
+            if commit_por_lote and modo != 'substituir':
+                conn.commit()
+                marcar_dados_alterados()
+            if progresso:
+                progresso(sum(contagem.values()))
+            if lote_gravado:
+                lote_gravado(dict(contagem))
+        conn.commit()
+        if modo == 'substituir':
+            promover_staging(conn)
+        elif contagem['inseridos'] or contagem['atualizados']:
+            # Cargas incrementais também mudam a distribuição dos dados vista pelo planejador
+            cursor = conn.cursor()
+            if contagem['atualizados']:
+                remover_dimensoes_orfas(cursor)
+            analisar_tabela(cursor)
+            conn.commit()
+        if carga_id is not None:
+            finalizar_carga(conn, carga_id, contagem, inicio)
+        if modo == 'substituir' or contagem['inseridos'] + contagem['atualizados'] >= app.config['MANUTENCAO_LINHAS']:
+            # A tabela antiga (substituir) ou a carga grande deixam páginas livres e um WAL grande para trás
+            agendar_manutencao(f'importação ({modo})')
+    except Exception as e:
+        conn.rollback()
+        if modo == 'substituir':
+            descartar_staging(conn.cursor())
+            conn.commit()
+        if carga_id is not None:
+            # Com commit_por_lote os lotes anteriores ao erro ficam gravados (e contados)
+            finalizar_carga(conn, carga_id, contagem if commit_por_lote else dict.fromkeys(contagem, 0), inicio, str(e))
+        raise
+    finally:
+        marcar_dados_alterados()
+    return contagem
+
+# --------------------
+# Cache de uploads por conteúdo (arquivo + snapshot colunar já normalizado)
+# --------------------
+SNAPSHOT_VERSION = 2  # Incrementar quando o formato do arquivo de snapshot mudar
+
+def fonte_funcao(funcao):
+    try:
+        return inspect.getsource(funcao)
+    except (OSError, TypeError):
+        # Executável empacotado sem o código-fonte: o bytecode também muda junto com a função
+        return marshal.dumps(funcao.__code__).hex()
+
+def assinatura_normalizacao():
+    # Hash das tabelas e do código que decidem o conteúdo de um snapshot (leitura, mapeamento de colunas
+    # e conversões): qualquer mudança na normalização invalida os snapshots antigos sozinha
+    partes = [repr(v) for v in (
+        MAPPING_KEYS, STATUS_MAP, DATE_FORMATS, IMPORT_COLUMNS, EXCEL_SERIAL_MIN, EXCEL_SERIAL_MAX
+    )]
+    partes += [fonte_funcao(f) for f in (
+        ler_arquivo, ler_planilha, ler_planilha_em_blocos, ler_csv_em_blocos, ler_parquet_em_blocos,
+        ler_ndjson_em_blocos, nomes_cabecalho, resolver_colunas, normalizar_colunas, normalizar_texto_serie,
+        converter_texto, mapear_status_serie, mapear_status, detectar_formato_data, converter_datas_serie,
+        converter_data, converter_seriais_excel, converter_valores_serie, serie_para_lista
+    )]
+    return hashlib.sha256('\n'.join(partes).encode('utf-8')).hexdigest()[:12]
+
+NORMALIZACAO_ASSINATURA = assinatura_normalizacao()
+
+def salvar_upload(file, ext):
+    # Grava o upload com o sha256 do conteúdo como nome; arquivos idênticos ocupam um só lugar
+    temporario = os.path.join(app.config['UPLOAD_FOLDER'], f'.{uuid.uuid4().hex}.tmp')
+    digest = hashlib.sha256()
+    with open(temporario, 'wb') as destino:
+        for bloco in iter(lambda: file.stream.read(1024 * 1024), b''):
+            digest.update(bloco)
+            destino.write(bloco)
+    hash_arquivo = digest.hexdigest()
+    caminho = os.path.join(app.config['UPLOAD_FOLDER'], f'{hash_arquivo}.{ext}')
+    if os.path.exists(caminho):
+        os.remove(temporario)
+        os.utime(caminho)
+    else:
+        os.replace(temporario, caminho)
+    return hash_arquivo, caminho
+
+def caminho_snapshot(hash_arquivo, indice_aba=0, pasta=None):
+    ext = 'parquet' if pq is not None else 'pkl'
+    pasta = pasta or app.config['SNAPSHOT_FOLDER']
+    return os.path.join(pasta, f'{hash_arquivo}-s{indice_aba}-v{SNAPSHOT_VERSION}-{NORMALIZACAO_ASSINATURA}.{ext}')
+
+def schema_snapshot():
+    return pa.schema([
+        (c, pa.float64() if c == 'valor_pedido_bruto' else pa.string()) for c in IMPORT_COLUMNS
+    ])
+
+def ler_snapshot(caminho, chunk_size):
+    os.utime(caminho)
+    if caminho.endswith('.parquet'):
+        arquivo = pq.ParquetFile(caminho)
+        for lote in arquivo.iter_batches(batch_size=chunk_size, columns=IMPORT_COLUMNS):
+            yield lote.to_pydict()
+    else:
+        with open(caminho, 'rb') as origem:
+            while True:
+                try:
+                    yield pickle.load(origem)
+                except EOFError:
+                    break
+
+def gravar_snapshot(lotes, caminho):
+    # Repassa os lotes normalizados adiante e grava cada um no snapshot; o arquivo só
+    # aparece com o nome final se a leitura terminar, então snapshots parciais nunca são usados.
+    temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+    parquet = caminho.endswith('.parquet')
+    writer = None
+    concluido = False
+    try:
+        if parquet:
+            writer = pq.ParquetWriter(temporario, schema_snapshot(), compression='zstd')
+        else:
+            writer = open(temporario, 'wb')
+        for colunas in lotes:
+            if parquet:
+                writer.write_table(pa.Table.from_pydict(colunas, schema=schema_snapshot()))
+            else:
+                pickle.dump(colunas, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            yield colunas
+        concluido = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if concluido:
+            os.replace(temporario, caminho)
+        elif os.path.exists(temporario):
+            os.remove(temporario)
+
+def blocos_reconhecidos(caminho, chunk_size, aba=None):
+    # Blocos da aba, ou None se ela estiver vazia ou sem nenhuma coluna reconhecida (ex.: instruções,
+    # tabelas auxiliares). Regra única dos dois caminhos de leitura: uma aba assim nunca gera snapshot.
+    blocos = iter(ler_arquivo(caminho, chunk_size, aba))
+    primeiro = next(blocos, None)
+    if primeiro is None or not resolver_colunas(primeiro.columns):
+        return None
+    return chain([primeiro], blocos)
+
+def lotes_do_arquivo(caminho, hash_arquivo, chunk_size):
+    # Reaproveita o snapshot de um upload idêntico; senão lê a planilha e grava o snapshot
+    snapshot = caminho_snapshot(hash_arquivo)
+    if os.path.exists(snapshot):
+        return ler_snapshot(snapshot, chunk_size), True
+    blocos = blocos_reconhecidos(caminho, chunk_size)
+    if blocos is None:
+        raise ValueError('Planilha vazia ou sem nenhuma coluna reconhecida')
+    return gravar_snapshot(normalizar_blocos(blocos), snapshot), False
+
+def preparar_aba(caminho, aba, snapshot, chunk_size):
+    # Executa em um processo do pool: lê e normaliza uma aba inteira direto para o snapshot.
+    # Só metadados voltam ao processo principal, que depois grava os snapshots em streaming.
+    inicio = time.perf_counter()
+    blocos = blocos_reconhecidos(caminho, chunk_size, aba)
+    if blocos is None:
+        return {'aba': aba, 'ignorada': True, 'linhas': 0, 'tempo_leitura_segundos': round(time.perf_counter() - inicio, 3)}
+    linhas = 0
+    for colunas in gravar_snapshot(normalizar_blocos(blocos), snapshot):
+        linhas += len(colunas['status'])
+    return {'aba': aba, 'ignorada': False, 'linhas': linhas, 'tempo_leitura_segundos': round(time.perf_counter() - inicio, 3)}
+
+_parse_executor = None
+_parse_executor_lock = threading.Lock()
+
+def parse_executor():
+    # Leitura de planilha é CPU-bound e presa ao GIL: cada aba vai para um processo separado
+    global _parse_executor
+    with _parse_executor_lock:
+        if _parse_executor is None:
+            _parse_executor = ProcessPoolExecutor(
+                max_workers=app.config['PARSE_PROCESSES'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _parse_executor
+
+def aplicar_retencao_uploads(em_uso=()):
+    # Descarta os uploads (e seus snapshots) usados há mais tempo até caber em UPLOAD_CACHE_MAX_MB
+    limite = app.config['UPLOAD_CACHE_MAX_MB'] * 1024 * 1024
+    grupos = {}
+    for pasta in (app.config['UPLOAD_FOLDER'], app.config['SNAPSHOT_FOLDER']):
+        for entrada in os.scandir(pasta):
+            if not entrada.is_file() or entrada.name.startswith('.'):
+                continue
+            hash_arquivo = entrada.name.split('.', 1)[0].split('-', 1)[0]
+            info = entrada.stat()
+            grupo = grupos.setdefault(hash_arquivo, {'tamanho': 0, 'uso': 0, 'arquivos': []})
+            grupo['tamanho'] += info.st_size
+            grupo['uso'] = max(grupo['uso'], info.st_mtime)
+            grupo['arquivos'].append(entrada.path)
+
+    total = sum(g['tamanho'] for g in grupos.values())
+    for hash_arquivo, grupo in sorted(grupos.items(), key=lambda item: item[1]['uso']):
+        if total <= limite:
+            break
+        if hash_arquivo in em_uso:
+            continue
+        for caminho in grupo['arquivos']:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        total -= grupo['tamanho']
+
+# --------------------
+# Importação em segundo plano (jobs)
+# --------------------
+_import_executor = ThreadPoolExecutor(max_workers=app.config['IMPORT_WORKERS'], thread_name_prefix='importacao')
+_import_jobs = {}
+_import_jobs_lock = threading.Lock()
+
+class ImportJob:
+    def __init__(self, arquivo, modo, hashes=()):
+        self.id = uuid.uuid4().hex
+        self.arquivo = arquivo
+        self.modo = modo
+        self.hashes = list(hashes)
+        self.cache = False
+        self.abas = []
+        self.fase = 'na_fila'
+        self.linhas_processadas = 0
+        self.total_estimado = None
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.concluido_em = None
+        self.resultado = None
+        self.erro = None
+
+    def atualizar_progresso(self, fase=None, linhas=None, total=None):
+        with _import_jobs_lock:
+            if fase:
+                self.fase = fase
+                if fase == 'importando' and self.iniciado_em is None:
+                    self.iniciado_em = time.time()
+                if fase in ('concluido', 'erro'):
+                    self.concluido_em = time.time()
+            if linhas is not None:
+                self.linhas_processadas = linhas
+            if total is not None:
+                self.total_estimado = total
+
+    def to_dict(self):
+        with _import_jobs_lock:
+            fim = self.concluido_em or time.time()
+            decorrido = fim - self.iniciado_em if self.iniciado_em else 0
+            vazao = self.linhas_processadas / decorrido if decorrido > 0 else 0
+            eta = None
+            if self.fase == 'importando' and self.total_estimado and vazao > 0:
+                eta = max(self.total_estimado - self.linhas_processadas, 0) / vazao
+            return {
+                'job_id': self.id,
+                'arquivo': self.arquivo,
+                'modo': self.modo,
+                'hashes': self.hashes,
+                'cache': self.cache,
+                'abas': self.abas,
+                'fase': self.fase,
+                'linhas_processadas': self.linhas_processadas,
+                'total_estimado': self.total_estimado,
+                'percentual': round(min(self.linhas_processadas / self.total_estimado, 1) * 100, 1) if self.total_estimado else None,
+                'linhas_por_segundo': round(vazao, 1),
+                'eta_segundos': round(eta, 1) if eta is not None else None,
+                'decorrido_segundos': round(decorrido, 2),
+                'resultado': self.resultado,
+                'erro': self.erro
+            }
+
+def registrar_job(job):
+    with _import_jobs_lock:
+        _import_jobs[job.id] = job
+        # Descarta os jobs finalizados mais antigos além do limite de histórico
+        finalizados = sorted(
+            (j for j in _import_jobs.values() if j.fase in ('concluido', 'erro')),
+            key=lambda j: j.criado_em
+        )
+        for antigo in finalizados[:max(len(finalizados) - app.config['IMPORT_JOBS_HISTORY'], 0)]:
+            del _import_jobs[antigo.id]
+
+def gravar_importacao(job, lotes, chunk_size, descricao='Arquivo processado com sucesso.'):
+    # Etapa comum aos jobs: grava os lotes sob o lock de escrita e monta o resultado
+    job.atualizar_progresso(fase='aguardando_escrita')
+    carga = {'origem': 'upload', 'arquivo': job.arquivo, 'hash_arquivo': ','.join(job.hashes) or None}
+    # Jobs simultâneos leem em paralelo e gravam em fila, pela conexão de escrita
+    with conexao_escrita() as conn:
+        job.atualizar_progresso(fase='importando')
+        contagem = importar_blocos(
+            conn, lotes, job.modo, chunk_size,
+            progresso=lambda n: job.atualizar_progresso(linhas=n), carga=carga
+        )
+
+    processadas = sum(contagem.values())
+    tempo = time.time() - job.iniciado_em
+    linhas_por_segundo = processadas / tempo if tempo > 0 else 0
+    print(f"Importação concluída ({job.modo}): {processadas} linhas em {tempo:.2f}s ({linhas_por_segundo:.0f} linhas/s)")
+    if job.modo in ('sincronizar', 'inserir'):
+        resumo = f"{contagem['inseridos']} inseridas, {contagem['atualizados']} atualizadas, {contagem['inalterados']} inalteradas"
+    else:
+        resumo = f"{contagem['inseridos']} linhas inseridas"
+    job.resultado = {
+        'success': True,
+        'message': f'{descricao} {resumo} em {tempo:.2f}s ({linhas_por_segundo:.0f} linhas/s).'
+                   + (' Planilha já conhecida: leitura reaproveitada do cache.' if job.cache else ''),
+        **contagem,
+        'carga_id': carga['id'],
+        'cache': job.cache,
+        'abas': job.abas,
+        'tempo_segundos': round(tempo, 3),
+        'linhas_por_segundo': round(linhas_por_segundo, 1)
+    }
+    job.atualizar_progresso(fase='concluido', linhas=processadas)
+
+def hashes_em_uso(ignorar=None):
+    # Arquivos de jobs ainda em andamento não podem ser removidos
+    with _import_jobs_lock:
+        return {
+            h for j in _import_jobs.values()
+            if j is not ignorar and j.fase not in ('concluido', 'erro') for h in j.hashes
+        }
+
+def falha_importacao(job, caminhos, e):
+    # Tenta remover os arquivos se o processamento falhar (exceto os que outro job está usando)
+    em_uso = hashes_em_uso(ignorar=job)
+    for caminho in caminhos:
+        if os.path.exists(caminho) and os.path.basename(caminho).split('.', 1)[0] not in em_uso:
+            os.remove(caminho)
+    print(f"Erro detalhado no upload: {e}")
+    job.erro = f'Erro ao processar arquivo. Verifique se a planilha está no formato correto. Detalhe: {e}'
+    job.atualizar_progresso(fase='erro')
+
+def executar_importacao(job, save_path):
+    try:
+        job.atualizar_progresso(fase='preparando', total=estimar_linhas(save_path))
+        chunk_size = app.config['IMPORT_CHUNK_SIZE']
+        lotes, job.cache = lotes_do_arquivo(save_path, job.hashes[0], chunk_size)
+        gravar_importacao(job, lotes, chunk_size)
+    except Exception as e:
+        falha_importacao(job, [save_path], e)
+
+def executar_importacao_multipla(job, arquivos, todas_abas):
+    # arquivos: [(nome, hash, caminho)]. As abas são lidas em paralelo no pool de processos,
+    # cada uma para o seu snapshot; depois todos os snapshots vão ao banco em uma única carga.
+    try:
+        job.atualizar_progresso(fase='lendo_abas')
+        chunk_size = app.config['IMPORT_CHUNK_SIZE']
+        abas = []
+        for nome, hash_arquivo, caminho in arquivos:
+            nomes_abas = listar_abas(caminho)
+            if not todas_abas:
+                nomes_abas = nomes_abas[:1]
+            for indice, aba in enumerate(nomes_abas):
+                abas.append({
+                    'arquivo': nome, 'aba': aba, 'caminho': caminho,
+                    'snapshot': caminho_snapshot(hash_arquivo, indice)
+                })
+
+        futuros = {}
+        for info in abas:
+            if os.path.exists(info['snapshot']):
+                info.update(cache=True, ignorada=False, tempo_leitura_segundos=0)
+            else:
+                futuro = parse_executor().submit(preparar_aba, info['caminho'], info['aba'], info['snapshot'], chunk_size)
+                futuros[futuro] = info
+        for futuro in as_completed(futuros):
+            info = futuros[futuro]
+            info.update(futuro.result(), cache=False)
+            job.atualizar_progresso(total=sum(i.get('linhas') or 0 for i in abas))
+
+        job.abas = [
+            {k: v for k, v in info.items() if k not in ('caminho', 'snapshot')} for info in abas
+        ]
+        validas = [(info, publico) for info, publico in zip(abas, job.abas) if not info['ignorada']]
+        job.cache = bool(validas) and all(info['cache'] for info, _ in validas)
+
+        def lotes_da_aba(info, publico):
+            publico['linhas'] = 0
+            for colunas in ler_snapshot(info['snapshot'], chunk_size):
+                publico['linhas'] += len(colunas['status'])
+                yield colunas
+
+        lotes = chain.from_iterable(lotes_da_aba(info, publico) for info, publico in validas)
+        gravar_importacao(
+            job, lotes, chunk_size,
+            descricao=f'{len(validas)} aba(s) de {len(arquivos)} arquivo(s) processadas com sucesso.'
+        )
+    except Exception as e:
+        falha_importacao(job, [caminho for _, _, caminho in arquivos], e)
+
+# --------------------
+# Ingestão programática (API bulk)
+# --------------------
+# Nomes aceitos na API (em inglês, como nos clientes de integração) -> modo do motor de importação
+BULK_MODES = {'insert': 'inserir', 'append': 'adicionar', 'upsert': 'sincronizar'}
+
+def blocos_do_corpo(fluxo, tamanho=64 * 1024):
+    return iter(lambda: fluxo.read(tamanho), b'')
+
+def registros_ndjson(blocos):
+    # Um objeto JSON por linha; linhas vazias são ignoradas
+    decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+    resto = ''
+    numero = 0
+    for bloco in chain(blocos, [None]):
+        texto = resto + decodificador.decode(bloco or b'', final=bloco is None)
+        linhas = texto.split('\n')
+        resto = linhas.pop() if bloco is not None else ''
+        for linha in linhas:
+            numero += 1
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                yield numero, json.loads(linha)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'Linha {numero}: JSON inválido ({e.msg})')
+
+def registros_array_json(blocos):
+    # Decodifica um array JSON incrementalmente: só o registro corrente fica em memória
+    decoder = json.JSONDecoder()
+    decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+    estado = {'buffer': '', 'pos': 0, 'fim': False}
+
+    def ler_mais():
+        bloco = next(blocos, None)
+        estado['fim'] = bloco is None
+        estado['buffer'] = estado['buffer'][estado['pos']:] + decodificador.decode(bloco or b'', final=bloco is None)
+        estado['pos'] = 0
+        return not estado['fim']
+
+    def proximo_caractere():
+        while True:
+            buffer, pos = estado['buffer'], estado['pos']
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            estado['pos'] = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not ler_mais():
+                return None
+
+    if proximo_caractere() != '[':
+        raise ValueError('O corpo deve ser um array JSON ou NDJSON (um objeto por linha)')
+    estado['pos'] += 1
+    if proximo_caractere() == ']':
+        return
+    indice = 0
+    while True:
+        indice += 1
+        if proximo_caractere() is None:
+            raise ValueError(f'Registro {indice}: array JSON incompleto')
+        while True:
+            try:
+                registro, estado['pos'] = decoder.raw_decode(estado['buffer'], estado['pos'])
+                break
+            except json.JSONDecodeError as e:
+                # O registro pode estar cortado no fim do bloco lido: lê mais e tenta de novo
+                if estado['fim']:
+                    raise ValueError(f'Registro {indice}: JSON inválido ({e.msg})')
+                ler_mais()
+        yield indice, registro
+        separador = proximo_caractere()
+        if separador == ']':
+            return
+        if separador != ',':
+            raise ValueError(f'Registro {indice}: esperado "," ou "]" após o registro')
+        estado['pos'] += 1
+
+def ler_registros_json(fluxo):
+    # Detecta o formato pelo primeiro caractere do corpo: '[' é array JSON, o resto é NDJSON
+    blocos = blocos_do_corpo(fluxo)
+    primeiro = next(blocos, b'')
+    blocos = chain([primeiro], blocos)
+    if primeiro.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'['):
+        return registros_array_json(blocos)
+    return registros_ndjson(blocos)
+
+def lotes_de_registros(registros, tamanho_lote):
+    # Valida e normaliza os registros com as mesmas regras do upload (status, datas e valores).
+    # O mapeamento de campos é resolvido por lote: registros de um feed não precisam ter todos os campos.
+    while True:
+        lote = list(islice(registros, tamanho_lote))
+        if not lote:
+            return
+        for indice, registro in lote:
+            if not isinstance(registro, dict):
+                raise ValueError(f'Registro {indice}: esperado um objeto JSON')
+        df = pd.DataFrame.from_records([registro for _, registro in lote])
+        col_map = resolver_colunas(df.columns)
+        if not col_map:
+            raise ValueError(f'Registros {lote[0][0]}-{lote[-1][0]}: nenhum campo reconhecido. '
+                             f'Use os campos: {", ".join(IMPORT_COLUMNS)}')
+        yield normalizar_colunas(df, col_map)
+
+def lotes_em_disco(caminho):
+    # Lotes normalizados gravados em sequência com pickle (API bulk), lidos de volta um a um
+    with open(caminho, 'rb') as origem:
+        while True:
+            try:
+                yield pickle.load(origem)
+            except EOFError:
+                return
+
 # --------------------
 # Funções de Consulta e Exportação (Reutilizáveis)
 # --------------------
-def build_query_and_params(request_args, limit=None):
+def expressao_busca(busca):
+    # Converte o texto digitado em uma consulta FTS5: cada palavra vira uma frase com prefixo
+    # ("cot0-1" -> "cot0 1"*), todas obrigatórias. Aspas e operadores do usuário são neutralizados.
+    termos = []
+    for palavra in busca.split():
+        tokens = re.findall(r'\w+', palavra)
+        if tokens:
+            termos.append('"{}"*'.format(' '.join(tokens)))
+    return ' '.join(termos)
+
+def valores_filtro(request_args, nome):
+    # Seleção múltipla: o parâmetro pode vir repetido (status=A&status=B); vazios são ignorados
+    return list(dict.fromkeys(v.strip() for v in request_args.getlist(nome) if v.strip()))
+
+def data_filtro(request_args, nome):
+    texto = request_args.get(nome, '').strip()
+    if not texto:
+        return None
+    data = converter_data(texto)
+    if data is None or pd.isna(data):
+        raise ValueError(f'Data inválida em {nome}: {texto}')
+    return data.isoformat()
+
+def valor_filtro(request_args, nome):
+    texto = request_args.get(nome, '').strip()
+    if not texto:
+        return None
+    valor = converter_valores_serie(pd.Series([texto], dtype=object))[0]
+    if valor is None:
+        raise ValueError(f'Valor inválido em {nome}: {texto}')
+    return valor
+
+# Filtros por valor de dimensão (seleção múltipla): parâmetro -> coluna lógica.
+# Os nomes dos parâmetros são os mesmos das dimensões do catálogo (resumo_ordens).
+FILTROS_DIMENSAO = {
+    'status': 'status',
+    'status_cotacao': 'status_cotacao',
+    'produto': 'denominacao_produto',
+    'cliente': 'nome_emissor_ordem',
+}
+
+def filtros_consulta(request_args, fonte=ORDENS_VIEW):
+    # Origem (FROM) e filtros (WHERE) comuns à consulta, à exportação e à contagem.
+    # Devolve também a expressão FTS5, vazia quando não há busca textual.
+    # fonte: a view (registros com o texto das dimensões) ou a própria tabela, quando só se conta.
+    # Datas e valores inválidos levantam ValueError (400 nas rotas).
     busca = request_args.get('busca', '').strip()
-    status_filter = request_args.get('status', '').strip()
-    cotacao_filter = request_args.get('status_cotacao', '').strip()
+    data_inicio = data_filtro(request_args, 'data_inicio')
+    data_fim = data_filtro(request_args, 'data_fim')
+    valor_min = valor_filtro(request_args, 'valor_min')
+    valor_max = valor_filtro(request_args, 'valor_max')
+    carga = request_args.get('carga', '').strip()
+    if carga and not carga.isdigit():
+        raise ValueError(f'Carga inválida: {carga}')
+    expressao = expressao_busca(busca) if busca else ''
     
-    query = "SELECT * FROM ordens_servico WHERE 1=1"
-    params = []
-    
-    if busca:
-        query += " AND (nome_emissor_ordem LIKE ? OR descricao_operacao LIKE ?)"
-        param = f'%{busca}%'
-        params.extend([param, param])
+    # Os filtros comparam as chaves inteiras das dimensões (índices por *_id)
+    if expressao:
+        origem = (f"FROM {BUSCA_TABLE} JOIN {fonte} o ON o.id = {BUSCA_TABLE}.rowid "
+                  f"WHERE {BUSCA_TABLE} MATCH ?")
+        params = [expressao]
+    else:
+        origem = f"FROM {fonte} o WHERE 1=1"
+        params = []
         
-    if status_filter:
-        query += " AND status = ?"
-        params.append(status_filter)
-        
-    if cotacao_filter:
-        query += " AND status_cotacao = ?"
-        params.append(cotacao_filter)
+    for parametro, coluna in FILTROS_DIMENSAO.items():
+        valores = valores_filtro(request_args, parametro)
+        if valores:
+            origem += (f" AND o.{coluna}_id IN (SELECT id FROM {DIMENSOES[coluna]} "
+                       f"WHERE valor IN ({','.join('?' * len(valores))}))")
+            params.extend(valores)
+
+    # Intervalos fechados nas duas pontas; criado_em é gravado como AAAA-MM-DD
+    if data_inicio:
+        origem += " AND o.criado_em >= ?"
+        params.append(data_inicio)
+    if data_fim:
+        origem += " AND o.criado_em <= ?"
+        params.append(data_fim)
+    if valor_min is not None:
+        origem += " AND o.valor_pedido_bruto >= ?"
+        params.append(valor_min)
+    if valor_max is not None:
+        origem += " AND o.valor_pedido_bruto <= ?"
+        params.append(valor_max)
+    if carga:
+        origem += " AND o.carga_id = ?"
+        params.append(int(carga))
         
-    query += " ORDER BY id DESC"
+    return origem, params, busca if expressao else ''
+
+# Colunas auxiliares de ordenação da busca textual (chave do cursor; não fazem parte do registro)
+CHAVES_RELEVANCIA = ('_exato', '_relevancia')
+
+# Formatos de resposta da consulta: um objeto por linha, colunas + linhas ou um array por coluna
+FORMATOS_CONSULTA = ('registros', 'tabela', 'colunas')
+
+def campos_solicitados(request_args):
+    # fields=a,b,c -> lista validada (o id sempre vai junto: é a chave da linha e do cursor)
+    texto = request_args.get('fields', '').strip()
+    if not texto:
+        return None
+    campos = [c.strip() for c in texto.split(',') if c.strip()]
+    invalidos = [c for c in campos if c not in CAMPOS_CONSULTA]
+    if invalidos:
+        raise ValueError(f'Campos inválidos em fields: {", ".join(invalidos)}')
+    return ['id'] + [c for c in dict.fromkeys(campos) if c != 'id']
+
+def build_query_and_params(request_args, limit=None, apos=None, campos=None):
+    # apos: chave de ordenação da última linha da página anterior (paginação por keyset).
+    # Sem busca a chave é o id e a página N custa o mesmo que a primeira (descida direta no índice).
+    # Com busca a chave é (casamento exato, bm25, id), na mesma ordem do ORDER BY; o FTS5 não tem
+    # acesso ordenado por relevância, então toda página refaz o MATCH e pontua todos os casamentos.
+    # O cursor evita o OFFSET (pular as linhas anteriores): o custo cresce com o número de
+    # casamentos da busca, não com o número da página.
+    # campos: projeção levada ao SELECT (None = todas as colunas).
+    origem, params, busca = filtros_consulta(request_args)
+    selecao = ', '.join(f'o.{c}' for c in campos or CAMPOS_CONSULTA)
+
+    if busca:
+        # Busca pelo índice FTS5, ordenada por relevância (bm25 com pesos por coluna).
+        # Cotação ou circuito digitados por inteiro vêm antes dos que só começam com o termo.
+        pesos = ', '.join(str(peso) for _, peso in BUSCA_COLUMNS)
+        query = (f"SELECT * FROM (SELECT {selecao}, "
+                 f"IFNULL(o.numero_cotacao = ? OR o.numero_circuito = ?, 0) AS _exato, "
+                 f"bm25({BUSCA_TABLE}, {pesos}) AS _relevancia {origem}) WHERE 1=1")
+        params = [busca, busca] + params
+        if apos is not None:
+            exato, relevancia, ultimo_id = apos
+            query += " AND (_exato < ? OR (_exato = ? AND (_relevancia > ? OR (_relevancia = ? AND id < ?))))"
+            params.extend([exato, exato, relevancia, relevancia, ultimo_id])
+        query += " ORDER BY _exato DESC, _relevancia, id DESC"
+    else:
+        query = f"SELECT {selecao} {origem}"
+        if apos is not None:
+            query += " AND id < ?"
+            params.append(apos[0])
+        query += " ORDER BY id DESC"
     
     if limit:
-        query += f" LIMIT {limit}"
+        query += f" LIMIT {int(limit)}"
         
     return query, params
 
+def codificar_cursor(chave):
+    return base64.urlsafe_b64encode(json.dumps(chave).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodificar_cursor(token, busca):
+    # Token opaco para o cliente; o formato depende de haver busca textual ou não
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(chave, list) or len(chave) != (3 if busca else 1):
+        raise ValueError('Cursor inválido para os filtros informados')
+    return chave
+
+# Cache das contagens por (filtros, geração dos dados): qualquer escrita invalida tudo
+_contagem_cache = {}
+_contagem_cache_lock = threading.Lock()
+
+def contar_consulta(request_args, exato=False):
+    # Contagem exata com orçamento de tempo; se estourar (filtro muito amplo em base grande),
+    # estima a partir dos ids mais recentes e escala pelo total de linhas.
+    # Conta direto na tabela: nenhum filtro precisa do texto das dimensões.
+    origem, params, _ = filtros_consulta(request_args, 'ordens_servico')
+    chave = (origem, tuple(params), exato)
+    geracao = geracao_dados()
+    with _contagem_cache_lock:
+        em_cache = _contagem_cache.get(chave)
+    if em_cache and em_cache['geracao'] == geracao:
+        return dict(em_cache['resultado'], cache=True)
+
+    conn = get_db_connection()
+    try:
+        resultado = None
+        limite = time.time() + app.config['CONTAGEM_TEMPO_MAX']
+        if not exato:
+            conn.set_progress_handler(lambda: time.time() > limite, 10000)
+        try:
+            total = conn.execute(f"SELECT COUNT(*) {origem}", params).fetchone()[0]
+            resultado = {'total': total, 'exato': True}
+        except sqlite3.OperationalError as e:
+            if 'interrupted' not in str(e):
+                raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+        if resultado is None:
+            maior_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM ordens_servico").fetchone()[0]
+            corte = max(maior_id - app.config['CONTAGEM_AMOSTRA'], 0)
+            amostra = conn.execute("SELECT COUNT(*) FROM ordens_servico WHERE id > ?", (corte,)).fetchone()[0]
+            acertos = conn.execute(f"SELECT COUNT(*) {origem} AND o.id > ?", params + [corte]).fetchone()[0]
+            linhas = estimar_total_linhas(conn) or amostra
+            resultado = {'total': round(acertos / amostra * linhas) if amostra else 0, 'exato': False}
+    finally:
+        conn.close()
+
+    with _contagem_cache_lock:
+        if len(_contagem_cache) >= app.config['CONTAGEM_CACHE_ITENS']:
+            _contagem_cache.clear()
+        _contagem_cache[chave] = {'geracao': geracao, 'resultado': resultado}
+    return dict(resultado, cache=False)
+
+def estimar_total_linhas(conn):
+    # Total de linhas segundo as estatísticas do ANALYZE (primeiro número de sqlite_stat1)
+    linha = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = 'ordens_servico' LIMIT 1").fetchone()
+    return int(linha[0].split()[0]) if linha else None
+
+# Dimensões de agrupamento do relatório: expressão da chave na tabela, dimensão com o texto e rótulo do vazio.
+# A agregação roda no SQLite sobre as chaves inteiras; o texto entra só nas linhas de resultado.
+DIMENSOES_RELATORIO = {
+    'status': ('o.status_id', 'dim_status', 'Sem Status'),
+    'status_cotacao': ('o.status_cotacao_id', 'dim_status_cotacao', 'Sem Cotação'),
+    'produto': ('o.denominacao_produto_id', 'dim_produto', 'Sem Produto'),
+    'cliente': ('o.nome_emissor_ordem_id', 'dim_cliente', 'Sem Nome'),
+    'mes': ("strftime('%Y-%m', o.criado_em)", None, 'Sem Data'),
+}
+
+def catalogo_filtro(conn, campo, limite, prefixo=''):
+    # Valores em uso de uma dimensão com a quantidade de ordens. Campos pequenos (status) saem em ordem
+    # alfabética; com prefixo ou em campos grandes, os mais frequentes primeiro.
+    dimensao = DIMENSOES[FILTROS_DIMENSAO[campo]]
+    if prefixo:
+        # O prefixo dobrado percorre só a faixa do índice de chave_busca da dimensão; CROSS JOIN fixa essa
+        # ordem e o +d.id (sem afinidade) deixa a chave do resumo ser buscada pela chave primária
+        juncao = f"{dimensao} d CROSS JOIN resumo_ordens r ON r.dimensao = ? AND r.chave = +d.id"
+        filtro = " AND d.chave_busca >= ? AND d.chave_busca < ?"
+        dobrado = chave_busca(prefixo)
+        params = [campo, dobrado, dobrado + '\U0010ffff']
+    else:
+        juncao = f"resumo_ordens r JOIN {dimensao} d ON d.id = r.chave AND r.dimensao = ?"
+        filtro, params = '', [campo]
+    ordem = 'd.valor' if campo in ('status', 'status_cotacao') and not prefixo else 'r.linhas DESC, d.valor'
+    linhas = conn.execute(f"""
+        SELECT d.valor, r.linhas as quantidade
+        FROM {juncao}
+        WHERE d.valor != ''{filtro}
+        ORDER BY {ordem} LIMIT ?
+    """, params + [limite]).fetchall()
+    return [{'valor': row['valor'], 'quantidade': row['quantidade']} for row in linhas]
+
+def dimensoes_relatorio(request_args):
+    # agrupar=produto,mes ou agrupar=produto&agrupar=mes; a ordem define a ordem das colunas
+    nomes = [n.strip() for v in valores_filtro(request_args, 'agrupar') for n in v.split(',') if n.strip()]
+    nomes = list(dict.fromkeys(nomes)) or ['status', 'status_cotacao']
+    invalidas = [n for n in nomes if n not in DIMENSOES_RELATORIO]
+    if invalidas:
+        raise ValueError(f"Agrupamento inválido: {', '.join(invalidas)} (use {', '.join(DIMENSOES_RELATORIO)})")
+    return nomes
+
+def sql_relatorio(agrupamento, origem, params, limite):
+    # Contagem, soma e média por grupo lendo só as colunas do agrupamento e o valor (memória constante:
+    # o resultado tem uma linha por grupo, não por ordem)
+    chaves, rotulos, juncoes = [], [], []
+    for i, nome in enumerate(agrupamento):
+        expressao, dimensao, vazio = DIMENSOES_RELATORIO[nome]
+        chaves.append(f'{expressao} as g{i}')
+        if dimensao:
+            juncoes.append(f'LEFT JOIN {dimensao} d{i} ON d{i}.id = t.g{i}')
+            rotulos.append(f"IFNULL(d{i}.valor, '{vazio}') as {nome}")
+        else:
+            rotulos.append(f"IFNULL(t.g{i}, '{vazio}') as {nome}")
+    grupo = ', '.join(f'g{i}' for i in range(len(agrupamento)))
+    sql = f'''
+        SELECT {', '.join(rotulos)}, t.quantidade, t.total, t.media
+        FROM (SELECT {', '.join(chaves)}, COUNT(*) as quantidade, TOTAL(o.valor_pedido_bruto) as total,
+                     AVG(o.valor_pedido_bruto) as media
+              {origem} GROUP BY {grupo}) t
+        {' '.join(juncoes)}
+        ORDER BY {', '.join(agrupamento)}
+        LIMIT ?
+    '''
+    return sql, params + [limite]
+
+# Rótulo do período a partir de um dia AAAA-MM-DD (a semana é identificada pela sua segunda-feira)
+GRANULARIDADES_TIMELINE = {
+    'dia': '{dia}',
+    'semana': "date({dia}, '-6 days', 'weekday 1')",
+    'mes': 'substr({dia}, 1, 7)',
+    'trimestre': "substr({dia}, 1, 4) || '-T' || ((CAST(substr({dia}, 6, 2) AS INTEGER) + 2) / 3)",
+}
+
+# Filtros que o rollup diário (dia x status) não responde: com algum deles a série agrega ordens_servico
+FILTROS_FORA_DO_ROLLUP = ('busca', 'status_cotacao', 'produto', 'cliente', 'valor_min', 'valor_max', 'carga')
+
+def serie_timeline(conn, request_args, granularidade):
+    # Ordens e valor por período. Só com período e status a série sai de resumo_diario (uma linha por
+    # dia e status: três anos são ~1100 dias por status); com outros filtros, das linhas que passam neles.
+    periodo = GRANULARIDADES_TIMELINE[granularidade]
+    if not any(valores_filtro(request_args, nome) for nome in FILTROS_FORA_DO_ROLLUP):
+        condicoes, params = ["r.dia != ''"], []
+        data_inicio = data_filtro(request_args, 'data_inicio')
+        data_fim = data_filtro(request_args, 'data_fim')
+        status = valores_filtro(request_args, 'status')
+        if data_inicio:
+            condicoes.append("r.dia >= ?")
+            params.append(data_inicio)
+        if data_fim:
+            condicoes.append("r.dia <= ?")
+            params.append(data_fim)
+        if status:
+            condicoes.append(f"r.status_id IN (SELECT id FROM dim_status WHERE valor IN ({','.join('?' * len(status))}))")
+            params.extend(status)
+        sql = (f"SELECT {periodo.format(dia='r.dia')} as periodo, SUM(r.linhas) as quantidade, TOTAL(r.valor) as total "
+               f"FROM resumo_diario r WHERE {' AND '.join(condicoes)} GROUP BY 1 ORDER BY 1")
+        fonte = 'resumo_diario'
+    else:
+        origem, params, _ = filtros_consulta(request_args, 'ordens_servico')
+        sql = (f"SELECT {periodo.format(dia='date(o.criado_em)')} as periodo, COUNT(*) as quantidade, "
+               f"TOTAL(o.valor_pedido_bruto) as total {origem} AND date(o.criado_em) IS NOT NULL GROUP BY 1 ORDER BY 1")
+        fonte = 'ordens_servico'
+    return conn.execute(sql, params).fetchall(), fonte
+
+# --------------------
+# Cargas de importação (listar, desfazer e comparar)
+# --------------------
+def listar_cargas(limite):
+    # Linhas atuais de cada carga pelo índice de carga_id (cargas substituídas ficam com zero)
+    conn = get_db_connection()
+    try:
+        cargas = conn.execute(
+            "SELECT c.*, (SELECT COUNT(*) FROM ordens_servico WHERE carga_id = c.id) AS linhas_atuais "
+            "FROM cargas c ORDER BY c.id DESC LIMIT ?", (limite,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in cargas]
+
+def remover_carga(carga_id):
+    # Remove as linhas inseridas pela carga (DELETE pelo índice de carga_id). Atualizações feitas
+    # por ela em linhas de outras cargas (modo sincronizar) não são revertidas.
+    with conexao_escrita() as conn:
+        if conn.execute("SELECT 1 FROM cargas WHERE id = ?", (carga_id,)).fetchone() is None:
+            return None
+        cursor = conn.cursor()
+        atualizar_resumo(cursor, "WHERE o.carga_id = ?", (carga_id,), -1)
+        removidas = cursor.execute("DELETE FROM ordens_servico WHERE carga_id = ?", (carga_id,)).rowcount
+        conn.execute("UPDATE cargas SET status = 'desfeita' WHERE id = ?", (carga_id,))
+        remover_dimensoes_orfas(cursor)
+        conn.commit()
+        if removidas:
+            analisar_tabela(cursor)
+            conn.commit()
+    marcar_dados_alterados()
+    if removidas >= app.config['MANUTENCAO_LINHAS']:
+        agendar_manutencao('carga desfeita')
+    return removidas
+
+def chaves_da_carga(conn, carga_id):
+    # chave de negócio -> hash do conteúdo das linhas atuais da carga
+    chaves = app.config['SYNC_KEY_COLUMNS']
+    linhas = conn.execute(
+        f"SELECT {', '.join(chaves)}, hash_conteudo FROM {ORDENS_VIEW} WHERE carga_id = ? ORDER BY id", (carga_id,)
+    ).fetchall()
+    return {tuple(row[:-1]): row[-1] for row in linhas}
+
+def comparar_cargas(carga_a, carga_b, amostra):
+    # Compara as linhas atuais de duas cargas pela chave de negócio (SYNC_KEY_COLUMNS)
+    conn = get_db_connection()
+    try:
+        a = chaves_da_carga(conn, carga_a)
+        b = chaves_da_carga(conn, carga_b)
+    finally:
+        conn.close()
+    somente_a = [k for k in a if k not in b]
+    somente_b = [k for k in b if k not in a]
+    alteradas = [k for k in a if k in b and a[k] != b[k]]
+    chaves = app.config['SYNC_KEY_COLUMNS']
+
+    def bloco(lista):
+        return {'total': len(lista), 'amostra': [dict(zip(chaves, k)) for k in lista[:amostra]]}
+
+    return {
+        'carga_a': carga_a,
+        'carga_b': carga_b,
+        'chaves': chaves,
+        'somente_a': bloco(somente_a),
+        'somente_b': bloco(somente_b),
+        'alteradas': bloco(alteradas),
+        'iguais': len(a) - len(somente_a) - len(alteradas),
+    }
+
+# --------------------
+# Cache de respostas das rotas de leitura (geração dos dados + ETag)
+# --------------------
+class CacheRespostas:
+    # LRU limitado pela soma dos tamanhos. A chave começa pela geração dos dados: depois de uma
+    # escrita as entradas antigas ficam inalcançáveis e são descartadas na primeira gravação nova.
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._geracao = None
+        self._lock = threading.Lock()
+        self.estatisticas = {'acertos': 0, 'falhas': 0, 'descartes': 0}
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.estatisticas['falhas'] += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.estatisticas['acertos'] += 1
+            return item[0]
+
+    def guardar(self, chave, valor, tamanho):
+        geracao = chave[0]
+        with self._lock:
+            # Requisição que começou antes de uma escrita não grava resultado já vencido
+            if tamanho > self.limite_bytes or (self._geracao is not None and geracao < self._geracao):
+                return
+            if geracao != self._geracao:
+                self._itens.clear()
+                self._bytes = 0
+                self._geracao = geracao
+            if chave in self._itens:
+                self._bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (valor, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.limite_bytes:
+                _, (_, removido) = self._itens.popitem(last=False)
+                self._bytes -= removido
+                self.estatisticas['descartes'] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self.estatisticas, itens=len(self._itens), mb=round(self._bytes / (1024 * 1024), 2),
+                        limite_mb=round(self.limite_bytes / (1024 * 1024), 2), geracao=self._geracao)
+
+_respostas_cache = CacheRespostas(app.config['RESPOSTAS_CACHE_MB'] * 1024 * 1024)
+
+def argumentos_normalizados():
+    # Os mesmos parâmetros em outra ordem caem na mesma entrada; a ordem de valores repetidos é mantida
+    return tuple(sorted((nome, tuple(request.args.getlist(nome))) for nome in request.args))
+
+def resposta_condicional(corpo, mimetype='application/json', etag=None):
+    # ETag pelo conteúdo: If-None-Match igual devolve 304 sem corpo. no-cache faz o navegador
+    # guardar a resposta, mas sempre revalidar antes de reutilizá-la.
+    resposta = app.response_class(corpo, mimetype=mimetype)
+    resposta.set_etag(etag or hashlib.blake2b(corpo, digest_size=16).hexdigest())
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
+
+def cache_de_resposta(rota):
+    # Rotas de leitura: a resposta 200 fica em cache por (geração, rota, parâmetros) e sai com ETag.
+    # Erros e respostas em streaming passam direto.
+    @wraps(rota)
+    def rota_em_cache(*args, **kwargs):
+        chave = (geracao_dados(), request.endpoint, tuple(sorted(kwargs.items())), argumentos_normalizados())
+        item = _respostas_cache.obter(chave)
+        if item is None:
+            resposta = app.make_response(rota(*args, **kwargs))
+            if resposta.status_code != 200 or resposta.is_streamed:
+                return resposta
+            corpo = resposta.get_data()
+            item = (corpo, resposta.mimetype, hashlib.blake2b(corpo, digest_size=16).hexdigest())
+            _respostas_cache.guardar(chave, item, len(corpo))
+        return resposta_condicional(*item)
+    return rota_em_cache
+
 # --------------------
 # Rotas
 # --------------------
@@ -798,242 +3674,446 @@ def build_query_and_params(request_args, limit=None):
 def index():
     return render_template_string(HTML_TEMPLATE)
 
-@app.route('/api/dashboard')
-def dashboard_data():
-    conn = get_db_connection()
-    
-    # Métricas
-    total = conn.execute('SELECT COUNT(*) as total FROM ordens_servico').fetchone()['total']
-    concluidas = conn.execute("SELECT COUNT(*) as total FROM ordens_servico WHERE status = 'Concluído'").fetchone()['total']
-    pendentes = conn.execute("SELECT COUNT(*) as total FROM ordens_servico WHERE status = 'Pendente' OR status IS NULL OR status = 'Aberto' OR status = 'Em Andamento'").fetchone()['total']
-    valor_total = conn.execute('SELECT SUM(valor_pedido_bruto) as total FROM ordens_servico').fetchone()['total'] or 0
-    ultima_atualizacao = conn.execute('SELECT MAX(data_importacao) as data FROM ordens_servico').fetchone()['data'] or 'N/A'
+STATUS_PENDENTES = ('Pendente', 'Aberto', 'Em Andamento')
+
+def dashboard_do_resumo(conn):
+    # Sem filtros o dashboard lê só resumo_ordens: o custo depende do número de grupos, não de linhas
+    status_data = conn.execute('''
+        SELECT IFNULL(d.valor,"Sem Status") as status, d.valor as valor_status, r.linhas as count, r.valor
+        FROM resumo_ordens r LEFT JOIN dim_status d ON d.id = r.chave
+        WHERE r.dimensao = 'status' ORDER BY r.linhas DESC
+    ''').fetchall()
+    cotacao_data = conn.execute('''
+        SELECT IFNULL(d.valor,"Sem Cotação") as status_cotacao, t.total
+        FROM (SELECT chave, valor as total FROM resumo_ordens WHERE dimensao = 'status_cotacao'
+              ORDER BY valor DESC LIMIT 10) t
+        LEFT JOIN dim_status_cotacao d ON d.id = t.chave
+        ORDER BY t.total DESC
+    ''').fetchall()
+    timeline_data = conn.execute(
+        f"SELECT {GRANULARIDADES_TIMELINE['mes'].format(dia='dia')} as mes_ano, SUM(linhas) as count "
+        "FROM resumo_diario WHERE dia != '' GROUP BY 1 ORDER BY 1"
+    ).fetchall()
+    tops = {}
+    for dimensao, tabela, rotulo in (('cliente', 'dim_cliente', 'Sem Nome'), ('produto', 'dim_produto', 'Sem Produto')):
+        tops[dimensao] = conn.execute(f'''
+            SELECT IFNULL(d.valor,"{rotulo}") as nome, t.count
+            FROM (SELECT chave, linhas as count FROM resumo_ordens WHERE dimensao = ?
+                  ORDER BY linhas DESC LIMIT 10) t
+            LEFT JOIN {tabela} d ON d.id = t.chave
+            ORDER BY t.count DESC
+        ''', (dimensao,)).fetchall()
+    # MIN/MAX de coluna indexada é uma única busca em idx_ordens_data_importacao
+    ultima_atualizacao = conn.execute("SELECT MAX(data_importacao) FROM ordens_servico").fetchone()[0]
+    return {
+        'total': sum(row['count'] for row in status_data),
+        'concluidas': sum(row['count'] for row in status_data if row['valor_status'] == 'Concluído'),
+        'pendentes': sum(row['count'] for row in status_data
+                         if row['valor_status'] is None or row['valor_status'] in STATUS_PENDENTES),
+        # Somas e subtrações sucessivas deixam resíduo de ponto flutuante (e -0,00) sem o arredondamento
+        'valor_total': round(sum(row['valor'] for row in status_data), 2) or 0.0,
+        'ultima_atualizacao': ultima_atualizacao or 'N/A',
+        'status_data': status_data,
+        'cotacao_data': cotacao_data,
+        'timeline_data': timeline_data,
+        'top_clientes': tops['cliente'],
+        'top_produtos': tops['produto'],
+    }
+
+def dashboard_filtrado(conn, origem, params):
+    # Com filtros os agregados são calculados sobre as linhas que passam por eles
+    placeholders = ', '.join('?' * len(STATUS_PENDENTES))
+    dados = {
+        'total': conn.execute(f'SELECT COUNT(*) as total {origem}', params).fetchone()['total'],
+        'concluidas': conn.execute(f"SELECT COUNT(*) as total {origem} AND o.status_id = (SELECT id FROM dim_status WHERE valor = 'Concluído')", params).fetchone()['total'],
+        'pendentes': conn.execute(f"SELECT COUNT(*) as total {origem} AND (o.status_id IS NULL OR o.status_id IN (SELECT id FROM dim_status WHERE valor IN ({placeholders})))", params + list(STATUS_PENDENTES)).fetchone()['total'],
+        'valor_total': conn.execute(f'SELECT SUM(o.valor_pedido_bruto) as total {origem}', params).fetchone()['total'] or 0,
+        'ultima_atualizacao': conn.execute(f'SELECT MAX(o.data_importacao) as data {origem}', params).fetchone()['data'] or 'N/A',
+    }
     
+    # Agrupamentos pelas chaves inteiras; o texto vem da dimensão só para as linhas do resultado
     # Gráfico de Status
-    status_data = conn.execute('SELECT IFNULL(status,"Sem Status") as status, COUNT(*) as count FROM ordens_servico GROUP BY status ORDER BY count DESC').fetchall()
-    status_labels = [row['status'] for row in status_data]
-    status_values = [row['count'] for row in status_data]
+    dados['status_data'] = conn.execute(f'''
+        SELECT IFNULL(d.valor,"Sem Status") as status, t.count
+        FROM (SELECT o.status_id, COUNT(*) as count {origem} GROUP BY o.status_id) t
+        LEFT JOIN dim_status d ON d.id = t.status_id
+        ORDER BY t.count DESC
+    ''', params).fetchall()
     
     # Gráfico de Cotação
-    cotacao_data = conn.execute('''
-        SELECT IFNULL(status_cotacao,"Sem Cotação") as status_cotacao, SUM(IFNULL(valor_pedido_bruto,0)) as total 
-        FROM ordens_servico 
-        GROUP BY status_cotacao 
-        ORDER BY total DESC LIMIT 10
-    ''').fetchall()
-    cotacao_labels = [row['status_cotacao'] for row in cotacao_data]
-    cotacao_values = [row['total'] or 0 for row in cotacao_data]
+    dados['cotacao_data'] = conn.execute(f'''
+        SELECT IFNULL(d.valor,"Sem Cotação") as status_cotacao, t.total
+        FROM (SELECT o.status_cotacao_id, SUM(IFNULL(o.valor_pedido_bruto,0)) as total {origem}
+              GROUP BY o.status_cotacao_id ORDER BY total DESC LIMIT 10) t
+        LEFT JOIN dim_status_cotacao d ON d.id = t.status_cotacao_id
+        ORDER BY t.total DESC
+    ''', params).fetchall()
     
     # Timeline
-    timeline_data = conn.execute('''
-        SELECT strftime('%Y-%m', criado_em) as mes_ano, COUNT(*) as count 
-        FROM ordens_servico 
-        WHERE criado_em IS NOT NULL 
+    dados['timeline_data'] = conn.execute(f'''
+        SELECT strftime('%Y-%m', o.criado_em) as mes_ano, COUNT(*) as count 
+        {origem} AND o.criado_em IS NOT NULL 
         GROUP BY mes_ano ORDER BY mes_ano
-    ''').fetchall()
-    timeline_labels = [row['mes_ano'] for row in timeline_data]
-    timeline_values = [row['count'] for row in timeline_data]
+    ''', params).fetchall()
     
     # Top Clientes
-    top_clientes = conn.execute('''
-        SELECT IFNULL(nome_emissor_ordem,"Sem Nome") as nome_emissor_ordem, COUNT(*) as count 
-        FROM ordens_servico 
-        GROUP BY nome_emissor_ordem 
-        ORDER BY count DESC LIMIT 10
-    ''').fetchall()
+    dados['top_clientes'] = conn.execute(f'''
+        SELECT IFNULL(d.valor,"Sem Nome") as nome, t.count
+        FROM (SELECT o.nome_emissor_ordem_id, COUNT(*) as count {origem}
+              GROUP BY o.nome_emissor_ordem_id ORDER BY count DESC LIMIT 10) t
+        LEFT JOIN dim_cliente d ON d.id = t.nome_emissor_ordem_id
+        ORDER BY t.count DESC
+    ''', params).fetchall()
     
     # Top Produtos
-    top_produtos = conn.execute('''
-        SELECT IFNULL(denominacao_produto,"Sem Produto") as denominacao_produto, COUNT(*) as count 
-        FROM ordens_servico 
-        GROUP BY denominacao_produto 
-        ORDER BY count DESC LIMIT 10
-    ''').fetchall()
-    
-    conn.close()
+    dados['top_produtos'] = conn.execute(f'''
+        SELECT IFNULL(d.valor,"Sem Produto") as nome, t.count
+        FROM (SELECT o.denominacao_produto_id, COUNT(*) as count {origem}
+              GROUP BY o.denominacao_produto_id ORDER BY count DESC LIMIT 10) t
+        LEFT JOIN dim_produto d ON d.id = t.denominacao_produto_id
+        ORDER BY t.count DESC
+    ''', params).fetchall()
+    return dados
+
+@app.route('/api/dashboard')
+@cache_de_resposta
+def dashboard_data():
+    # Mesmos filtros da Consulta (período, faixa de valor, status múltiplos, busca) aplicados a todos os blocos
+    try:
+        origem, params, _ = filtros_consulta(request.args, 'ordens_servico')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    conn = get_db_connection()
+    try:
+        dados = dashboard_filtrado(conn, origem, params) if params else dashboard_do_resumo(conn)
+    finally:
+        conn.close()
     
+    valor_total = dados['valor_total']
+    ultima_atualizacao = dados['ultima_atualizacao']
     return jsonify({
         'metricas': {
-            'total': total,
-            'concluidas': concluidas,
-            'pendentes': pendentes,
+            'total': dados['total'],
+            'concluidas': dados['concluidas'],
+            'pendentes': dados['pendentes'],
             'valor_total': 'R$ {:,.2f}'.format(valor_total).replace(',', 'X').replace('.', ',').replace('X', '.'), # Formato BR
             'ultima_atualizacao': str(ultima_atualizacao)[:10] if ultima_atualizacao != 'N/A' else 'N/A'
         },
-        'status_chart': {'labels': status_labels, 'values': status_values},
-        'cotacao_chart': {'labels': cotacao_labels, 'values': cotacao_values},
-        'timeline_chart': {'labels': timeline_labels, 'values': timeline_values},
-        'top_clientes': [{'nome': row['nome_emissor_ordem'], 'count': row['count']} for row in top_clientes],
-        'top_produtos': [{'nome': row['denominacao_produto'], 'count': row['count']} for row in top_produtos]
+        'status_chart': {'labels': [row['status'] for row in dados['status_data']],
+                         'values': [row['count'] for row in dados['status_data']]},
+        'cotacao_chart': {'labels': [row['status_cotacao'] for row in dados['cotacao_data']],
+                          'values': [row['total'] or 0 for row in dados['cotacao_data']]},
+        'timeline_chart': {'labels': [row['mes_ano'] for row in dados['timeline_data']],
+                           'values': [row['count'] for row in dados['timeline_data']]},
+        'top_clientes': [{'nome': row['nome'], 'count': row['count']} for row in dados['top_clientes']],
+        'top_produtos': [{'nome': row['nome'], 'count': row['count']} for row in dados['top_produtos']]
+    })
+
+@app.route('/api/timeline')
+@cache_de_resposta
+def timeline():
+    # ?granularidade=dia|semana|mes|trimestre, com os mesmos filtros do dashboard
+    granularidade = request.args.get('granularidade', 'mes').strip().lower()
+    if granularidade not in GRANULARIDADES_TIMELINE:
+        return jsonify({'success': False, 'message': f"Granularidade inválida: {granularidade} "
+                                                     f"(use {', '.join(GRANULARIDADES_TIMELINE)})"}), 400
+    conn = get_db_connection()
+    try:
+        linhas, fonte = serie_timeline(conn, request.args, granularidade)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    finally:
+        conn.close()
+
+    return jsonify({
+        'granularidade': granularidade,
+        'fonte': fonte,
+        'labels': [row['periodo'] for row in linhas],
+        'values': [row['quantidade'] for row in linhas],
+        'totais': [row['total'] for row in linhas]
     })
 
 @app.route('/api/filtros')
+@cache_de_resposta
 def get_filtros():
+    # Catálogo de valores distintos com contagem, lido de resumo_ordens (mantido a cada carga):
+    # o custo é proporcional aos valores distintos, nunca às linhas.
+    # ?campo=cliente&prefixo=ac&limite=20 busca por prefixo em um campo de alta cardinalidade.
+    campo = request.args.get('campo', '').strip()
+    limite = min(max(request.args.get('limite', app.config['FILTROS_VALORES_MAX'], type=int), 1),
+                 app.config['FILTROS_VALORES_MAX'])
+    if campo and campo not in FILTROS_DIMENSAO:
+        return jsonify({'success': False, 'message': f"Campo inválido: {campo} (use {', '.join(FILTROS_DIMENSAO)})"}), 400
     conn = get_db_connection()
+    try:
+        if campo:
+            return jsonify({
+                'campo': campo,
+                'valores': catalogo_filtro(conn, campo, limite, request.args.get('prefixo', '').strip())
+            })
+        catalogo = {nome: catalogo_filtro(conn, nome, limite) for nome in FILTROS_DIMENSAO}
+        distintos = dict(conn.execute(
+            f"SELECT dimensao, COUNT(*) FROM resumo_ordens WHERE dimensao IN ({','.join('?' * len(FILTROS_DIMENSAO))}) "
+            "AND chave != 0 GROUP BY dimensao",
+            list(FILTROS_DIMENSAO)
+        ).fetchall())
+    finally:
+        conn.close()
     
-    # Obter todos os status únicos
-    status_data = conn.execute('SELECT DISTINCT status FROM ordens_servico WHERE status IS NOT NULL AND status != "" ORDER BY status').fetchall()
-    status_cotacao_data = conn.execute('SELECT DISTINCT status_cotacao FROM ordens_servico WHERE status_cotacao IS NOT NULL AND status_cotacao != "" ORDER BY status_cotacao').fetchall()
-    
-    conn.close()
-    
-    status_list = [row['status'] for row in status_data]
-    status_cotacao_list = [row['status_cotacao'] for row in status_cotacao_data]
-    
-    return jsonify({
-        'status': status_list,
-        'status_cotacao': status_cotacao_list
-    })
+    return jsonify(dict(catalogo, distintos={nome: distintos.get(nome, 0) for nome in FILTROS_DIMENSAO}))
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'})
-    file = request.files['file']
-    atualizar = request.form.get('atualizar', 'true') == 'true'
+    files = request.files.getlist('file')
+    modo = request.form.get('modo', '').strip().lower()
+    if not modo:
+        # Compatibilidade com clientes que enviam apenas atualizar=true/false
+        modo = 'substituir' if request.form.get('atualizar', 'true') == 'true' else 'adicionar'
+    todas_abas = request.form.get('todas_abas', 'false') == 'true'
     
-    if file.filename == '':
+    if any(file.filename == '' for file in files):
         return jsonify({'success': False, 'message': 'Arquivo sem nome'})
-    if not allowed_file(file.filename):
-        return jsonify({'success': False, 'message': 'Tipo de arquivo não suportado. Envie .xls ou .xlsx'})
+    if not all(allowed_file(file.filename) for file in files):
+        return jsonify({'success': False, 'message': 'Tipo de arquivo não suportado. Envie .xls, .xlsx, .csv, .parquet ou .ndjson'})
+    if modo not in IMPORT_MODES:
+        return jsonify({'success': False, 'message': f'Modo de importação inválido. Use: {", ".join(IMPORT_MODES)}'})
     
-    filename = secure_filename(file.filename)
-    save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(save_path)
+    arquivos = []
+    for file in files:
+        hash_arquivo, save_path = salvar_upload(file, file.filename.rsplit('.', 1)[1].lower())
+        arquivos.append((secure_filename(file.filename), hash_arquivo, save_path))
     
-    try:
-        # Lê com pandas
-        df = pd.read_excel(save_path, engine='openpyxl' if filename.lower().endswith('x') else None)
-        # Normalizar nomes das colunas para uppercase sem espaços extremos
-        df.columns = [str(c).strip() for c in df.columns]
-        
-        # Mapeamento de colunas aprimorado
-        col_map = {}
-        cols_upper = {str(c).upper(): c for c in df.columns}
-        
-        # Mapeamento de colunas do DB para as colunas do Excel
-        MAPPING_KEYS = {
-            'descricao_operacao': ['DESCR', 'DESCRI', 'OPERACAO'],
-            'status_cotacao': ['STATUS COT', 'STATUS_COT', 'STATUSCOTACAO', 'COTACAO STATUS'],
-            'status': ['STATUS'],
-            'denominacao_produto': ['PRODUTO', 'DENOMINACAO PRODUTO'],
-            'nome_emissor_ordem': ['CLIENTE', 'NOME', 'EMISSOR', 'NOME EMISSOR'],
-            'valor_pedido_bruto': ['VALOR', 'TOTAL', 'PRECO', 'VALOR PEDIDO'],
-            'criado_em': ['CRIADO', 'DATA', 'DATA CRIACAO'],
-            'numero_circuito': ['NUMERO CIRCUITO', 'CIRCUITO'],
-            'numero_cotacao': ['NUMERO COTACAO', 'COTACAO']
-        }
-        
-        for db_col, excel_keys in MAPPING_KEYS.items():
-            for key in excel_keys:
-                key_upper = key.upper()
-                if key_upper in cols_upper:
-                    col_map[db_col] = cols_upper[key_upper]
-                    break
-                # Heurística de substring
-                for col_name_upper, col_name_raw in cols_upper.items():
-                    if key_upper in col_name_upper:
-                        col_map[db_col] = col_name_raw
-                        break
-                if db_col in col_map:
-                    break
+    job = ImportJob(', '.join(nome for nome, _, _ in arquivos), modo, [h for _, h, _ in arquivos])
+    registrar_job(job)
+    if len(arquivos) == 1 and not todas_abas:
+        _import_executor.submit(executar_importacao, job, arquivos[0][2])
+    else:
+        _import_executor.submit(executar_importacao_multipla, job, arquivos, todas_abas)
+    aplicar_retencao_uploads(hashes_em_uso())
 
-        # Substitua por valores None onde não existam
-        def safe_get(row, key):
-            return row[col_map[key]] if (key in col_map and col_map[key] in row.index) else None
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'message': 'Arquivo recebido. A importação está em andamento.'
+    }), 202
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+@app.route('/api/jobs')
+def listar_jobs():
+    with _import_jobs_lock:
+        jobs = sorted(_import_jobs.values(), key=lambda j: j.criado_em, reverse=True)
+    return jsonify({'jobs': [j.to_dict() for j in jobs]})
 
-        if atualizar:
-            cursor.execute("DELETE FROM ordens_servico")
-            conn.commit()
+@app.route('/api/jobs/<job_id>')
+def status_job(job_id):
+    with _import_jobs_lock:
+        job = _import_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job não encontrado'}), 404
+    return jsonify(job.to_dict())
 
-        inserted = 0
-        for _, row in df.iterrows():
-            # Leitura segura:
-            descricao = safe_get(row, 'descricao_operacao')
-            status_raw = safe_get(row, 'status')
-            status = mapear_status(status_raw)
-            status_cot = safe_get(row, 'status_cotacao')
-            produto = safe_get(row, 'denominacao_produto')
-            cliente = safe_get(row, 'nome_emissor_ordem')
-            valor = safe_get(row, 'valor_pedido_bruto')
-            
-            # Normalizar valor
-            valor_num = None
-            if valor is not None and not pd.isna(valor):
+@app.route('/api/ordens/bulk', methods=['POST'])
+def ordens_bulk():
+    # Corpo em NDJSON ou array JSON, lido em streaming. Os lotes são normalizados fora do lock de
+    # escrita (um cliente lento não segura as importações) e guardados em um arquivo temporário; só a
+    # gravação roda com o lock, cada lote confirmado em sua própria transação. A resposta traz a
+    # vazão de cada lote.
+    modo_api = request.args.get('modo', 'append').strip().lower()
+    modo = BULK_MODES.get(modo_api)
+    if modo is None:
+        return jsonify({'success': False, 'message': f'Modo inválido. Use: {", ".join(BULK_MODES)}'}), 400
+    tamanho_lote = max(request.args.get('lote', app.config['BULK_BATCH_SIZE'], type=int), 1)
+
+    lotes_info = []
+    leituras = []
+    marcas = {}
+    anterior = {'inseridos': 0, 'atualizados': 0, 'inalterados': 0}
+
+    def lote_gravado(parcial):
+        agora = time.time()
+        linhas = sum(parcial.values()) - sum(anterior.values())
+        leitura = leituras[len(lotes_info)]
+        gravacao = agora - marcas['inicio']
+        lotes_info.append({
+            'lote': len(lotes_info) + 1,
+            'linhas': linhas,
+            **{k: parcial[k] - anterior[k] for k in parcial},
+            'leitura_segundos': round(leitura, 3),
+            'gravacao_segundos': round(gravacao, 3),
+            'linhas_por_segundo': round(linhas / (leitura + gravacao), 1) if leitura + gravacao > 0 else None
+        })
+        anterior.update(parcial)
+        marcas['inicio'] = agora
+
+    def lotes_lidos():
+        # O erro de leitura volta a ser levantado depois dos lotes válidos: a carga termina com o erro
+        yield from lotes_em_disco(temporario)
+        if erro is not None:
+            raise ValueError(erro)
+
+    inicio = time.time()
+    erro = None
+    carga = {'origem': 'bulk'}
+    temporario = os.path.join(app.config['UPLOAD_FOLDER'], f'.{uuid.uuid4().hex}.bulk.tmp')
+    try:
+        with open(temporario, 'wb') as destino:
+            try:
+                marca = time.time()
+                for colunas in lotes_de_registros(ler_registros_json(request.stream), tamanho_lote):
+                    pickle.dump(colunas, destino, protocol=pickle.HIGHEST_PROTOCOL)
+                    leituras.append(time.time() - marca)
+                    marca = time.time()
+            except ValueError as e:
+                # Os lotes válidos anteriores ao erro ainda são gravados (lotes_lidos)
+                erro = str(e)
+        if not leituras and erro is None:
+            # Corpo vazio (ou []) não registra carga
+            return jsonify({'success': False, 'message': 'Nenhum registro enviado.'}), 400
+        if leituras:
+            # A escrita é serializada com as importações de planilha
+            with conexao_escrita() as conn:
+                marcas['inicio'] = time.time()
                 try:
-                    valor_num = float(valor)
-                except:
-                    # Tenta remover caracteres não numéricos
-                    try:
-                        valor_str = str(valor).replace('R$', '').replace('.', '').replace(',', '.').strip()
-                        valor_num = float(valor_str)
-                    except:
-                        valor_num = None
-
-            criado_em_raw = safe_get(row, 'criado_em')
-            criado_em_dt = None
-            if criado_em_raw is not None and not pd.isna(criado_em_raw):
-                d = converter_data(criado_em_raw)
-                if d:
-                    criado_em_dt = d.isoformat()
-            
-            numero_circuito = safe_get(row, 'numero_circuito')
-            numero_cotacao = safe_get(row, 'numero_cotacao')
-
-            cursor.execute('''
-                INSERT INTO ordens_servico (
-                    descricao_operacao, numero_oportunidade, numero_vta,
-                    numero_cotacao, numero_circuito, status_cotacao,
-                    denominacao_produto, quantidade, status,
-                    valor_pedido_bruto, criado_em, emissor_ordem,
-                    nome_emissor_ordem, nome_gerente_contas, organizacao_vendas,
-                    canal_distribuicao, setor_atividade, item_sd,
-                    id_produto, tempo_contrato
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            ''', (
-                descricao, None, None,
-                numero_cotacao, numero_circuito, status_cot,
-                produto, None, status,
-                valor_num, criado_em_dt, None,
-                cliente, None, None,
-                None, None, None,
-                None, None
-            ))
-            inserted += 1
+                    importar_blocos(conn, lotes_lidos(), modo, app.config['IMPORT_CHUNK_SIZE'],
+                                    commit_por_lote=True, lote_gravado=lote_gravado, carga=carga)
+                except ValueError as e:
+                    erro = str(e)
+    finally:
+        os.remove(temporario)
 
-        conn.commit()
-        conn.close()
+    tempo = time.time() - inicio
+    processadas = sum(anterior.values())
+    resposta = {
+        'success': erro is None,
+        'modo': modo_api,
+        'carga_id': carga.get('id'),
+        **anterior,
+        'lotes': lotes_info,
+        'tempo_segundos': round(tempo, 3),
+        'linhas_por_segundo': round(processadas / tempo, 1) if tempo > 0 else 0
+    }
+    if erro is not None:
+        resposta['message'] = f'{erro}. {len(lotes_info)} lote(s) anteriores ao erro foram gravados.'
+        return jsonify(resposta), 400
+    print(f"Bulk concluído ({modo_api}): {processadas} registros em {tempo:.2f}s")
+    resposta['message'] = f'{processadas} registros processados em {len(lotes_info)} lote(s).'
+    return jsonify(resposta)
+
+@app.route('/api/cargas')
+@cache_de_resposta
+def listar_cargas_rota():
+    limite = min(max(request.args.get('limite', 100, type=int), 1), 1000)
+    return jsonify({'cargas': listar_cargas(limite)})
 
-        return jsonify({'success': True, 'message': f'Arquivo processado com sucesso. {inserted} linhas inseridas.'})
+@app.route('/api/cargas/<int:carga_id>', methods=['DELETE'])
+def desfazer_carga(carga_id):
+    try:
+        removidas = remover_carga(carga_id)
     except Exception as e:
-        # Tenta remover o arquivo se o processamento falhar
-        if os.path.exists(save_path):
-            os.remove(save_path)
-        print(f"Erro detalhado no upload: {e}")
-        return jsonify({'success': False, 'message': f'Erro ao processar arquivo. Verifique se a planilha está no formato correto. Detalhe: {e}'})
+        return jsonify({'success': False, 'message': f'Erro ao desfazer a carga: {e}'}), 500
+    if removidas is None:
+        return jsonify({'success': False, 'message': 'Carga não encontrada'}), 404
+    return jsonify({'success': True, 'removidas': removidas,
+                    'message': f'Carga {carga_id} desfeita: {removidas} linhas removidas.'})
+
+@app.route('/api/cargas/<int:carga_a>/comparar/<int:carga_b>')
+@cache_de_resposta
+def comparar_cargas_rota(carga_a, carga_b):
+    amostra = min(max(request.args.get('amostra', 50, type=int), 0), 1000)
+    return jsonify(comparar_cargas(carga_a, carga_b, amostra))
+
+def resposta_json(dados):
+    # Serialização compacta e sem ordenar chaves (jsonify ordena e indenta, caro em páginas grandes)
+    return app.response_class(json.dumps(dados, ensure_ascii=False, separators=(',', ':')),
+                              mimetype='application/json')
 
 @app.route('/api/consultar')
+@cache_de_resposta
 def consultar():
-    query, params = build_query_and_params(request.args, limit=1000)
+    # Uma página por requisição; o cliente segue proximo_cursor até ele vir nulo.
+    # O total de registros fica em /api/consultar/contagem, que pode ser cacheado à parte.
+    # fields= restringe as colunas no próprio SELECT; formato= escolhe o formato da resposta.
+    tamanho = request.args.get('tamanho', app.config['CONSULTA_PAGINA_PADRAO'], type=int)
+    tamanho = min(max(tamanho, 1), app.config['CONSULTA_PAGINA_MAX'])
+    formato = request.args.get('formato', 'registros')
+    if formato not in FORMATOS_CONSULTA:
+        return jsonify({'success': False, 'message': f'Formato inválido. Use: {", ".join(FORMATOS_CONSULTA)}'}), 400
+    apos = None
+    try:
+        busca = filtros_consulta(request.args)[2]
+        campos = campos_solicitados(request.args)
+        if request.args.get('cursor'):
+            apos = decodificar_cursor(request.args['cursor'], busca)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    # Uma linha a mais indica se existe próxima página sem precisar contar
+    query, params = build_query_and_params(request.args, limit=tamanho + 1, apos=apos, campos=campos)
     
     conn = get_db_connection()
-    rows = conn.execute(query, params).fetchall()
-    
-    results = []
-    for r in rows:
-        row_dict = {k: r[k] for k in r.keys()}
-        results.append(row_dict)
-        
+    cur = conn.execute(query, params)
+    colunas = [d[0] for d in cur.description]
+    rows = cur.fetchmany(tamanho + 1)
     conn.close()
-    return jsonify({'total': len(results), 'resultados': results})
+
+    tem_mais = len(rows) > tamanho
+    rows = rows[:tamanho]
+    proximo_cursor = None
+    if tem_mais:
+        ultima = dict(zip(colunas, rows[-1]))
+        chave = [ultima[c] for c in CHAVES_RELEVANCIA] + [ultima['id']] if busca else [ultima['id']]
+        proximo_cursor = codificar_cursor(chave)
+
+    visiveis = [i for i, c in enumerate(colunas) if c not in CHAVES_RELEVANCIA]
+    nomes = [colunas[i] for i in visiveis]
+    if len(visiveis) < len(colunas):
+        rows = [tuple(r[i] for i in visiveis) for r in rows]
+    else:
+        rows = [tuple(r) for r in rows]
+    resposta = {
+        'quantidade': len(rows),
+        'tamanho_pagina': tamanho,
+        'proximo_cursor': proximo_cursor
+    }
+    if formato == 'tabela':
+        resposta.update(colunas=nomes, linhas=rows)
+    elif formato == 'colunas':
+        resposta.update(colunas=nomes, valores=dict(zip(nomes, map(list, zip(*rows)))) if rows else {n: [] for n in nomes})
+    else:
+        resposta['resultados'] = [dict(zip(nomes, r)) for r in rows]
+    return resposta_json(resposta)
+
+@app.route('/api/consultar/contagem')
+@cache_de_resposta
+def consultar_contagem():
+    # Exata quando cabe no orçamento de tempo (ou com exato=1); senão estimada por amostragem
+    exato = request.args.get('exato', '').lower() in ('1', 'true')
+    try:
+        return jsonify(contar_consulta(request.args, exato=exato))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@app.route('/api/admin/consultas-lentas', methods=['GET', 'DELETE'])
+def consultas_lentas():
+    # Piores consultas do log, com o plano de execução e as tabelas varridas por inteiro
+    if request.method == 'DELETE':
+        with _consultas_lock:
+            _consultas_lentas.clear()
+        return jsonify({'success': True, 'message': 'Log de consultas lentas limpo'})
+    try:
+        limite = max(int(request.args.get('limite', 20)), 1)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limite deve ser um inteiro'}), 400
+    return jsonify(resumo_consultas_lentas(limite))
 
 @app.route('/api/exportar')
 def exportar():
     # Não aplica limite para exportação
-    query, params = build_query_and_params(request.args, limit=None)
+    try:
+        campos = campos_solicitados(request.args)
+        query, params = build_query_and_params(request.args, limit=None, campos=campos)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
     conn = get_db_connection()
     
@@ -1041,6 +4121,8 @@ def exportar():
     # Isso resolve o erro de "Número incorreto de associações fornecidas"
     try:
         df = pd.read_sql_query(query, conn, params=params)
+        # Colunas auxiliares da ordenação por relevância não vão para a planilha
+        df = df.drop(columns=[c for c in CHAVES_RELEVANCIA if c in df.columns])
     except Exception as e:
         conn.close()
         # Se houver erro na consulta (ex: sintaxe SQL inválida), retorna um erro amigável
@@ -1078,80 +4160,103 @@ def exportar():
     )
 
 @app.route('/api/relatorios')
+@cache_de_resposta
 def relatorios():
+    # Filtros da Consulta e agrupamento escolhido (agrupar=status,status_cotacao por padrão)
+    try:
+        origem, params, _ = filtros_consulta(request.args, 'ordens_servico')
+        agrupamento = dimensoes_relatorio(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    limite = app.config['RELATORIO_GRUPOS_MAX']
     conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM ordens_servico", conn)
-    conn.close()
-
-    total = len(df)
-    valor_total = df['valor_pedido_bruto'].sum() if 'valor_pedido_bruto' in df.columns and not df.empty else 0
-    ticket_medio = df['valor_pedido_bruto'].mean() if 'valor_pedido_bruto' in df.columns and total > 0 else 0
-
-    performance = []
-    if 'status' in df.columns and 'status_cotacao' in df.columns and not df.empty:
-        # Preenche NaN com strings para o agrupamento funcionar corretamente
-        df['status'] = df['status'].fillna('Sem Status')
-        df['status_cotacao'] = df['status_cotacao'].fillna('Sem Cotação')
-        
-        grouped = df.groupby(['status', 'status_cotacao'])
-        for (st, sc), g in grouped:
-            total_g = g['valor_pedido_bruto'].sum() if 'valor_pedido_bruto' in g.columns else 0
-            media_g = g['valor_pedido_bruto'].mean() if 'valor_pedido_bruto' in g.columns else 0
-            
-            performance.append({
-                'status': st,
-                'status_cotacao': sc,
-                'quantidade': int(len(g)),
-                'total': float(total_g) if pd.notna(total_g) else 0,
-                'media': float(media_g) if pd.notna(media_g) else 0
-            })
+    try:
+        metricas = conn.execute(
+            f"SELECT COUNT(*) as total, TOTAL(o.valor_pedido_bruto) as valor_total, "
+            f"AVG(o.valor_pedido_bruto) as ticket_medio {origem}", params
+        ).fetchone()
+        grupos = conn.execute(*sql_relatorio(agrupamento, origem, params, limite + 1)).fetchall()
+    finally:
+        conn.close()
 
+    performance = [
+        dict(zip(agrupamento, row[:len(agrupamento)]),
+             quantidade=row['quantidade'], total=row['total'], media=row['media'] or 0)
+        for row in grupos[:limite]
+    ]
     return jsonify({
         'metricas': {
-            'total': total,
-            'valor_total': float(valor_total) if pd.notna(valor_total) else 0,
-            'ticket_medio': float(ticket_medio) if pd.notna(ticket_medio) else 0
+            'total': metricas['total'],
+            'valor_total': metricas['valor_total'],
+            'ticket_medio': metricas['ticket_medio'] or 0
         },
-        'performance': performance
+        'agrupamento': agrupamento,
+        'performance': performance,
+        'grupos_truncados': len(grupos) > limite
     })
 
 @app.route('/api/configuracoes')
 def configuracoes():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    total_registros = cur.execute("SELECT COUNT(*) as c FROM ordens_servico").fetchone()['c']
-    tamanho_mb = 0
-    try:
-        tamanho_mb = round(os.path.getsize(DB_FILE) / (1024*1024), 2)
-    except:
+    # Só o que depende dos dados (contagem, colunas, estatísticas do arquivo): fica em cache pela
+    # geração e pelas execuções da manutenção, que mexem no arquivo sem alterar dados, e o ETag
+    # permanece o mesmo entre elas. O estado ao vivo fica em /api/configuracoes/estado.
+    chave = (geracao_dados(), 'configuracoes', estado_manutencao()['execucoes'])
+    dados = _respostas_cache.obter(chave)
+    if dados is None:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        total_registros = cur.execute("SELECT COUNT(*) as c FROM ordens_servico").fetchone()['c']
         tamanho_mb = 0
+        try:
+            tamanho_mb = round(os.path.getsize(DB_FILE) / (1024*1024), 2)
+        except:
+            tamanho_mb = 0
+
+        # Colunas esperadas (para instrução ao usuário)
+        colunas_esperadas = [
+            'descricao_operacao','numero_cotacao','numero_circuito','status_cotacao',
+            'denominacao_produto','valor_pedido_bruto','criado_em','nome_emissor_ordem',
+            'status' # Adicionado status para clareza
+        ]
         
-    # Colunas esperadas (para instrução ao usuário)
-    colunas_esperadas = [
-        'descricao_operacao','numero_cotacao','numero_circuito','status_cotacao',
-        'denominacao_produto','valor_pedido_bruto','criado_em','nome_emissor_ordem',
-        'status' # Adicionado status para clareza
-    ]
-    
-    # Colunas reais no DB
-    df = pd.read_sql_query("SELECT * FROM ordens_servico LIMIT 1", conn)
-    conn.close()
-    colunas_reais = df.columns.tolist() if not df.empty else []
+        # Colunas reais no DB
+        df = pd.read_sql_query(f"SELECT {', '.join(CAMPOS_CONSULTA)} FROM {ORDENS_VIEW} LIMIT 1", conn)
+        armazenamento = estatisticas_armazenamento(conn)
+        conn.close()
+        colunas_reais = df.columns.tolist() if not df.empty else []
+        dados = {
+            'total_registros': total_registros,
+            'tamanho_mb': tamanho_mb,
+            'colunas_esperadas': colunas_esperadas,
+            'colunas': ', '.join(colunas_reais) if colunas_reais else 'Sem registros',
+            'armazenamento': armazenamento
+        }
+        _respostas_cache.guardar(chave, dados, len(json.dumps(dados)))
     
+    return resposta_condicional(jsonify(dados).get_data())
+
+@app.route('/api/configuracoes/estado')
+def configuracoes_estado():
+    # Conexões, manutenção e o próprio cache de respostas mudam a cada requisição: sem cache nem ETag
     return jsonify({
-        'total_registros': total_registros,
-        'tamanho_mb': tamanho_mb,
-        'colunas_esperadas': colunas_esperadas,
-        'colunas': ', '.join(colunas_reais) if colunas_reais else 'Sem registros'
+        'conexoes': estatisticas_conexoes(),
+        'manutencao': estado_manutencao(),
+        'cache_respostas': _respostas_cache.to_dict()
     })
 
+@app.route('/api/manutencao', methods=['POST'])
+def manutencao():
+    # Dispara a manutenção agora (em segundo plano); o resultado aparece em /api/configuracoes/estado
+    agendar_manutencao('manual')
+    return jsonify({'success': True, 'message': 'Manutenção agendada.', 'manutencao': estado_manutencao()}), 202
+
 @app.route('/api/limpar', methods=['POST'])
 def limpar():
     try:
-        conn = get_db_connection()
-        conn.execute("DELETE FROM ordens_servico")
-        conn.commit()
-        conn.close()
+        with conexao_escrita() as conn:
+            truncar_ordens(conn)
+        marcar_dados_alterados()
+        agendar_manutencao('limpeza')
         return jsonify({'success': True, 'message': 'Todos os dados foram apagados!'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao limpar dados: {e}'})
@@ -1159,7 +4264,29 @@ def limpar():
 # --------------------
 # Run
 # --------------------
+_iniciado = False
+_iniciar_lock = threading.Lock()
+
+def iniciar():
+    # Banco (migrações) e thread de manutenção. Não roda no import: os processos do pool de leitura
+    # (spawn) reimportam este módulo e só usam as funções de leitura e normalização.
+    global _iniciado
+    with _iniciar_lock:
+        if not _iniciado:
+            if not init_database():
+                with _manutencao_lock:
+                    _manutencao_estado['conversao_vacuo'] = {'fase': 'pendente'}
+                agendar_manutencao('conversão para vácuo incremental')
+            iniciar_manutencao()
+            _iniciado = True
+
+@app.before_request
+def garantir_iniciado():
+    # Servidores WSGI importam o módulo sem passar pelo __main__
+    if not _iniciado:
+        iniciar()
+
 if __name__ == '__main__':
     # Garante que o DB está inicializado antes de rodar o app
-    init_database() 
+    iniciar()
     app.run(debug=True, host='0.0.0.0', port=5000)